@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import update, case, or_, func
+
+from database import AsyncSessionLocal
+import models as models
+
+# --- AYARLAR ---
+ACTIVITY_FLUSH_SECONDS = int(os.getenv("ACTIVITY_FLUSH_SECONDS", "30"))
+ACTIVITY_FLUSH_CHUNK = 1000  # Tek UPDATE'teki IN listesi
+
+
+def effective_streak(streak: Optional[int], last_active_date: Optional[date], today: date) -> int:
+    # Kullanıcı bugün aktif sayılırsa görünen seri (DB'ye yazılmış olsun olmasın aynı sonuç)
+    if last_active_date == today: return streak or 0
+    if last_active_date == today - timedelta(days=1): return (streak or 0) + 1
+    return 1
+
+
+class ActivityTracker:
+    """
+    "Kullanıcı şu gün aktif" işaretlerini bellekte toplar, aralıklarla toplu UPDATE ile yazar.
+    /profil sadece okur; seri, yazılmış durum + bekleyen işaretten hesaplanır.
+    Cache'teki principal bayat kalsa da görünen seri değişmez, tekrar işaret 0 satırlık UPDATE olur.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._pending = {}   # user_id -> {aktif günler} (gece yarısını geçen işaretler ayrı gün olarak kalır)
+        self._lock = threading.Lock()
+        self.marked = 0
+        self.flushed_users = 0
+        self.updated_rows = 0
+        self.last_flush_seconds = 0.0
+
+    def mark(self, user_id: int, last_active_date: Optional[date], today: Optional[date] = None):
+        today = today or date.today()
+        if last_active_date == today: return  # Bugün zaten yazılmış
+        with self._lock:
+            days = self._pending.setdefault(user_id, set())
+            if today not in days:
+                days.add(today)
+                self.marked += 1
+
+    def streak(self, user_id: int, streak: Optional[int], last_active_date: Optional[date], today: Optional[date] = None) -> int:
+        # Yazılmış durumun üstüne bekleyen günleri sırayla uygula, bugün de aktif say
+        today = today or date.today()
+        with self._lock:
+            days = sorted(d for d in self._pending.get(user_id, ()) if last_active_date is None or d > last_active_date)
+        for day in days + ([today] if today not in days else []):
+            streak, last_active_date = effective_streak(streak, last_active_date, day), day
+        return streak or 0
+
+    def start(self, scheduler, interval: int = ACTIVITY_FLUSH_SECONDS):
+        scheduler.add_job(self.flush, "interval", seconds=interval, id="activity-flush", max_instances=1, coalesce=True)
+
+    async def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending: return
+        started = time.perf_counter()
+
+        by_day = {}
+        for user_id, days in pending.items():
+            for day in days: by_day.setdefault(day, []).append(user_id)
+        try:
+            async with self.session_factory() as db:
+                # Eski gün önce: dünün UPDATE'i bugününkünün seri hesabına girer
+                for day in sorted(by_day):
+                    user_ids = sorted(by_day[day])
+                    for i in range(0, len(user_ids), ACTIVITY_FLUSH_CHUNK):
+                        result = await db.execute(self._streak_update(day, user_ids[i:i + ACTIVITY_FLUSH_CHUNK]))
+                        self.updated_rows += result.rowcount
+                await db.commit()
+        except Exception as e:
+            print(f"Aktivite Flush Hata: {e}")
+            with self._lock:
+                for user_id, days in pending.items():
+                    self._pending.setdefault(user_id, set()).update(days)  # Yazılamayanları geri koy
+            return
+
+        self.flushed_users += len(pending)
+        self.last_flush_seconds = time.perf_counter() - started
+
+    @staticmethod
+    def _streak_update(day: date, user_ids: list):
+        # Seri hesabı SQL'de: birden fazla worker aynı kullanıcıyı işaretlese de sonuç aynı
+        users = models.User
+        return (update(users)
+                .where(users.id.in_(user_ids), or_(users.last_active_date.is_(None), users.last_active_date < day))
+                .values(streak=case((users.last_active_date == day - timedelta(days=1), func.coalesce(users.streak, 0) + 1), else_=1),
+                        last_active_date=day)
+                .execution_options(synchronize_session=False))
+
+    def stats(self):
+        return {"pending_users": len(self._pending), "marked": self.marked, "flushed_users": self.flushed_users,
+                "updated_rows": self.updated_rows, "last_flush_seconds": self.last_flush_seconds}
+
+
+activity_tracker = ActivityTracker()
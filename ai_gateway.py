@@ -0,0 +1,168 @@
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+
+from metrics import metrics, caller_name, prompt_size, estimate_tokens
+
+# --- AYARLAR ---
+DEFAULT_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))   # Aynı anda Gemini'ye giden en fazla istek
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))              # Sırada bekleyebilecek en fazla istek
+AI_QUEUE_WAIT_SECONDS = float(os.getenv("AI_QUEUE_WAIT_SECONDS", "2"))
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "30"))
+
+
+def prompt_tokens(contents) -> int:
+    # Metin kısımlarının tahmini; resimler (bayt) sayılmaz, onların sayısı cevaptan gelir
+    if isinstance(contents, str): return estimate_tokens(contents)
+    if isinstance(contents, (list, tuple)): return sum(prompt_tokens(c) for c in contents)
+    return 0
+
+def reported_prompt_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return int(getattr(usage, "prompt_token_count", 0) or 0)
+
+
+class AIGateway:
+    """
+    Tüm AI endpointlerinin geçtiği ortak kapı.
+    Model nesnelerini yeniden kullanır, eşzamanlı çağrı sayısını sınırlar,
+    kuyruk dolunca beklemek yerine hemen 503 döner.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 max_queue: int = AI_MAX_QUEUE, queue_wait: float = AI_QUEUE_WAIT_SECONDS,
+                 timeout: float = AI_TIMEOUT_SECONDS):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_wait = queue_wait
+        self.timeout = timeout
+        self.enabled = False
+        self._api_key = None
+        self._genai = None   # google.generativeai: ~1 sn'lik import, ilk kullanımda (ya da warm() ile arka planda)
+        self._sdk_lock = threading.Lock()
+        self._models = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        self.quota = None   # async func(): modelin ortak bütçesi (rate_limit), aşılırsa 503 fırlatır
+
+    def configure(self, api_key: Optional[str], model_name: Optional[str] = None):
+        # SDK'yı yüklemez; anahtar ilk model oluşturulurken verilir
+        if model_name: self.model_name = model_name
+        self._api_key = api_key or None
+        self.enabled = bool(api_key)
+
+    def sdk(self):
+        if self._genai is None:
+            with self._sdk_lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self._api_key)
+                    self._genai = genai
+        return self._genai
+
+    async def warm(self):
+        # Açılıştan sonra arka planda: ilk AI isteği import beklemesin, açılış da SDK'yı beklemesin
+        if not self.enabled: return
+        try: await asyncio.to_thread(self.sdk)
+        except Exception as e: print(f"🚨 API Başlatma Hatası: {e}")
+
+    def get_model(self, model_name: Optional[str] = None):
+        name = model_name or self.model_name
+        model = self._models.get(name)
+        if model is None:
+            model = self.sdk().GenerativeModel(name)
+            self._models[name] = model
+        return model
+
+    async def model(self, model_name: Optional[str] = None):
+        # İstek yolundan: model hazır değilse (soğuk worker, yeni model adı) SDK importu ve kurulum thread'de
+        return self._models.get(model_name or self.model_name) or await asyncio.to_thread(self.get_model, model_name)
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()  # Boş yer var, beklemeden döner
+        else:
+            # Kuyruk doluysa bekletme, hemen reddet (backpressure)
+            if self._waiting >= self.max_queue:
+                raise HTTPException(status_code=503, detail="AI şu an çok yoğun, birazdan tekrar dene.", headers={"Retry-After": "5"})
+
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_wait)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="AI şu an çok yoğun, birazdan tekrar dene.", headers={"Retry-After": "5"})
+            finally:
+                self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def generate(self, contents, model_name: Optional[str] = None, timeout: Optional[float] = None,
+                       caller: Optional[str] = None, generation_config: Optional[dict] = None) -> str:
+        # caller: metrik etiketi, verilmezse çağıran fonksiyonun adı
+        # generation_config: ör. {"response_mime_type": "application/json", "response_schema": {...}} (yapılandırılmış çıktı)
+        caller = caller or caller_name()
+        model = await self.model(model_name)
+        if self.quota: await self.quota()
+        async with self.slot():
+            with metrics.ai_call(caller, "generate", prompt_size(contents), prompt_tokens(contents)) as usage:
+                try:
+                    response = await asyncio.wait_for(model.generate_content_async(contents, generation_config=generation_config),
+                                                      timeout=timeout or self.timeout)
+                except asyncio.TimeoutError:
+                    raise HTTPException(status_code=504, detail="AI zamanında cevap vermedi.")
+                text = response.text
+                usage[0] = len(text)
+                usage[1] = reported_prompt_tokens(response) or usage[1]
+        return text
+
+    async def stream(self, contents, model_name: Optional[str] = None, timeout: Optional[float] = None,
+                     caller: Optional[str] = None):
+        """
+        Parçaları geldikçe verir. Slot ilk parça istenince alınır, akış bitince bırakılır.
+        Tüketici yarıda bırakırsa aclose() çağırmalı (contextlib.aclosing), yoksa slot GC'ye kadar tutulur.
+        """
+        caller = caller or caller_name()
+        model = await self.model(model_name)
+        timeout = timeout or self.timeout
+        if self.quota: await self.quota()
+        async with self.slot():
+            with metrics.ai_call(caller, "stream", prompt_size(contents), prompt_tokens(contents)) as usage:
+                try:
+                    response = await asyncio.wait_for(model.generate_content_async(contents, stream=True), timeout=timeout)
+                    chunks = response.__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                            except StopAsyncIteration:
+                                break
+                            usage[1] = reported_prompt_tokens(chunk) or usage[1]  # Sayı genelde son parçada gelir
+                            try: text = chunk.text
+                            except ValueError: continue  # Metin içermeyen (ör. sadece finish_reason) parça
+                            if text:
+                                usage[0] += len(text)
+                                yield text
+                    finally:
+                        # Akış yarıda bırakıldıysa (aclose) SDK'nın bağlantısı da kapansın
+                        if hasattr(chunks, "aclose"): await chunks.aclose()
+                except asyncio.TimeoutError:
+                    raise HTTPException(status_code=504, detail="AI zamanında cevap vermedi.")
+
+    def stats(self):
+        return {"in_flight": self._in_flight, "waiting": self._waiting, "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+
+
+gateway = AIGateway()
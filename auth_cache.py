@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from database import AsyncSessionLocal
+from xp_ledger import pending_xp
+from delta_sync import sync_version
+import models as models
+
+# --- AYARLAR ---
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+
+# UserTarget ile aynı alan adları: user.target kullanan kod principal.target ile de çalışır
+@dataclass(frozen=True)
+class PrincipalTarget:
+    ranking: Optional[str]
+    dream_university: Optional[str]
+    dream_department: Optional[str]
+    current_tyt_net: float
+    target_tyt_net: float
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Token sahibinin salt okunur özeti. Sadece kimlik isteyen route'lar DB'ye gitmez."""
+    id: int
+    username: str
+    is_active: bool
+    xp: int
+    streak: int
+    last_active_date: Optional[date]
+    target: Optional[PrincipalTarget]
+    sync_version: int = 0   # user_sync_versions sayacı (ETag'ler ve /sync için)
+
+    @classmethod
+    def from_user(cls, user: models.User, pending_xp: int = 0, version: Optional[int] = None) -> "Principal":
+        # xp: users.xp + henüz işlenmemiş XP olayları; version verilmezse eski users.sync_version'a düşülür
+        t = user.target
+        target = PrincipalTarget(t.ranking, t.dream_university, t.dream_department,
+                                 t.current_tyt_net or 0.0, t.target_tyt_net or 0.0) if t else None
+        return cls(user.id, user.username, bool(user.is_active), (user.xp or 0) + int(pending_xp or 0), user.streak or 0, user.last_active_date, target,
+                   (version if version is not None else user.sync_version) or 0)
+
+
+class PrincipalCache:
+    """Token subject'ine (username) göre kısa TTL'li, boyutu sınırlı LRU."""
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES,
+                 session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self._data = OrderedDict()  # username -> (expires_at, Principal)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            item = self._data.get(username)
+            if item is not None and item[0] >= time.monotonic():
+                self._data.move_to_end(username)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        principal = await self._load(username)
+        if principal is not None: self.put(principal)
+        return principal
+
+    async def _load(self, username: str) -> Optional[Principal]:
+        async with self.session_factory() as db:
+            result = await db.execute(select(models.User, pending_xp(models.User.id), sync_version(models.User.id))
+                                      .options(joinedload(models.User.target)).where(models.User.username == username))
+            row = result.first()
+            return Principal.from_user(*row) if row else None
+
+    def put(self, principal: Principal):
+        if self.ttl <= 0: return
+        with self._lock:
+            self._data[principal.username] = (time.monotonic() + self.ttl, principal)
+            self._data.move_to_end(principal.username)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, username: str):
+        # Hesap silme, doğrulama, XP/hedef/streak değişikliklerinden sonra çağrılır
+        with self._lock:
+            self._data.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "size": len(self._data)}
+
+
+principal_cache = PrincipalCache()
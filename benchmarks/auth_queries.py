@@ -0,0 +1,83 @@
+"""
+/profil, /gorevler ve /istatistikler için istek başına SQL sorgu sayısını ölçer.
+
+Kullanım (repo kökünden):
+    python benchmarks/auth_queries.py --requests 200
+
+Geçici bir SQLite veritabanı kullanır, Gemini/SMTP'ye bağlanmaz.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ["GOOGLE_API_KEY"] = ""
+os.environ["MAIL_USERNAME"] = ""
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")  # Bu ölçümde bcrypt havuzu gereksiz
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+
+import main
+import models
+from database import SessionLocal, async_engine, sync_schema
+
+sync_schema()  # Lifespan çalışmıyor; şema açıkça
+
+ROUTES = ["/profil", "/gorevler", "/istatistikler"]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(async_engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def create_user(client: TestClient) -> dict:
+    client.post("/register", json={
+        "username": "bench", "email": "bench@example.com", "password": "bench-pw",
+        "targets": {"dream_university": "ODTÜ", "dream_department": "Bilgisayar", "current_tyt_net": 60, "target_tyt_net": 100},
+    })
+    db = SessionLocal()
+    user = db.query(models.User).filter(models.User.username == "bench").first()
+    code = user.verification_code
+    for i in range(20):
+        db.add(models.Todo(user_id=user.id, content=f"Görev {i}"))
+        db.add(models.ExamResult(user_id=user.id, exam_name=f"D{i}", tyt_turkce=30, tyt_sosyal=15, tyt_mat=20, tyt_fen=10,
+                                 tyt_net=75, ayt_net=40, topic_mistakes={"Türev": i}))
+    db.commit()
+    db.close()
+    client.post("/verify", json={"email": "bench@example.com", "code": code})
+    token = client.post("/token", data={"username": "bench", "password": "bench-pw"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def main_bench(requests: int) -> dict:
+    client = TestClient(main.app)
+    headers = create_user(client)
+    counter = QueryCounter()
+    results = {}
+    for route in ROUTES:
+        client.get(route, headers=headers)  # Isınma (ilk çağrı cache'i doldurur, günlük streak yazılır)
+        before = counter.count
+        for _ in range(requests):
+            assert client.get(route, headers=headers).status_code == 200
+        results[route] = (counter.count - before) / requests
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps({"queries_per_request": main_bench(args.requests)}, indent=2))
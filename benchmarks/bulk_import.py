@@ -0,0 +1,92 @@
+"""
+/deneme-ice-aktar toplu içe aktarmasını ölçer: süre, satır/sn, SQL sorgu sayısı ve tepe bellek.
+
+Kullanım (repo kökünden):
+    python benchmarks/bulk_import.py --rows 500 5000
+    python benchmarks/bulk_import.py --rows 5000 --format jsonl --topics 80
+    DATABASE_URL=postgresql://... python benchmarks/bulk_import.py --rows 5000
+
+DATABASE_URL verilmezse geçici bir SQLite veritabanı kullanılır. Dosya içe aktarıcıya
+doğrudan verilir (HTTP/multipart ölçülmez), AI yorum işleri kuyruğa yazılır ama çalıştırılmaz.
+Bellek tracemalloc ile içe aktarma süresince ölçülür: satır sayısıyla büyümemeli.
+Her ölçüm kendi transaction'ında yapılır ve geri alınır (kullanıcının geçmişi büyümez).
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+parser.add_argument("--rows", type=int, nargs="+", default=[500, 5000])
+parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+parser.add_argument("--topics", type=int, default=40, help="dosyadaki farklı konu sayısı")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.abspath(args.root))
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ["GOOGLE_API_KEY"] = ""
+os.environ["IMPORT_MAX_ROWS"] = str(max(args.rows))
+os.environ["IMPORT_MAX_BYTES"] = str(max(args.rows) * 200)
+
+from sqlalchemy import event
+
+import main
+import models
+from database import SessionLocal, AsyncSessionLocal, async_engine, sync_schema
+
+sync_schema()  # Lifespan çalıştırılmıyor; şema açıkça
+
+
+def build_file(rows: int) -> io.BytesIO:
+    if args.format == "csv":
+        lines = ["exam_name,tyt_turkce,tyt_sosyal,tyt_mat,tyt_fen,ayt_net,yanlis_konular,tarih"]
+        lines += [f"D{i},30.5,15,20,10,40,Türev:2|K{i % args.topics}:1,2026-{1 + i % 9:02d}-{1 + i % 27:02d}T10:00:00" for i in range(rows)]
+    else:
+        lines = [json.dumps({"exam_name": f"D{i}", "tyt_turkce": 30.5, "tyt_sosyal": 15, "tyt_mat": 20, "tyt_fen": 10, "ayt_net": 40,
+                             "yanlis_konular": {"Türev": 2, f"K{i % args.topics}": 1},
+                             "tarih": f"2026-{1 + i % 9:02d}-{1 + i % 27:02d}T10:00:00"}) for i in range(rows)]
+    return io.BytesIO("\n".join(lines).encode("utf-8"))
+
+
+async def measure(user_id: int, rows: int) -> dict:
+    queries = [0]
+    def count(*_): queries[0] += 1
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    file = build_file(rows)
+    try:
+        async with AsyncSessionLocal() as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            result = await main.exam_importer.run(db, user_id, file, args.format, main.DenemeIceAktarSatiri, xp_per_exam=50, comments=True)
+            seconds = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            await db.rollback()
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    return {"rows": result["eklenen"], "seconds": round(seconds, 3), "rows_per_second": round(rows / seconds, 1),
+            "queries": queries[0], "peak_memory_kb": round(peak / 1024, 1)}
+
+
+def main_():
+    db = SessionLocal()
+    user = models.User(username="bench", email="bench@example.com", hashed_password="-", is_active=True, xp=0)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    out = {"database": "sqlite" if os.environ["DATABASE_URL"].startswith("sqlite") else "postgresql", "format": args.format,
+           "topics": args.topics, "results": [asyncio.run(measure(user_id, rows)) for rows in args.rows]}
+    print(json.dumps(out, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,105 @@
+"""
+DB ağırlıklı route'larda eşzamanlı istek altında throughput ve gecikme ölçer.
+
+Kullanım (repo kökünden):
+    python benchmarks/db_throughput.py --concurrency 1 16 64 --requests 400
+    DATABASE_URL=postgresql://... python benchmarks/db_throughput.py --concurrency 64
+    python benchmarks/db_throughput.py --root /tmp/eski-surum   # Başka bir checkout ile karşılaştırma
+
+DATABASE_URL verilmezse geçici bir SQLite veritabanı kullanılır. Uygulama
+aynı süreçte ASGI üzerinden çağrılır (ağ yok), Gemini/SMTP'ye bağlanmaz.
+Her eşzamanlılık seviyesi için istek/sn ile p50/p95 gecikmesini JSON yazar.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+parser.add_argument("--requests", type=int, default=400)
+parser.add_argument("--users", type=int, default=8)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.abspath(args.root))
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ["GOOGLE_API_KEY"] = ""
+os.environ["MAIL_USERNAME"] = ""
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("PRINCIPAL_CACHE_TTL_SECONDS", "0")  # Her istek DB'ye gitsin, ölçülen şey havuz/sürücü
+
+import httpx
+
+import main
+import models
+from database import SessionLocal, sync_schema
+
+sync_schema()  # Lifespan çalıştırılmıyor; şema açıkça
+
+ROUTES = ["/profil", "/gorevler", "/deneme-gecmisi", "/istatistikler"]
+
+
+async def create_users(client: httpx.AsyncClient, count: int) -> list:
+    headers = []
+    for i in range(count):
+        name = f"bench{i}"
+        await client.post("/register", json={
+            "username": name, "email": f"{name}@example.com", "password": "bench-pw",
+            "targets": {"dream_university": "ODTÜ", "dream_department": "Bilgisayar", "current_tyt_net": 60, "target_tyt_net": 100},
+        })
+        db = SessionLocal()
+        user = db.query(models.User).filter(models.User.username == name).first()
+        code = user.verification_code
+        for j in range(30):
+            db.add(models.Todo(user_id=user.id, content=f"Görev {j}"))
+            db.add(models.ExamResult(user_id=user.id, exam_name=f"D{j}", tyt_turkce=30, tyt_sosyal=15, tyt_mat=20, tyt_fen=10,
+                                     tyt_net=75, ayt_net=40, topic_mistakes={"Türev": j}))
+        db.commit()
+        db.close()
+        await client.post("/verify", json={"email": f"{name}@example.com", "code": code})
+        token = (await client.post("/token", data={"username": name, "password": "bench-pw"})).json()["access_token"]
+        headers.append({"Authorization": f"Bearer {token}"})
+    return headers
+
+
+async def run_level(client: httpx.AsyncClient, headers: list, concurrency: int, total: int) -> dict:
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            r = await client.get(ROUTES[i % len(ROUTES)], headers=headers[i % len(headers)])
+            assert r.status_code == 200, r.text
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+async def main_bench() -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = await create_users(client, args.users)
+        await run_level(client, headers, 4, 40)  # Isınma: havuz bağlantıları açılsın, streak yazılsın
+        levels = [await run_level(client, headers, c, args.requests) for c in args.concurrency]
+    return {"root": os.path.abspath(args.root), "database": os.environ["DATABASE_URL"].split("://", 1)[0], "levels": levels}
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(main_bench()), indent=2))
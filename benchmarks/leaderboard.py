@@ -0,0 +1,101 @@
+"""
+Liderlik tablosu: 1M kullanıcıda sıra sorgusu, XP güncellemesi ve ilk 100 gecikmesi.
+
+Kullanım (repo kökünden):
+    python benchmarks/leaderboard.py --users 1000000 --ops 20000
+    python benchmarks/leaderboard.py --users 1000000 --sql   # Naif ORDER BY / COUNT(*) ile karşılaştırma
+
+Bellek içi yapı sentetik verilerle kurulur (DB'ye gitmez). --sql verilirse aynı
+veri geçici bir SQLite users tablosuna yazılır ve "COUNT(*) WHERE xp > ?" ile
+"ORDER BY xp DESC LIMIT 100" ölçülür. Sonuçlar JSON olarak yazılır.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import resource
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from leaderboard import Leaderboard
+
+DEPARTMENTS = [f"Bölüm {i}" for i in range(200)]
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1e6, 2)
+    return {"p50_us": pick(0.50), "p99_us": pick(0.99), "mean_us": round(statistics.fmean(samples) * 1e6, 2)}
+
+def timed(func, args_list: list) -> dict:
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_memory(rows: list, ops: int) -> dict:
+    board = Leaderboard(session_factory=None)
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    board._users, board._global, board._departments, _ = board._build(rows, {})
+    board.loaded = True
+    build_seconds = time.perf_counter() - started
+
+    ids = [random.randrange(1, len(rows) + 1) for _ in range(ops)]
+    return {
+        "build_seconds": round(build_seconds, 2),
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+        "rank": timed(board.rank, [(i,) for i in ids]),
+        "rank_department": timed(board.rank, [(i, rows[i - 1][2]) for i in ids]),
+        "update": timed(board.update, [(i, random.randrange(0, 40000), rows[i - 1][2]) for i in ids]),
+        "top100": timed(board.top, [(100,)] * min(ops, 2000)),
+    }
+
+def bench_sql(rows: list, ops: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "users.db")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, xp INTEGER)")
+    con.executemany("INSERT INTO users (id, xp) VALUES (?, ?)", ((r[0], r[1]) for r in rows))
+    con.execute("CREATE INDEX ix_users_xp ON users (xp)")
+    con.commit()
+
+    ids = [random.randrange(1, len(rows) + 1) for _ in range(ops)]
+    rank = lambda i: con.execute("SELECT COUNT(*) + 1 FROM users WHERE xp > (SELECT xp FROM users WHERE id = ?)", (i,)).fetchone()
+    update = lambda i, xp: con.execute("UPDATE users SET xp = ? WHERE id = ?", (xp, i))
+    top = lambda n: con.execute("SELECT id, xp FROM users ORDER BY xp DESC LIMIT ?", (n,)).fetchall()
+    result = {
+        "rank": timed(rank, [(i,) for i in ids]),
+        "update": timed(update, [(i, random.randrange(0, 40000)) for i in ids]),
+        "top100": timed(top, [(100,)] * min(ops, 2000)),
+    }
+    con.commit()
+    con.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--sql", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(42)
+    # XP dağılımı çarpık: çoğu kullanıcı düşük XP'de, eşitlikler bol
+    rows = [(i, int(random.paretovariate(1.2) * 100) // 10 * 10, random.choice(DEPARTMENTS)) for i in range(1, args.users + 1)]
+    out = {"users": args.users, "ops": args.ops, "sorted_list": bench_memory(rows, args.ops)}
+    if args.sql: out["sqlite_naive"] = bench_sql(rows, min(args.ops, 500))
+    print(json.dumps(out, indent=2))
@@ -0,0 +1,365 @@
+"""
+Karışık senaryolu yük testi: sahte Gemini, yerel SMTP alıcısı, yerel veritabanı.
+
+Kullanım (repo kökünden):
+    python benchmarks/load_test.py --users 40 --concurrency 16 --duration 30 --out sonuc.json
+    python benchmarks/load_test.py --ai-latency-ms 1500 --ai-jitter 0.6 --ai-failure-rate 0.05
+    DATABASE_URL=postgresql://... python benchmarks/load_test.py
+    python benchmarks/load_test.py --root /tmp/eski-surum --out eski.json   # Başka bir commit'in checkout'u
+    python benchmarks/load_test.py --compare eski.json                      # Sonucu öncekiyle karşılaştır
+
+Uygulama aynı süreçte ASGI üzerinden (lifespan ve arka plan işleriyle birlikte) çalışır.
+  - Gemini: google.generativeai.GenerativeModel sahtesiyle değişir; gecikme log-normal
+    (medyan --ai-latency-ms, yayılım --ai-jitter), --ai-failure-rate oranında hata fırlatır.
+  - Mail: doğrulama kodları yerel bir SMTP alıcısına gider, kayıt senaryosu kodu oradan okur.
+  - Veritabanı: DATABASE_URL verilmezse geçici SQLite.
+Aşamalar: "signup" (kayıt/doğrulama/giriş patlaması), sonra süre boyunca "mixed":
+  sabah (/profil + /gorevler + görevleri bitir + /plan-olustur), deneme girişi, sohbet
+  (isteğe bağlı: --mix ...,challenge=2 ile /challenge-olustur).
+Her route için istek/sn, p50/p95/p99 ve istek başına SQL sorgu sayısı JSON olarak yazılır.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import email
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextvars import ContextVar
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+parser.add_argument("--users", type=int, default=40)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--duration", type=float, default=30.0, help="mixed aşamasının süresi (sn)")
+parser.add_argument("--mix", default="morning=5,deneme=2,chat=3", help="senaryo ağırlıkları")
+parser.add_argument("--ai-latency-ms", type=float, default=800.0)
+parser.add_argument("--ai-jitter", type=float, default=0.5, help="log-normal sigma (0 = sabit gecikme)")
+parser.add_argument("--ai-failure-rate", type=float, default=0.0)
+parser.add_argument("--keep-rate-limits", action="store_true", help="RATE_LIMIT_RANKS'i gevşetme")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--out")
+parser.add_argument("--compare")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.abspath(args.root))
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ["AUTO_MIGRATE"] = "1"  # Şema lifespan'de açılır
+os.environ["GOOGLE_API_KEY"] = "bench-fake-key"
+os.environ["MAIL_USERNAME"] = ""
+os.environ["MAIL_FROM"] = "bench@example.com"
+os.environ["SMTP_HOST"] = "127.0.0.1"
+os.environ["SMTP_STARTTLS"] = "0"
+os.environ.setdefault("MAIL_POLL_SECONDS", "1")
+os.environ.setdefault("SLOW_REQUEST_SECONDS", "0")
+if not args.keep_rate_limits:
+    os.environ["RATE_LIMIT_RANKS"] = json.dumps({r: [10000, 100000] for r in ("Çaylak", "Çırak", "Kalfa", "Usta", "YKS LORDU")})
+
+
+# --- SMTP ALICISI (sadece test için: AUTH/TLS yok, mesajlar bellekte) ---
+class SMTPSink:
+    def __init__(self):
+        self.messages = []
+        self._waiters = {}   # alıcı -> Future
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader, writer):
+        send = lambda line: writer.write((line + "\r\n").encode())
+        send("220 bench-sink")
+        recipients = []
+        try:
+            while True:
+                line = (await reader.readline()).decode(errors="replace").strip()
+                if not line: break
+                command = line[:4].upper()
+                if command in ("EHLO", "HELO"): send("250 bench-sink")
+                elif command == "RCPT":
+                    recipients.append(line.split(":", 1)[1].strip().strip("<>"))
+                    send("250 OK")
+                elif command == "DATA":
+                    send("354 End with .")
+                    data = await reader.readuntil(b"\r\n.\r\n")
+                    self._deliver(recipients, data[:-5].replace(b"\r\n..", b"\r\n."))
+                    recipients = []
+                    send("250 OK")
+                elif command == "QUIT":
+                    send("221 Bye")
+                    break
+                else: send("250 OK")  # MAIL, RSET, NOOP
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _deliver(self, recipients: list, data: bytes):
+        message = email.message_from_bytes(data)
+        body = "".join(part.get_payload(decode=True).decode("utf-8") for part in message.walk() if part.get_content_type() == "text/plain")
+        for to in recipients:
+            self.messages.append((to, body))
+            waiter = self._waiters.pop(to, None)
+            if waiter is not None and not waiter.done(): waiter.set_result(body)
+
+    async def wait_for(self, to: str, timeout: float = 30.0) -> str:
+        for recipient, body in self.messages:
+            if recipient == to: return body
+        waiter = self._waiters[to] = asyncio.get_running_loop().create_future()
+        return await asyncio.wait_for(waiter, timeout)
+
+
+sink = SMTPSink()
+
+
+# --- SAHTE GEMINI ---
+PLAN_REPLY = "- [Mat]: Türev - 40 soru çöz\n- [Fizik]: Optik - video izle\n- [Türkçe]: Paragraf - 30 soru\n- [Kimya]: Mol - tekrar et"
+CHALLENGE_REPLY = {"baslik": "Türev Maratonu", "aciklama": "45 dakikada 30 soru. GÖREVİN: 30 türev sorusu çözmek", "sure_dk": 45, "xp_degeri": 100}
+COACH_REPLY = '{"unvan": "Savaşçı", "mesaj": "Hedefe yakınsın, paragrafa yüklen."}'
+TUTOR_REPLY = "Türevde zincir kuralını tekrar et, sonra 20 soru çöz. GOREV_EKLE: Zincir kuralı 20 soru"
+
+
+class FakeResponse:
+    def __init__(self, text: str): self.text = text
+
+
+class FakeModel:
+    calls = 0
+    failures = 0
+    challenges = 0
+
+    def __init__(self, name: str = "fake", **kwargs):
+        self.name = name
+
+    @staticmethod
+    def reply_for(contents) -> str:
+        prompt = contents if isinstance(contents, str) else " ".join(c for c in contents if isinstance(c, str))
+        if "xp_degeri" in prompt:
+            # Havuz başlığı aynı olanı tekrar saymaz: her challenge'a ayrı numara
+            count = int(m.group(1)) if (m := re.search(r"farklı (\d+) zorlu", prompt)) else 1
+            FakeModel.challenges += count
+            return json.dumps([dict(CHALLENGE_REPLY, baslik=f"{CHALLENGE_REPLY['baslik']} #{FakeModel.challenges - i}") for i in range(count)])
+        if "unvan" in prompt: return COACH_REPLY
+        if "4 adet görev" in prompt: return PLAN_REPLY
+        return TUTOR_REPLY
+
+    async def _wait(self):
+        FakeModel.calls += 1
+        delay = args.ai_latency_ms / 1000
+        if args.ai_jitter > 0: delay = random.lognormvariate(math.log(delay), args.ai_jitter)
+        await asyncio.sleep(delay)
+        if random.random() < args.ai_failure_rate:
+            FakeModel.failures += 1
+            raise RuntimeError("429 Resource has been exhausted (bench)")
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        await self._wait()
+        text = self.reply_for(contents)
+        if not stream: return FakeResponse(text)
+
+        async def chunks():
+            for i in range(0, len(text), 16):
+                await asyncio.sleep(0.005)
+                yield FakeResponse(text[i:i + 16])
+        return chunks()
+
+    def generate_content(self, contents, **kwargs):
+        FakeModel.calls += 1
+        return FakeResponse(self.reply_for(contents))
+
+
+import google.generativeai as genai
+genai.GenerativeModel = FakeModel
+
+import httpx
+from sqlalchemy import event
+
+# --- SORGU SAYACI (istemci isteği açmadan önce bağlamı kurar, ASGITransport aynı task'ta çalışır) ---
+query_counter: ContextVar = ContextVar("query_counter", default=None)
+
+def count_queries(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        counter = query_counter.get()
+        if counter is not None: counter[0] += 1
+
+
+# --- ÖLÇÜM ---
+class Recorder:
+    def __init__(self):
+        self.samples = {}   # route -> [(saniye, sorgu, hata)]
+
+    async def call(self, client: httpx.AsyncClient, method: str, label: str, url: str, ok=(200,), **kwargs) -> httpx.Response:
+        counter = [0]
+        token = query_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            error = response.status_code not in ok
+        except Exception:
+            response, error = None, True
+        finally:
+            query_counter.reset(token)
+        self.samples.setdefault(label, []).append((time.perf_counter() - started, counter[0], error))
+        return response
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(s[0] * 1000 for s in samples)
+    return {
+        "count": len(samples),
+        "errors": sum(1 for s in samples if s[2]),
+        "requests_per_second": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "queries_per_request": round(sum(s[1] for s in samples) / len(samples), 2),
+    }
+
+def report(recorder: Recorder, elapsed: float) -> dict:
+    every = [s for samples in recorder.samples.values() for s in samples]
+    return {"seconds": round(elapsed, 2), "all": summarize(every, elapsed) if every else None,
+            "routes": {label: summarize(samples, elapsed) for label, samples in sorted(recorder.samples.items())}}
+
+
+# --- SENARYOLAR ---
+class VirtualUser:
+    def __init__(self, i: int):
+        self.name = f"load{i}"
+        self.email = f"load{i}@example.com"
+        self.headers = None
+        self.questions = 0
+
+
+async def signup(client, rec: Recorder, user: VirtualUser):
+    await rec.call(client, "POST", "/register", "/register", json={
+        "username": user.name, "email": user.email, "password": "bench-pw",
+        "targets": {"dream_university": "ODTÜ", "dream_department": random.choice(["Bilgisayar", "Tıp", "Hukuk"]),
+                    "current_tyt_net": 55, "target_tyt_net": 100}})
+    code = re.search(r"Kodun: (\d+)", await sink.wait_for(user.email)).group(1)
+    await rec.call(client, "POST", "/verify", "/verify", json={"email": user.email, "code": code})
+    response = await rec.call(client, "POST", "/token", "/token", data={"username": user.name, "password": "bench-pw"})
+    user.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def morning(client, rec: Recorder, user: VirtualUser):
+    await rec.call(client, "GET", "/profil", "/profil", headers=user.headers)
+    todos = await rec.call(client, "GET", "/gorevler", "/gorevler", headers=user.headers)
+    for todo in (todos.json() if todos is not None and todos.status_code == 200 else []):
+        if not todo["is_completed"]:
+            await rec.call(client, "PUT", "/gorev-yap/{todo_id}", f"/gorev-yap/{todo['id']}", headers=user.headers)
+    await rec.call(client, "POST", "/plan-olustur", "/plan-olustur", headers=user.headers, ok=(200, 406))
+
+async def deneme(client, rec: Recorder, user: VirtualUser):
+    topics = random.sample(["Türev", "Paragraf", "Optik", "Mol", "Limit", "Problemler", "Hücre"], 3)
+    await rec.call(client, "POST", "/deneme-ekle", "/deneme-ekle", headers=user.headers, json={
+        "exam_name": f"Deneme {random.randint(1, 999)}", "tyt_turkce": random.uniform(15, 38), "tyt_sosyal": random.uniform(5, 18),
+        "tyt_mat": random.uniform(5, 38), "tyt_fen": random.uniform(2, 18), "ayt_net": random.uniform(10, 60),
+        "yanlis_konular": {t: random.randint(1, 6) for t in topics}})
+    await rec.call(client, "GET", "/istatistikler", "/istatistikler", headers=user.headers)
+    await rec.call(client, "GET", "/deneme-gecmisi", "/deneme-gecmisi", headers=user.headers)
+
+async def chat(client, rec: Recorder, user: VirtualUser):
+    user.questions += 1
+    # Soruların bir kısmı ortak (cache isabeti), bir kısmı kişiye özel
+    soru = random.choice(["Türev nasıl çalışılır?", "Paragraf hızım düşük", f"{user.name} soru {user.questions}"])
+    await rec.call(client, "POST", "/ai-soru-sor", "/ai-soru-sor", headers=user.headers, json={"soru_metni": soru})
+    await rec.call(client, "GET", "/chat-gecmisi", "/chat-gecmisi", headers=user.headers)
+
+async def challenge(client, rec: Recorder, user: VirtualUser):
+    await rec.call(client, "POST", "/challenge-olustur", "/challenge-olustur", headers=user.headers)
+
+SCENARIOS = {"morning": morning, "deneme": deneme, "chat": chat, "challenge": challenge}
+
+
+async def run_pool(concurrency: int, jobs):
+    # jobs: async fonksiyon üreten iterator; sabit sayıda worker sırayla çeker
+    async def worker():
+        for job in jobs: await job()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def main_bench() -> dict:
+    random.seed(args.seed)
+    import main, database
+    count_queries(database.engine)
+    if hasattr(database, "async_engine"): count_queries(database.async_engine.sync_engine)
+    weights = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+
+    port = await sink.start()
+    main.mail_sender.port = port
+    users = [VirtualUser(i) for i in range(args.users)]
+    out = {"root": os.path.abspath(args.root), "commit": git_commit(args.root), "database": os.environ["DATABASE_URL"].split("://", 1)[0],
+           "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "root")}}
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            rec = Recorder()
+            started = time.perf_counter()
+            await run_pool(args.concurrency, (lambda u=u: signup(client, rec, u) for u in users))
+            out["signup"] = report(rec, time.perf_counter() - started)
+
+            rec = Recorder()
+            scenario_counts = {name: 0 for name in SCENARIOS}
+            started = time.perf_counter()
+            deadline = started + args.duration
+            free = asyncio.Queue()
+            for u in users: free.put_nowait(u)
+
+            async def mixed_worker():
+                # Aynı kullanıcı aynı anda iki senaryoda olmasın
+                while time.perf_counter() < deadline:
+                    user = await free.get()
+                    name = random.choices(list(weights), weights=list(weights.values()))[0]
+                    scenario_counts[name] += 1
+                    try: await SCENARIOS[name](client, rec, user)
+                    finally: free.put_nowait(user)
+
+            await asyncio.gather(*(mixed_worker() for _ in range(min(args.concurrency, len(users)))))
+            out["mixed"] = report(rec, time.perf_counter() - started)
+            out["mixed"]["scenarios"] = scenario_counts
+        # SMTP bağlantısı açık kalır; QUIT'i alıcı aynı event loop'ta cevaplayabilsin diye kapanıştan önce thread'de kapat
+        await asyncio.to_thread(main.mail_sender.close)
+    sink.server.close()
+    await sink.server.wait_closed()
+
+    out["ai"] = {"calls": FakeModel.calls, "failures": FakeModel.failures}
+    out["mail"] = {"received": len(sink.messages)}
+    return out
+
+
+def git_commit(root: str):
+    try: return subprocess.run(["git", "-C", root, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception: return None
+
+def compare(old: dict, new: dict):
+    # Route başına p95 ve sorgu sayısı değişimi (negatif = iyileşme)
+    print(f"{'aşama/route':40} {'p95 eski':>10} {'p95 yeni':>10} {'Δ%':>7} {'sorgu eski':>11} {'sorgu yeni':>11}", file=sys.stderr)
+    for phase in ("signup", "mixed"):
+        for route, stats in new.get(phase, {}).get("routes", {}).items():
+            before = old.get(phase, {}).get("routes", {}).get(route)
+            if not before: continue
+            delta = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            print(f"{phase + ' ' + route:40} {before['p95_ms']:>10} {stats['p95_ms']:>10} {delta:>7.1f} "
+                  f"{before['queries_per_request']:>11} {stats['queries_per_request']:>11}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    result = asyncio.run(main_bench())
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
+    print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f: compare(json.load(f), result)
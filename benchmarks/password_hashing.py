@@ -0,0 +1,61 @@
+"""
+bcrypt work factor'ı için gecikme ve çekirdek başına saniyede login ölçümü.
+
+Kullanım (repo kökünden):
+    python benchmarks/password_hashing.py --rounds 10 11 12 13 --logins 64 --workers 4
+
+Her work factor için tek çekirdekte verify gecikmesini, bundan çıkan
+login/sn/çekirdek değerini ve process havuzuyla elde edilen toplam
+throughput'u JSON olarak yazar. PASSWORD_HASH_BUDGET_MS'e göre önerilen
+BCRYPT_ROUNDS değeri de çıktıdadır.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from password_hashing import PasswordHasher, PASSWORD_HASH_BUDGET_MS, _hash, _verify, calibrate_rounds
+
+
+def single_core(rounds: int, samples: int) -> dict:
+    hashed = _hash("bench-password", rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        _verify("bench-password", hashed, rounds)
+        timings.append((time.perf_counter() - started) * 1000)
+    median = statistics.median(timings)
+    return {"verify_ms_p50": round(median, 2), "logins_per_sec_per_core": round(1000 / median, 2)}
+
+
+async def pooled(rounds: int, logins: int, workers: int) -> dict:
+    hasher = PasswordHasher(rounds=rounds, workers=workers, max_queue=logins)
+    hashed = _hash("bench-password", rounds)
+    await hasher.verify("bench-password", hashed)  # Havuzu ısıt (spawn maliyeti ölçüme girmesin)
+    started = time.perf_counter()
+    await asyncio.gather(*[hasher.verify("bench-password", hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    return {"workers": workers, "logins_per_sec": round(logins / elapsed, 2)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--budget-ms", type=float, default=PASSWORD_HASH_BUDGET_MS)
+    args = parser.parse_args()
+
+    results = {}
+    for rounds in args.rounds:
+        results[rounds] = {**single_core(rounds, args.samples), "pool": asyncio.run(pooled(rounds, args.logins, args.workers))}
+    print(json.dumps({"cpu_count": os.cpu_count(), "budget_ms": args.budget_ms,
+                      "recommended_rounds": calibrate_rounds(args.budget_ms), "results": results}, indent=2))
@@ -0,0 +1,93 @@
+"""
+Soğuk açılış süresini ölçer: `import main`, lifespan açılışı ve ilk istek.
+
+Kullanım (repo kökünden):
+    python benchmarks/startup.py --runs 7
+    python benchmarks/startup.py --budget-ms 1200          # Bütçe aşılırsa çıkış kodu 1 (CI)
+    python benchmarks/startup.py --root /tmp/eski-surum    # Başka bir checkout ile karşılaştırma
+
+Her ölçüm ayrı ve taze bir Python sürecinde yapılır (modül cache'i yok).
+Geçici SQLite kullanır, Gemini/SMTP'ye bağlanmaz. Medyan süreleri ve
+`-X importtime` çıktısındaki en pahalı modülleri JSON olarak yazar.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument("--budget-ms", type=float, default=0, help="import main için üst sınır (0 = kontrol yok)")
+parser.add_argument("--top", type=int, default=10)
+args = parser.parse_args()
+
+# Alt süreçte çalışan ölçüm: süreler JSON olarak stdout'un son satırında
+PROBE = r"""
+import os, sys, json, time, asyncio
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import database
+if hasattr(database, "sync_schema"): database.sync_schema()  # Yeni sürümde import'ta çalışmıyor; iki sürüm aynı DB ile başlasın
+import httpx
+
+async def first_request():
+    t0 = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        t1 = time.perf_counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            await client.get("/docs")
+        t2 = time.perf_counter()
+    return t1 - t0, t2 - t1
+
+lifespan, request = asyncio.run(first_request())
+print(json.dumps({"import_ms": (imported - started) * 1000, "lifespan_ms": lifespan * 1000, "first_request_ms": request * 1000}))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env.update({"DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}", "SECRET_KEY": "bench-secret",
+                "GOOGLE_API_KEY": "", "MAIL_USERNAME": "", "PASSWORD_HASH_WORKERS": "0", "PYTHONIOENCODING": "utf-8"})
+    return env
+
+
+def probe() -> dict:
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=args.root, env=child_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile() -> list:
+    # -X importtime: "import time: self [us] | cumulative | paket"; en üst seviyedeki pahalı modüller
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=args.root, env=child_env(),
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line: continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        if len(name) - len(name.lstrip()) <= 3:   # main ve doğrudan import ettikleri
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:args.top]]
+
+
+def main():
+    runs = [probe() for _ in range(args.runs)]
+    out = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    out["runs"] = args.runs
+    out["top_imports"] = import_profile()
+    if args.budget_ms:
+        out["budget_ms"] = args.budget_ms
+        out["within_budget"] = out["import_ms"] <= args.budget_ms
+    print(json.dumps(out, indent=2, ensure_ascii=False))
+    if args.budget_ms and not out["within_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+XP artışlarında kayıp güncelleme testi ve throughput karşılaştırması.
+
+Kullanım (repo kökünden):
+    python benchmarks/xp_ledger.py --tasks 32 --awards 50 --users 4
+    DATABASE_URL=postgresql://... python benchmarks/xp_ledger.py
+
+İki yöntem aynı eşzamanlı yük altında çalıştırılır:
+  rmw    : eski route'lardaki gibi kullanıcıyı oku, istek içinde bekle (AI çağrısı vb.), user.xp += N, commit
+  ledger : xp_events'e ekle + commit, sonra XPLedger.flush() ile toplu "xp = xp + delta"
+Sonunda users.xp beklenen toplamla karşılaştırılır; ledger'da fark varsa çıkış kodu 1'dir.
+DATABASE_URL verilmezse geçici bir SQLite veritabanı kullanılır.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from sqlalchemy import select
+
+import models
+from database import engine, AsyncSessionLocal, sync_schema
+import xp_ledger
+from xp_ledger import XPLedger
+
+
+def reset(user_count: int) -> list:
+    sync_schema()
+    with engine.begin() as conn:
+        conn.execute(models.XPEvent.__table__.delete())
+        conn.execute(models.User.__table__.delete().where(models.User.username.like("xpbench-%")))
+        conn.execute(models.User.__table__.insert(), [{"username": f"xpbench-{i}", "email": f"xpbench-{i}@example.com", "xp": 0,
+                                                        "is_active": True} for i in range(user_count)])
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(select(models.User.id).where(models.User.username.like("xpbench-%")))]
+
+
+async def rmw_award(user_id: int, delta: int):
+    async with AsyncSessionLocal() as db:
+        user = await db.get(models.User, user_id)
+        await asyncio.sleep(random.random() * 0.002)  # İstek içi iş: okuma ile yazma arasında başka istekler araya girer
+        user.xp += delta
+        await db.commit()
+
+async def ledger_award(user_id: int, delta: int):
+    async with AsyncSessionLocal() as db:
+        await asyncio.sleep(random.random() * 0.002)
+        xp_ledger.award(db, user_id, delta, "bench")
+        await db.commit()
+
+
+async def run(method, user_ids: list, tasks: int, awards: int) -> dict:
+    expected = {u: 0 for u in user_ids}
+    errors = 0
+
+    async def worker(n):
+        nonlocal errors
+        rnd = random.Random(n)
+        for _ in range(awards):
+            user_id = rnd.choice(user_ids)
+            try:
+                await method(user_id, 10)
+                expected[user_id] += 10
+            except Exception:
+                errors += 1  # Örn. SQLite "database is locked": yazılmadı, beklenene de eklenmez
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(tasks)))
+    elapsed = time.perf_counter() - started
+
+    flush_seconds = None
+    if method is ledger_award:
+        started = time.perf_counter()
+        await XPLedger().flush()
+        flush_seconds = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        actual = dict((await db.execute(select(models.User.id, models.User.xp).where(models.User.id.in_(user_ids)))).all())
+    lost = sum(expected.values()) - sum(actual.values())
+    return {
+        "awards": sum(expected.values()) // 10,
+        "errors": errors,
+        "awards_per_second": round(sum(expected.values()) / 10 / elapsed, 1),
+        "flush_seconds": round(flush_seconds, 3) if flush_seconds is not None else None,
+        "expected_xp": sum(expected.values()),
+        "stored_xp": sum(actual.values()),
+        "lost_increments": lost // 10,
+    }
+
+
+async def main_bench(args) -> dict:
+    out = {"tasks": args.tasks, "awards_per_task": args.awards, "users": args.users, "database": os.environ["DATABASE_URL"].split("://", 1)[0]}
+    for name, method in (("rmw", rmw_award), ("ledger", ledger_award)):
+        user_ids = reset(args.users)
+        out[name] = await run(method, user_ids, args.tasks, args.awards)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=32)
+    parser.add_argument("--awards", type=int, default=50)
+    parser.add_argument("--users", type=int, default=4)
+    args = parser.parse_args()
+    result = asyncio.run(main_bench(args))
+    print(json.dumps(result, indent=2))
+    if result["ledger"]["lost_increments"] != 0: sys.exit(1)
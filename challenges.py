@@ -0,0 +1,303 @@
+import os
+import json
+import asyncio
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select, update, delete, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, IS_SQLITE
+from ai_gateway import gateway
+import models as models, schemas as schemas
+
+# --- AYARLAR ---
+CHALLENGE_POOL_MIN = int(os.getenv("CHALLENGE_POOL_MIN", "20"))                # Her kovada en az bu kadar challenge (ilk doldurma)
+CHALLENGE_POOL_LOW = int(os.getenv("CHALLENGE_POOL_LOW", "5"))                 # Stok bunun altına inince kova yeniden doldurulur
+CHALLENGE_POOL_BATCH = int(os.getenv("CHALLENGE_POOL_BATCH", "10"))            # Bir AI çağrısında üretilen challenge
+CHALLENGE_REFILL_PER_RUN = int(os.getenv("CHALLENGE_REFILL_PER_RUN", "4"))     # Bir turda doldurulan en fazla kova (kota)
+CHALLENGE_REFILL_SECONDS = int(os.getenv("CHALLENGE_REFILL_SECONDS", "60"))
+CHALLENGE_REFILL_LEASE_SECONDS = int(os.getenv("CHALLENGE_REFILL_LEASE_SECONDS", "300"))  # Sahiplik bu kadar eskiyse worker çökmüş sayılır
+
+RANKS = ("Çaylak", "Çırak", "Kalfa", "Usta", "YKS LORDU")   # calculate_level ile aynı
+GENERAL = "Genel"
+# Kova -> görev metninde arananlar (küçük harf). Görevler "[Ders]: Konu - İş" biçiminde
+TOPICS = {
+    "Matematik": ("mat", "geometri", "türev", "integral", "limit", "fonksiyon", "problem"),
+    "Fizik": ("fiz", "optik", "elektrik", "kuvvet", "hareket", "dinamik", "dalga"),
+    "Kimya": ("kim", "mol", "asit", "organik"),
+    "Biyoloji": ("biy", "hücre", "genetik", "ekoloji"),
+    "Türkçe": ("türkçe", "paragraf", "dil bilgisi", "edebiyat", "sözcük"),
+    "Sosyal": ("sosyal", "tarih", "coğrafya", "felsefe", "din"),
+}
+BUCKETS = [(rank, topic) for rank in RANKS for topic in (*TOPICS, GENERAL)]
+FIELDS = ("baslik", "aciklama", "sure_dk", "xp_degeri")
+FALLBACK_CHALLENGE = {"baslik": "Hata Avı", "aciklama": "Sistem hata verdi, sen 20 soru çöz.", "sure_dk": 30, "xp_degeri": 50}
+
+CHALLENGE_PROMPT = """
+Rol: Oyun Yapımcısı. Seviye: {rank}. Konu: {topic}.
+Görev: Bu seviyedeki bir YKS öğrencisi için birbirinden farklı {count} zorlu challenge yaz.
+Her biri: baslik (kısa), aciklama, sure_dk (dakika), xp_degeri.
+Kural: Her açıklamanın sonunda 'GÖREVİN: ... çözmek' yazmalı.
+"""
+# Yapılandırılmış çıktı: Gemini düz metin yerine bu şemada JSON listesi döner (yine de schemas.Challenge ile doğrulanır)
+CHALLENGE_OUTPUT = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {"baslik": {"type": "STRING"}, "aciklama": {"type": "STRING"},
+                           "sure_dk": {"type": "INTEGER"}, "xp_degeri": {"type": "INTEGER"}},
+            "required": list(FIELDS),
+        },
+    },
+}
+
+
+def topic_bucket(contents: list) -> str:
+    # Son görevlerde en çok geçen ders; tanınmazsa genel kova
+    found = Counter()
+    for content in contents:
+        text = (content or "").replace("İ", "i").replace("I", "ı").lower()
+        topic = next((t for t, words in TOPICS.items() if any(w in text for w in words)), None)
+        if topic: found[topic] += 1
+    return found.most_common(1)[0][0] if found else GENERAL
+
+def parse_challenges(text: str) -> tuple:
+    """AI çıktısı -> (geçerli challenge sözlükleri, reddedilen sayısı). Şemaya ya da GÖREVİN kuralına uymayan girmez."""
+    try:
+        data = json.loads(text.replace("```json", "").replace("```", "").strip())
+    except ValueError:
+        return [], 1
+    if isinstance(data, dict): data = [data]
+    if not isinstance(data, list): return [], 1
+    valid, rejected = [], 0
+    for item in data:
+        try:
+            challenge = schemas.Challenge.model_validate(item)
+        except ValidationError:
+            rejected += 1
+            continue
+        if "görevin" not in challenge.aciklama.replace("İ", "i").lower():
+            rejected += 1
+            continue
+        valid.append(challenge.model_dump())
+    return valid, rejected
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.ChallengeCursor).where(models.ChallengeCursor.user_id == user_id))
+
+
+class ChallengePool:
+    """
+    /challenge-olustur için rütbe + konu kovası başına önceden üretilmiş challenge havuzu.
+    Kovalar bellekte (id sırasıyla); kullanıcının kovadaki imleci (challenge_cursors.last_id) sıradakini
+    sözlükten tek adımda bulur, aynı challenge iki kez verilmez. En ileri kullanıcının önünde kalan
+    stok CHALLENGE_POOL_LOW'un altına inince kova arka planda yeniden doldurulur (tek worker sahiplenir).
+    """
+
+    def __init__(self, minimum: int = CHALLENGE_POOL_MIN, low: int = CHALLENGE_POOL_LOW, batch: int = CHALLENGE_POOL_BATCH,
+                 per_run: int = CHALLENGE_REFILL_PER_RUN, lease: int = CHALLENGE_REFILL_LEASE_SECONDS,
+                 session_factory=AsyncSessionLocal, ai=gateway):
+        self.minimum = minimum
+        self.low = low
+        self.batch = batch
+        self.per_run = per_run
+        self.lease = lease
+        self.session_factory = session_factory
+        self.ai = ai
+        self._items = {}      # (rank, topic) -> [challenge sözlüğü, ...] id sırasıyla
+        self._ids = {}        # (rank, topic) -> [id, ...]
+        self._index = {}      # (rank, topic) -> {id: sıra}
+        self._frontier = {}   # (rank, topic) -> en ileri kullanıcının last_id'si (stok buna göre)
+        self._wanted = set()  # İstek gelip stoğu azalan/biten kovalar: doldurmada önce bunlar
+        self._refilling = False
+        self._task = None     # nudge()'un başlattığı doldurma
+        self.loaded = False
+        self.served = 0
+        self.misses = 0
+        self.live_generated = 0
+        self.fallbacks = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.generated = 0
+        self.rejected = 0
+
+    def start(self, scheduler, interval: int = CHALLENGE_REFILL_SECONDS):
+        # Açılışta havuz yüklenir (ve boş kovalar doldurulmaya başlar), sonra periyodik kontrol
+        scheduler.add_job(self.refill, "interval", seconds=interval, id="challenge-refill", max_instances=1, coalesce=True,
+                          next_run_time=datetime.now())
+
+    # --- İSTEK TARAFI ---
+    async def take(self, db: AsyncSession, user_id: int, rank: str, topic: str) -> Optional[dict]:
+        """Kullanıcının kovada görmediği sıradaki challenge; yoksa None. İmleç güncellenir, commit çağıranın işi."""
+        cursors = models.ChallengeCursor
+        last = await db.scalar(select(cursors.last_id).where(cursors.user_id == user_id, cursors.rank == rank,
+                                                             cursors.topic == topic)) or 0
+        item = self._next((rank, topic), last)
+        if item is None:
+            self.misses += 1
+            self.nudge((rank, topic))
+            return None
+        await self._advance(db, user_id, (rank, topic), item["id"])
+        self.served += 1
+        return {f: item[f] for f in FIELDS}
+
+    async def live(self, rank: str, topic: str) -> Optional[dict]:
+        # Havuzda kullanıcıya yeni challenge yok: anında üretilir. Havuza girmez; girseydi id'si,
+        # bu arada doldurulan kovadakilerden büyük olur ve imleç onları atlardı
+        self.live_generated += 1
+        fresh = await self.generate(rank, topic, 1, caller="challenge-olustur")
+        return fresh[0] if fresh else None
+
+    def fallback(self) -> dict:
+        self.fallbacks += 1
+        return dict(FALLBACK_CHALLENGE)
+
+    def _next(self, key: tuple, last: int) -> Optional[dict]:
+        ids = self._ids.get(key)
+        if not ids: return None
+        pos = self._index[key].get(last)
+        i = pos + 1 if pos is not None else bisect_right(ids, last)   # İmleç havuzda yoksa (ör. 0) ikili arama
+        if i >= len(ids): return None
+        if ids[i] > self._frontier.get(key, 0): self._frontier[key] = ids[i]
+        if self.stock(key) < self.low: self.nudge(key)
+        return self._items[key][i]
+
+    async def _advance(self, db: AsyncSession, user_id: int, key: tuple, challenge_id: int):
+        cursors = models.ChallengeCursor
+        insert = sqlite_insert if IS_SQLITE else pg_insert
+        stmt = insert(cursors).values(user_id=user_id, rank=key[0], topic=key[1], last_id=challenge_id, served_at=datetime.utcnow())
+        # Aynı anda iki istek: imleç geri gitmez
+        await db.execute(stmt.on_conflict_do_update(index_elements=["user_id", "rank", "topic"],
+                                                    set_={"last_id": stmt.excluded.last_id, "served_at": stmt.excluded.served_at},
+                                                    where=cursors.last_id < stmt.excluded.last_id))
+
+    def _set(self, key: tuple, items: list):
+        self._items[key] = items
+        self._ids[key] = [c["id"] for c in items]
+        self._index[key] = {c["id"]: i for i, c in enumerate(items)}
+
+    def stock(self, key: tuple) -> int:
+        # En ileri kullanıcının henüz görmediği challenge sayısı
+        ids = self._ids.get(key, ())
+        return len(ids) - bisect_right(ids, self._frontier.get(key, 0))
+
+    # --- ARKA PLAN ---
+    def nudge(self, key: tuple):
+        # Stok azaldı/bitti: periyodik turu beklemeden, bu kova öncelikli doldurulur
+        self._wanted.add(key)
+        if self.loaded and not self._refilling and self._task is None and self.ai.enabled:
+            # Referans tutulur: görev yarıda GC'lenmesin, hatası görülsün
+            self._task = asyncio.create_task(self.refill())
+            self._task.add_done_callback(self._refill_done)
+
+    def _refill_done(self, task: asyncio.Task):
+        self._task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Challenge Doldurma Hata: {task.exception()}")
+
+    async def refill(self):
+        if self._refilling: return
+        self._refilling = True
+        try:
+            await self._sync()
+            if not self.ai.enabled: return
+            due = [key for key in BUCKETS if len(self._ids.get(key, ())) < self.minimum or self.stock(key) < self.low]
+            for key in sorted(due, key=lambda k: (k not in self._wanted, self.stock(k)))[:self.per_run]:
+                await self._refill_bucket(key)
+        except Exception as e:
+            print(f"Challenge Havuzu Hata: {e}")
+        finally:
+            self._refilling = False
+
+    async def _sync(self):
+        # Başka worker'ların doldurduğu kovalar ve imleçler: sayısı tutmayan kova baştan yüklenir
+        pool, cursors = models.PoolChallenge, models.ChallengeCursor
+        async with self.session_factory() as db:
+            counts = (await db.execute(select(pool.rank, pool.topic, func.count(pool.id)).group_by(pool.rank, pool.topic))).all()
+            frontiers = (await db.execute(select(cursors.rank, cursors.topic, func.max(cursors.last_id))
+                                          .group_by(cursors.rank, cursors.topic))).all()
+            for rank, topic, last in frontiers:
+                self._frontier[(rank, topic)] = max(self._frontier.get((rank, topic), 0), last or 0)
+            for rank, topic, count in counts:
+                if count != len(self._ids.get((rank, topic), ())):
+                    await self._reload(db, (rank, topic))
+        self.loaded = True
+
+    async def _reload(self, db: AsyncSession, key: tuple):
+        pool = models.PoolChallenge
+        rows = (await db.execute(select(pool.id, *[getattr(pool, f) for f in FIELDS])
+                                 .where(pool.rank == key[0], pool.topic == key[1]).order_by(pool.id))).mappings().all()
+        self._set(key, [dict(row) for row in rows])
+
+    async def _refill_bucket(self, key: tuple):
+        if not await self._claim(key): return   # Başka worker dolduruyor
+        rank, topic = key
+        try:
+            seen = {c["baslik"].lower() for c in self._items.get(key, ())}
+            fresh = []
+            for challenge in await self.generate(rank, topic, self.batch, caller="challenge_refill"):
+                if challenge["baslik"].lower() in seen: continue
+                seen.add(challenge["baslik"].lower())
+                fresh.append(challenge)
+            if not fresh: raise ValueError("geçerli challenge yok")
+            async with self.session_factory() as db:
+                db.add_all([models.PoolChallenge(rank=rank, topic=topic, **c) for c in fresh])
+                await self._release(db, key, refilled=True)
+                await db.commit()
+                await self._reload(db, key)
+            self._wanted.discard(key)
+            self.refills += 1
+            self.generated += len(fresh)
+        except Exception as e:
+            self.refill_failures += 1
+            print(f"Challenge Doldurma Hata ({rank}/{topic}): {e}")
+            async with self.session_factory() as db:
+                await self._release(db, key)
+                await db.commit()
+
+    async def _claim(self, key: tuple) -> bool:
+        buckets = models.ChallengeBucket
+        async with self.session_factory() as db:
+            insert = sqlite_insert if IS_SQLITE else pg_insert
+            await db.execute(insert(buckets).values(rank=key[0], topic=key[1], refills=0)
+                             .on_conflict_do_nothing(index_elements=["rank", "topic"]))
+            now = datetime.utcnow()
+            claimed = await db.execute(update(buckets).where(buckets.rank == key[0], buckets.topic == key[1], or_(
+                buckets.claimed_at.is_(None), buckets.claimed_at < now - timedelta(seconds=self.lease))).values(claimed_at=now))
+            if claimed.rowcount != 1:
+                await db.rollback()
+                return False
+            await db.commit()
+        return True
+
+    @staticmethod
+    async def _release(db: AsyncSession, key: tuple, refilled: bool = False):
+        buckets = models.ChallengeBucket
+        values = {"claimed_at": None}
+        if refilled: values.update(refilled_at=datetime.utcnow(), refills=func.coalesce(buckets.refills, 0) + 1)
+        await db.execute(update(buckets).where(buckets.rank == key[0], buckets.topic == key[1]).values(**values))
+
+    async def generate(self, rank: str, topic: str, count: int, caller: str) -> list:
+        prompt = CHALLENGE_PROMPT.format(rank=rank, topic="Genel YKS" if topic == GENERAL else topic, count=count)
+        text = await self.ai.generate(prompt, caller=caller, generation_config=CHALLENGE_OUTPUT)
+        valid, rejected = parse_challenges(text)
+        self.rejected += rejected
+        return valid[:count]
+
+    def stats(self):
+        stock = {f"{rank}/{topic}": self.stock((rank, topic)) for rank, topic in BUCKETS}
+        return {"loaded": self.loaded, "pool_size": sum(len(ids) for ids in self._ids.values()),
+                "low_buckets": sum(1 for n in stock.values() if n < self.low), "served": self.served, "misses": self.misses,
+                "live": self.live_generated, "fallbacks": self.fallbacks, "refills": self.refills, "refill_failures": self.refill_failures,
+                "generated": self.generated, "rejected": self.rejected, "stock": stock}
+
+
+challenge_pool = ChallengePool()
@@ -0,0 +1,186 @@
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ai_gateway import gateway as ai
+from database import AsyncSessionLocal, IS_SQLITE
+from jobs import job_queue
+from metrics import estimate_tokens
+import models as models
+
+# --- AYARLAR ---
+CHAT_MEMORY_TOKENS = int(os.getenv("CHAT_MEMORY_TOKENS", "1200"))          # Özet + son mesajlar için sabit bütçe
+CHAT_MEMORY_RECENT = int(os.getenv("CHAT_MEMORY_RECENT", "4"))             # Bağlama aynen giren son K soru-cevap
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))         # Bütçenin özete ayrılan kısmı
+CHAT_MEMORY_IDLE_MINUTES = int(os.getenv("CHAT_MEMORY_IDLE_MINUTES", "120"))  # Bu kadar sessizlikten sonraki soru yeni konuşma sayılır
+CHAT_SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH", "20"))            # Bir özet işinde katlanan en fazla soru-cevap
+
+SUMMARY_PROMPT = """
+Rol: YKS koçunun not defteri.
+Aşağıda öğrenciyle önceki konuşmanın özeti ve yeni soru-cevaplar var.
+Görev: Hepsini tek bir güncel özet halinde yaz. Öğrencinin sorduğu konular, takıldığı yerler,
+verilen öneriler ve yarım kalan konular kalsın; selamlaşma ve tekrarlar çıksın.
+En fazla {words} kelime. Sadece özeti yaz.
+
+ÖNCEKİ ÖZET:
+{summary}
+
+YENİ SORU-CEVAPLAR:
+{exchanges}
+"""
+
+
+def exchange_text(question: str, answer: str) -> str:
+    return f"Öğrenci: {question}\nKoç: {answer}"
+
+def clip(text: str, tokens: int) -> str:
+    # Tahmini token sınırına kırp (baştan tutulur)
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:max(0, limit - 1)].rstrip() + "…"
+
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.ChatMemory).where(models.ChatMemory.user_id == user_id))
+
+
+@dataclass
+class Context:
+    """Bir soru için bağlam: prompt'a eklenecek metin ve özet işi gerekip gerekmediği."""
+    text: str = ""
+    tokens: int = 0
+    exchanges: int = 0
+    needs_refresh: bool = False
+    messages: list = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not self.text
+
+
+class ConversationMemory:
+    """
+    /ai-soru-sor için sohbet hafızası: kullanıcı başına kayan özet + özetlenmemiş son K soru-cevap,
+    toplamı CHAT_MEMORY_TOKENS'ı geçmez. Özet istek yolunda değil, bütçe taşınca kuyruktaki işte yenilenir.
+    Böylece sohbet uzasa da prompt boyutu sabit kalır.
+    """
+
+    def __init__(self, budget: int = CHAT_MEMORY_TOKENS, recent: int = CHAT_MEMORY_RECENT,
+                 summary_tokens: int = CHAT_SUMMARY_TOKENS, idle_minutes: int = CHAT_MEMORY_IDLE_MINUTES,
+                 summary_batch: int = CHAT_SUMMARY_BATCH, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.budget = budget
+        self.recent = recent
+        self.summary_tokens = summary_tokens
+        self.idle = timedelta(minutes=idle_minutes)
+        self.summary_batch = summary_batch
+        self.contexts = 0
+        self.context_tokens = 0
+        self.refreshes_queued = 0
+        self.summaries = 0
+
+    async def context(self, user_id: int) -> Context:
+        # Kendi kısa oturumu: AI cevabı beklenirken bağlantı havuzda kalsın
+        async with self.session_factory() as db:
+            memory = (await db.execute(select(models.ChatMemory.summary, models.ChatMemory.summarized_until)
+                                       .where(models.ChatMemory.user_id == user_id))).first()
+            summary, until = (memory.summary or "", memory.summarized_until or 0) if memory else ("", 0)
+
+            # Özetlenmemiş en yeni K+1: K'dan fazlası varsa özet işi gerekir
+            chat = models.ChatMessage
+            rows = (await db.execute(select(chat.user_question, chat.ai_response, chat.created_at)
+                                     .where(chat.user_id == user_id, chat.id > until)
+                                     .order_by(chat.id.desc()).limit(self.recent + 1))).all()
+        ctx = Context(needs_refresh=len(rows) > self.recent)
+        if rows and datetime.utcnow() - rows[0].created_at > self.idle:
+            return ctx   # Yeni konuşma: bağlamsız (cevap cache'ten gelebilir)
+        if not rows and not summary:
+            return ctx
+
+        summary = clip(summary, self.summary_tokens)
+        left = self.budget - estimate_tokens(summary)
+        for row in rows[:self.recent]:
+            text = exchange_text(row.user_question, row.ai_response)
+            tokens = estimate_tokens(text)
+            if tokens > left:
+                ctx.needs_refresh = ctx.needs_refresh or len(rows) > 1   # Pencere bütçeye sığmadı: eskileri özete katla
+                if not ctx.messages and left > 0: ctx.messages.append(clip(text, left))  # En yenisi kırpılarak da olsa girsin
+                break
+            ctx.messages.append(text)
+            left -= tokens
+
+        parts = []
+        if summary: parts.append(f"ÖNCEKİ KONUŞMANIN ÖZETİ:\n{summary}")
+        if ctx.messages: parts.append("SON KONUŞMALAR (eskiden yeniye):\n" + "\n\n".join(reversed(ctx.messages)))
+        ctx.text = "\n\n".join(parts)
+        ctx.tokens = estimate_tokens(ctx.text)
+        ctx.exchanges = len(ctx.messages)
+        self.contexts += 1
+        self.context_tokens += ctx.tokens
+        return ctx
+
+    @staticmethod
+    def prompt(system: str, question: str, ctx: Context) -> str:
+        if ctx.empty: return f"{system}\n\nSoru: {question}"
+        return f"{system}\n\n{ctx.text}\n\nÖğrencinin yeni sorusu öncekilerin devamı olabilir.\n\nSoru: {question}"
+
+    async def after_save(self, db: AsyncSession, user_id: int, ctx: Context) -> bool:
+        """Soru-cevap kaydedilirken, aynı transaction'da: gerekirse özet işini kuyruğa koy (kullanıcı başına bir tane)."""
+        if not ctx.needs_refresh: return False
+        memory = models.ChatMemory
+        insert = sqlite_insert if IS_SQLITE else pg_insert
+        await db.execute(insert(memory).values(user_id=user_id, summary="", summarized_until=0, refresh_queued=False)
+                         .on_conflict_do_nothing(index_elements=["user_id"]))
+        claimed = await db.execute(update(memory).where(memory.user_id == user_id, memory.refresh_queued == False)
+                                   .values(refresh_queued=True))
+        if claimed.rowcount:
+            job_queue.enqueue(db, "chat_summary", {"user_id": user_id})
+            self.refreshes_queued += 1
+        return bool(claimed.rowcount)
+
+    async def summarize(self, db: AsyncSession, user_id: int):
+        """Özet işi: son K dışındaki özetlenmemiş soru-cevapları (en fazla summary_batch) özete katlar."""
+        memory = (await db.execute(select(models.ChatMemory).where(models.ChatMemory.user_id == user_id))).scalars().first()
+        if memory is None: return   # Hesap silinmiş
+        chat = models.ChatMessage
+        rows = (await db.execute(select(chat.id, chat.user_question, chat.ai_response)
+                                 .where(chat.user_id == user_id, chat.id > (memory.summarized_until or 0))
+                                 .order_by(chat.id))).all()
+        # Bağlamda aynen kalacaklar: en yeni K'dan bütçeye sığanlar (en az 1); gerisi özete
+        keep, left = 0, self.budget - self.summary_tokens
+        for r in reversed(rows[-self.recent:]):
+            left -= estimate_tokens(exchange_text(r.user_question, r.ai_response))
+            if left < 0 and keep: break
+            keep += 1
+        fold = rows[:len(rows) - keep][:self.summary_batch]
+        if fold:
+            # Her soru-cevap kırpılır: özet işinin promptu da sınırlı kalsın
+            exchanges = "\n\n".join(clip(exchange_text(r.user_question, r.ai_response), self.budget // self.recent) for r in fold)
+            prompt = SUMMARY_PROMPT.format(words=self.summary_tokens * 3 // 4, summary=memory.summary or "Yok", exchanges=exchanges)
+            summarized_until = memory.summarized_until
+            await db.commit()  # Bağlantı AI cevabını beklerken havuza dönsün
+            text = await ai.generate(prompt, caller="chat_summary")
+            memory = (await db.execute(select(models.ChatMemory).where(models.ChatMemory.user_id == user_id)
+                                       .execution_options(populate_existing=True))).scalars().first()
+            if memory is None or memory.summarized_until != summarized_until: return   # Hesap silinmiş ya da başka iş özetlemiş
+            memory.summary = clip(text.strip(), self.summary_tokens)
+            memory.summarized_until = fold[-1].id
+            self.summaries += 1
+        memory.refresh_queued = False
+        memory.updated_at = datetime.utcnow()
+
+    async def summary_dead(self, db: AsyncSession, user_id: int):
+        # İş tamamen düştü: bayrağı aç ki bir sonraki taşmada yeniden denensin
+        await db.execute(update(models.ChatMemory).where(models.ChatMemory.user_id == user_id).values(refresh_queued=False))
+
+    def stats(self):
+        return {"contexts": self.contexts, "avg_context_tokens": self.context_tokens / self.contexts if self.contexts else 0.0,
+                "refreshes_queued": self.refreshes_queued, "summaries": self.summaries}
+
+
+conversation_memory = ConversationMemory()
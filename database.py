@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -10,12 +11,79 @@ load_dotenv()
 # 2. Veritabanı adresi
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not SQLALCHEMY_DATABASE_URL:
-    raise ValueError("🚨 HATA: DATABASE_URL bulunamadı! .env dosyasını kontrol et.")
+
+# Bağlantı havuzu ayarları (varsayılan 5+10 yerine açıkça)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))            # Havuzdan bağlantı bekleme süresi (sn)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))           # Bulut DB boştaki bağlantıyı keserse diye
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+IS_SQLITE = bool(SQLALCHEMY_DATABASE_URL) and SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+def require_url():
+    # Import'ta değil, açılışta (lifespan / migrate.py) kontrol edilir: araçlar ve testler main'i DB'siz import edebilsin
+    if not SQLALCHEMY_DATABASE_URL:
+        raise ValueError("🚨 HATA: DATABASE_URL bulunamadı! .env dosyasını kontrol et.")
+
+def async_url(url: str) -> str:
+    # Aynı DATABASE_URL'den asyncio sürücüsünü seç
+    if url.startswith("postgres://"): url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        # asyncpg "sslmode" tanımaz, "ssl" bekler
+        return "postgresql+asyncpg://" + url.split("://", 1)[1].replace("sslmode=", "ssl=")
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def pool_options() -> dict:
+    if IS_SQLITE: return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": DB_POOL_PRE_PING}
 
 # 3. Bulut veritabanına bağlanma işlemi (PostgreSQL)
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Engine'ler bağlantı açmaz; ilk bağlantı lifespan'de (check_connection) ya da ilk sorguda açılır
+# Senkron engine: şema kontrolü ve thread'de çalışan arka plan işleri (mail) için
+engine = None
+async_engine = None
+if SQLALCHEMY_DATABASE_URL:
+    sync_url = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    engine = create_engine(sync_url, **pool_options(),
+                           connect_args={} if IS_SQLITE else {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"})
+    # Asenkron engine: tüm route'lar bunu kullanır
+    async_engine = create_async_engine(async_url(SQLALCHEMY_DATABASE_URL), **pool_options(),
+                                       connect_args={} if IS_SQLITE else {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}})
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# expire_on_commit=False: commit sonrası nesneye erişim lazy-load (ve MissingGreenlet) tetiklemesin
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+
+def sync_schema():
+    """
+    create_all sadece eksik tabloları açar. Mevcut tablolara sonradan eklenen
+    sütunları (nullable) ve indexleri de burada tamamlıyoruz, veri silinmez.
+    Her import'ta değil, açıkça çalışır: `python migrate.py` (ya da AUTO_MIGRATE=1 ile lifespan'de).
+    """
+    require_url()
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing: continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+async def check_connection():
+    """Açılışta: URL'yi doğrular, havuzun ilk bağlantısını açar (hatalı ayar ilk istekte değil burada patlar)."""
+    require_url()
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
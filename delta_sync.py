@@ -0,0 +1,240 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import event, inspect, select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal, IS_SQLITE
+from pagination import encode_cursor, decode_cursor
+import models as models
+
+# --- AYARLAR ---
+SYNC_MAX_ROWS = int(os.getenv("SYNC_MAX_ROWS", "500"))              # Tür başına; delta bunu aşarsa tam senkron döner
+SYNC_CHAT_LIMIT = int(os.getenv("SYNC_CHAT_LIMIT", "50"))           # Tam senkronda son N mesaj (/chat-gecmisi ile aynı)
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))   # Silinme kayıtları bu kadar tutulur; daha eski cursor tam senkrona düşer
+SYNC_LOCAL_MAX_ENTRIES = int(os.getenv("SYNC_LOCAL_MAX_ENTRIES", "100000"))
+
+# İstemcide tutulan tablolar (yanıttaki anahtar). Satırın version'ı kullanıcının sayacından (user_sync_versions) alınır
+TRACKED = {models.Todo: "gorevler", models.ExamResult: "denemeler", models.ChatMessage: "sohbet", models.UserTarget: "hedef"}
+TOMBSTONED = (models.Todo, models.ExamResult)   # Tek tek silinebilenler (sohbet ve hedef sadece hesapla birlikte gider)
+UNSYNCED_ATTRS = {"version", "updated_at", "topics_indexed"}   # Değişmesi istemciyi ilgilendirmeyen sütunlar
+
+users_table = models.User.__table__
+versions_table = models.UserSyncVersion.__table__
+
+
+def bump(connection, user_id: int, now: datetime) -> Optional[int]:
+    # Sayaç satırı commit'e kadar kilitli: aynı kullanıcıya yazanlar sırayla numara alır,
+    # commit edilmiş sürümler hep kesintisiz bir önek oluşturur (cursor'dan küçükler kaçmaz).
+    # users satırına dokunulmaz (XP/giriş yazımlarıyla çekişmez). İlk artışta eski users.sync_version'dan devam edilir;
+    # kullanıcı yoksa satır eklenmez, None döner
+    insert = sqlite_insert if IS_SQLITE else pg_insert
+    seed = select(users_table.c.id, func.coalesce(users_table.c.sync_version, 0) + 1).where(users_table.c.id == user_id)
+    statement = (insert(versions_table).from_select(["user_id", "version"], seed)
+                 .on_conflict_do_update(index_elements=["user_id"], set_={"version": versions_table.c.version + 1})
+                 .returning(versions_table.c.version))
+    return connection.execute(statement).scalar()
+
+def sync_version(user_id_column):
+    """Kullanıcının güncel sürümü (korele alt sorgu); sayaç satırı henüz yoksa eski users.sync_version."""
+    counter = select(versions_table.c.version).where(versions_table.c.user_id == user_id_column).scalar_subquery()
+    legacy = select(users_table.c.sync_version).where(users_table.c.id == user_id_column).scalar_subquery()
+    return func.coalesce(counter, legacy, 0)
+
+async def current_version(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(select(sync_version(user_id))) or 0
+
+class CommittedVersions:
+    """
+    Bu worker'da commit edilen son sürüm, kullanıcı başına. Principal cache'teki sürüm
+    TTL kadar eski olabilir; kendi yazımlarımız ETag'e hemen yansısın diye ikisinin büyüğü kullanılır.
+    Başka worker'ın yazımı en geç PRINCIPAL_CACHE_TTL_SECONDS içinde görünür.
+    """
+
+    def __init__(self, max_entries: int = SYNC_LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # user_id -> sürüm
+        self._lock = threading.Lock()
+
+    def note(self, versions: dict):
+        with self._lock:
+            for user_id, version in versions.items():
+                if version is None or version <= self._data.get(user_id, 0): continue
+                self._data[user_id] = version
+                self._data.move_to_end(user_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, user_id: int, floor: int = 0) -> int:
+        return max(floor, self._data.get(user_id, 0))
+
+
+committed_versions = CommittedVersions()
+
+def _remember(session: Session, user_id: int, version: Optional[int]):
+    # Commit'e kadar oturumda bekler: geri alınan sürüm ETag'e girerse sonraki yazım aynı numarayı alır
+    if version is not None: session.info.setdefault("sync_versions", {})[user_id] = version
+
+@event.listens_for(Session, "after_commit")
+def publish_versions(session: Session):
+    versions = session.info.pop("sync_versions", None)
+    if versions: committed_versions.note(versions)
+
+@event.listens_for(Session, "after_rollback")
+def drop_versions(session: Session):
+    session.info.pop("sync_versions", None)
+
+def _changed(session: Session, obj) -> bool:
+    if obj in session.new: return True
+    state = inspect(obj)
+    return any(attr.history.has_changes() for attr in state.attrs if attr.key not in UNSYNCED_ATTRS)
+
+@event.listens_for(Session, "before_flush")
+def stamp_versions(session: Session, flush_context, instances):
+    """ORM üzerinden eklenen/değişen/silinen satırlar: kullanıcı başına flush'ta bir sürüm, silinenlere tombstone."""
+    touched = {}
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) in TRACKED and obj.user_id is not None and _changed(session, obj):
+            touched.setdefault(obj.user_id, []).append(obj)
+    gone = [obj for obj in session.deleted if isinstance(obj, TOMBSTONED) and obj.user_id is not None]
+    for obj in gone: touched.setdefault(obj.user_id, [])
+    if not touched: return
+
+    now = datetime.utcnow()
+    connection = session.connection()
+    versions = {user_id: bump(connection, user_id, now) for user_id in sorted(touched)}  # Sabit sıra: kilitler aynı sırayla
+    for user_id, version in versions.items(): _remember(session, user_id, version)
+    for user_id, objs in touched.items():
+        for obj in objs:
+            obj.version, obj.updated_at = versions[user_id], now
+    for obj in gone:
+        if versions[obj.user_id] is not None:
+            session.add(models.SyncTombstone(user_id=obj.user_id, entity=TRACKED[type(obj)], entity_id=obj.id,
+                                             version=versions[obj.user_id], deleted_at=now))
+
+async def next_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Toplu UPDATE/DELETE (ORM olayı tetiklemeyen) yazanlar için: satırlara elle verilecek sürüm."""
+    def run(session: Session) -> Optional[int]:
+        version = bump(session.connection(), user_id, datetime.utcnow())
+        _remember(session, user_id, version)
+        return version
+    return await db.run_sync(run)
+
+async def record_deleted(db: AsyncSession, user_id: int, model, ids: list):
+    # Toplu DELETE sonrası, aynı transaction'da. Commit çağıranın işi
+    if not ids: return
+    version = await next_version(db, user_id)
+    now = datetime.utcnow()
+    db.add_all([models.SyncTombstone(user_id=user_id, entity=TRACKED[model], entity_id=entity_id, version=version, deleted_at=now)
+                for entity_id in ids])
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.SyncTombstone).where(models.SyncTombstone.user_id == user_id))
+    await db.execute(delete(models.UserSyncVersion).where(models.UserSyncVersion.user_id == user_id))
+
+
+class DeltaSync:
+    """
+    /sync: istemcinin cursor'ından beri değişen satırlar ve silinenler, tek yanıtta.
+    Cursor = (kullanıcının sürümü, verildiği an). Cursor yoksa, tombstone'lar budanmışsa
+    ya da değişiklik SYNC_MAX_ROWS'u aşıyorsa tam senkron ("tam": true, istemci yerel kopyayı değiştirir).
+    İstemci önce silinenleri, sonra satırları uygular (SQLite'ta silinen id tekrar kullanılabilir).
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_rows: int = SYNC_MAX_ROWS,
+                 chat_limit: int = SYNC_CHAT_LIMIT, tombstone_days: int = SYNC_TOMBSTONE_DAYS):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.chat_limit = chat_limit
+        self.tombstone_days = tombstone_days
+        self.full = 0
+        self.delta = 0
+        self.overflow = 0
+        self.pruned = 0
+
+    def start(self, scheduler):
+        scheduler.add_job(self.prune, "interval", hours=6, id="sync-prune", max_instances=1, coalesce=True)
+
+    async def changes(self, db: AsyncSession, user_id: int, cursor: Optional[str], fields: dict) -> dict:
+        since, full = 0, True
+        if cursor:
+            since, issued_at = decode_cursor(cursor, [models.UserSyncVersion.version, models.SyncTombstone.deleted_at])
+            full = issued_at < datetime.utcnow() - timedelta(days=self.tombstone_days)
+        # Sürüm satırlardan önce okunur: sonradan commit edilenler bu turda da gelebilir (istemci için zararsız tekrar)
+        current = await current_version(db, user_id)
+        full = full or since > current   # DB geri yüklenmiş
+
+        out = None
+        if not full:
+            out = await self._delta(db, user_id, since, fields)
+            if out is None: self.overflow += 1
+        if out is None:
+            out = await self._full(db, user_id, fields)
+            self.full += 1
+        else:
+            self.delta += 1
+        out["cursor"] = encode_cursor([current, datetime.utcnow()])
+        return out
+
+    async def _delta(self, db: AsyncSession, user_id: int, since: int, fields: dict) -> Optional[dict]:
+        out = {"tam": False}
+        for model, key in TRACKED.items():
+            rows = await self._rows(db, model, fields[model], [model.user_id == user_id, model.version > since],
+                                    [model.version, model.id], self.max_rows + 1)
+            if len(rows) > self.max_rows: return None
+            if model is not models.UserTarget: out[key] = rows
+            elif rows: out[key] = rows[0]   # Hedef değişmediyse anahtar yok
+
+        tombstones = models.SyncTombstone
+        deleted = (await db.execute(select(tombstones.entity, tombstones.entity_id)
+                                    .where(tombstones.user_id == user_id, tombstones.version > since)
+                                    .order_by(tombstones.version).limit(self.max_rows + 1))).all()
+        if len(deleted) > self.max_rows: return None
+        out["silinen"] = {TRACKED[model]: [] for model in TOMBSTONED}
+        for entity, entity_id in deleted: out["silinen"][entity].append(entity_id)
+        return out
+
+    async def _full(self, db: AsyncSession, user_id: int, fields: dict) -> dict:
+        todo, exam, chat, target = models.Todo, models.ExamResult, models.ChatMessage, models.UserTarget
+        # Liste uçlarıyla aynı sıra: görevler eskiden yeniye, deneme/sohbet en yeniler (sayfa içinde eskiden yeniye)
+        todos = await self._rows(db, todo, fields[todo], [todo.user_id == user_id], [todo.id], self.max_rows + 1)
+        exams = await self._rows(db, exam, fields[exam], [exam.user_id == user_id], [exam.date.desc(), exam.id.desc()], self.max_rows + 1)
+        chats = await self._rows(db, chat, fields[chat], [chat.user_id == user_id], [chat.created_at.desc(), chat.id.desc()], self.chat_limit)
+        targets = await self._rows(db, target, fields[target], [target.user_id == user_id], [target.id], 1)
+        return {
+            "tam": True,
+            "gorevler": todos[:self.max_rows],
+            "denemeler": exams[:self.max_rows][::-1],
+            "sohbet": chats[::-1],
+            "hedef": targets[0] if targets else None,
+            "silinen": {TRACKED[model]: [] for model in TOMBSTONED},
+            # Kesilen listenin devamı liste uçlarından (cursor ile) çekilir
+            "devami_var": [key for key, rows in (("gorevler", todos), ("denemeler", exams)) if len(rows) > self.max_rows],
+        }
+
+    @staticmethod
+    async def _rows(db: AsyncSession, model, fields: tuple, where: list, order_by: list, limit: int) -> list:
+        rows = (await db.execute(select(*[getattr(model, f) for f in fields]).where(*where).order_by(*order_by).limit(limit))).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def prune(self):
+        try:
+            async with self.session_factory() as db:
+                cutoff = datetime.utcnow() - timedelta(days=self.tombstone_days)
+                result = await db.execute(delete(models.SyncTombstone).where(models.SyncTombstone.deleted_at < cutoff))
+                await db.commit()
+                self.pruned += result.rowcount
+        except Exception as e:
+            print(f"Sync Prune Hata: {e}")
+
+    def stats(self):
+        return {"full": self.full, "delta": self.delta, "overflow": self.overflow, "pruned_tombstones": self.pruned}
+
+
+change_feed = DeltaSync()
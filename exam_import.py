@@ -0,0 +1,225 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import asyncio
+from datetime import datetime
+from itertools import islice
+from types import SimpleNamespace
+from typing import Optional
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import IS_SQLITE
+import delta_sync
+import exam_stats
+import plan_batch
+import topic_stats
+import xp_ledger
+from jobs import job_queue
+import models as models
+
+# --- AYARLAR ---
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))              # Bir dosyada en fazla deneme
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "500"))                     # Bir executemany'deki satır
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "50"))            # Yanıtta listelenen en fazla hatalı satır
+EXAM_COMMENT_BATCH = int(os.getenv("EXAM_COMMENT_BATCH", "20"))          # Tek AI çağrısında yorumlanan deneme
+
+NUMERIC_FIELDS = ("tyt_turkce", "tyt_sosyal", "tyt_mat", "tyt_fen", "ayt_net")
+# Toplu yorum: her deneme için {id, yorum} (yapılandırılmış çıktı)
+COMMENT_OUTPUT = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "ARRAY",
+        "items": {"type": "OBJECT", "properties": {"id": {"type": "INTEGER"}, "yorum": {"type": "STRING"}},
+                  "required": ["id", "yorum"]},
+    },
+}
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name, kind = (filename or "").lower(), (content_type or "").lower()
+    if name.endswith(".csv") or "csv" in kind: return "csv"
+    if name.endswith((".jsonl", ".ndjson")) or "ndjson" in kind or "jsonl" in kind or "json-lines" in kind: return "jsonl"
+    return None
+
+def _mistakes(value: str):
+    # CSV hücresi: JSON nesnesi ya da "Türev:3|Optik:1" (ayraç | veya ;)
+    value = value.strip()
+    if not value: return {}
+    if value.startswith("{"): return json.loads(value)
+    pairs = (item.rsplit(":", 1) for item in re.split(r"[|;]", value) if item.strip())
+    return {topic.strip(): count.strip() for topic, count in pairs}
+
+def _csv_record(row: dict) -> dict:
+    record = {}
+    for key, value in row.items():
+        if key is None or value is None: continue   # Fazla/eksik sütun
+        key, value = key.strip(), value.strip()
+        if not value: continue   # Boş hücre: alan verilmemiş sayılır
+        if key in NUMERIC_FIELDS: value = value.replace(",", ".")   # "30,5"
+        elif key == "yanlis_konular": value = _mistakes(value)
+        record[key] = value
+    return record
+
+def read_records(file, fmt: str):
+    """(satır no, sözlük) üretir; dosya satır satır okunur, tamamı belleğe alınmaz."""
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            sample = text.read(4096)
+            text.seek(0)
+            delimiter = ";" if sample.split("\n", 1)[0].count(";") > sample.split("\n", 1)[0].count(",") else ","
+            reader = csv.DictReader(text, delimiter=delimiter)
+            for row in reader:
+                try: yield reader.line_num, _csv_record(row)
+                except ValueError: yield reader.line_num, None   # yanlis_konular okunamadı
+        else:
+            for line_no, line in enumerate(text, 1):
+                if not line.strip(): continue
+                try: yield line_no, json.loads(line)
+                except ValueError: yield line_no, None
+    finally:
+        text.detach()   # Alttaki dosya UploadFile'ın, kapatma
+
+def local_time(when: Optional[datetime]) -> datetime:
+    # Denemeler yerel saatle ve saat dilimsiz tutulur (/deneme-ekle: datetime.now())
+    if when is None: return datetime.now()
+    return when.astimezone().replace(tzinfo=None) if when.tzinfo else when
+
+def parse_comments(text: str) -> dict:
+    # Toplu yorum çıktısı -> {deneme id: yorum}; okunamayan öğe atlanır
+    try:
+        data = json.loads(text.replace("```json", "").replace("```", "").strip())
+    except ValueError:
+        return {}
+    comments = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict): continue
+        try: exam_id = int(item.get("id"))
+        except (TypeError, ValueError): continue
+        comment = str(item.get("yorum") or "").strip()
+        if comment: comments[exam_id] = comment
+    return comments
+
+
+class ExamImporter:
+    """
+    /deneme-ice-aktar: CSV ya da JSON lines dosyasındaki denemeleri tek transaction'da ekler.
+    Önce bütün dosya doğrulanır (thread'de, DB'ye dokunmadan); hata varsa hiçbir satır yazılmaz.
+    Sonra IMPORT_BATCH'lik parçalar executemany ile girer; konu ve istatistik özetleri parçalardan biriktirilip
+    sonda bir kez yazılır, XP tek olay. AI yorumları EXAM_COMMENT_BATCH'lik işlere bölünür (iş başına tek çağrı).
+    Dosya UploadFile'ın diskteki kopyasından okunur: bellek satır sayısıyla büyümez.
+    """
+
+    def __init__(self, max_rows: int = IMPORT_MAX_ROWS, max_bytes: int = IMPORT_MAX_BYTES, batch_size: int = IMPORT_BATCH,
+                 max_errors: int = IMPORT_MAX_ERRORS, comment_batch: int = EXAM_COMMENT_BATCH):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.comment_batch = comment_batch
+        self.imports = 0
+        self.rows = 0
+        self.rejected = 0
+        self.comment_jobs = 0
+        self.last_rows = 0
+        self.last_import_seconds = 0.0
+
+    def validate(self, file, fmt: str, row_model) -> tuple:
+        """(geçerli satır, hatalı satır, ilk max_errors hata). Geçerliler sınırı aşınca okumayı bırakır."""
+        count, errors, failed = 0, [], 0
+        for line_no, record in read_records(file, fmt):
+            error = None
+            if not isinstance(record, dict):
+                error = "Satır okunamadı."
+            else:
+                try: row_model.model_validate(record)
+                except ValidationError as e:
+                    error = "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'satir'}: {err['msg']}" for err in e.errors())
+            if error:
+                failed += 1
+                if len(errors) < self.max_errors: errors.append({"satir": line_no, "hata": error})
+                continue
+            count += 1
+            if count > self.max_rows: break
+        return count, failed, errors
+
+    def _batch_values(self, records, user_id: int, comments: bool, version: int, now: datetime) -> list:
+        """Sıradaki batch_size satırı okuyup INSERT değerlerine çevirir (thread'de çalışır)."""
+        return [{
+            "user_id": user_id, "exam_name": req.exam_name,
+            "tyt_turkce": req.tyt_turkce, "tyt_sosyal": req.tyt_sosyal, "tyt_mat": req.tyt_mat, "tyt_fen": req.tyt_fen,
+            "tyt_net": req.tyt_turkce + req.tyt_sosyal + req.tyt_mat + req.tyt_fen, "ayt_net": req.ayt_net,
+            "topic_mistakes": req.yanlis_konular,
+            "ai_comment": None if comments else "Analiz oluşturulamadı.", "ai_status": "pending" if comments else "failed",
+            "topics_indexed": True, "date": local_time(req.tarih), "version": version, "updated_at": now,
+        } for req in islice(records, self.batch_size)]
+
+    async def run(self, db: AsyncSession, user_id: int, file, fmt: str, row_model, xp_per_exam: int, comments: bool) -> dict:
+        """
+        Denemeleri ekler; commit çağıranın işi. Dönüş: eklenen sayı ve en son tarihli denemenin TYT neti
+        (son_tyt_net; dosyadaki en yeni deneme kullanıcının mevcut denemelerinden yeni değilse None).
+        """
+        started = time.perf_counter()
+        file.seek(0, os.SEEK_END)
+        if file.tell() > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Dosya çok büyük (en fazla {self.max_bytes // (1024 * 1024)} MB).")
+        count, failed, errors = await asyncio.to_thread(self.validate, file, fmt, row_model)
+        if failed:
+            self.rejected += 1
+            raise HTTPException(status_code=422, detail={"mesaj": f"{failed} satır hatalı, hiçbir deneme eklenmedi.",
+                                                         "hatali_satir": failed, "hatalar": errors})
+        if count > self.max_rows:
+            self.rejected += 1
+            raise HTTPException(status_code=413, detail=f"En fazla {self.max_rows} deneme yüklenebilir.")
+        if count == 0: raise HTTPException(status_code=400, detail="Dosyada deneme yok.")
+
+        # Toplu INSERT ORM olayını tetiklemez: /sync sürümü elle, tüm dosyaya bir tane
+        version, now = await delta_sync.next_version(db, user_id), datetime.utcnow()
+        # Geçmiş dönem yüklemesi mevcut neti geri götürmesin: kullanıcının şimdiye kadarki en yeni denemesi
+        newest_before = await db.scalar(select(func.max(models.ExamResult.date)).where(models.ExamResult.user_id == user_id))
+        latest, added, topics, summary = None, 0, {}, {}
+        records = (row_model.model_validate(record) for _, record in read_records(file, fmt))
+        # Dosya ikinci kez okunurken de ayrıştırma/doğrulama thread'de: event loop parça başına yalnızca DB'yi bekler
+        while values := await asyncio.to_thread(self._batch_values, records, user_id, comments, version, now):
+            # Sıralı RETURNING SQLite'ta satır satır çalışır. Orada yazma kilidi (next_version'dan beri) bizde:
+            # id'ler parametre sırasıyla artar, sıralamak yeter
+            ids = (await db.execute(insert(models.ExamResult).returning(models.ExamResult.id, sort_by_parameter_order=not IS_SQLITE),
+                                    values)).scalars().all()
+            if IS_SQLITE: ids = sorted(ids)
+            await topic_stats.collect_bulk(db, user_id, [(exam_id, v["date"], v["topic_mistakes"]) for exam_id, v in zip(ids, values)], topics)
+            exam_stats.collect_bulk([SimpleNamespace(id=exam_id, **v) for exam_id, v in zip(ids, values)], summary)
+            if comments:
+                payloads = [{"exam_ids": list(ids[i:i + self.comment_batch])} for i in range(0, len(ids), self.comment_batch)]
+                await job_queue.enqueue_many(db, "exam_comment_batch", payloads)
+                self.comment_jobs += len(payloads)
+            for v in values:
+                if latest is None or v["date"] >= latest["date"]: latest = v
+            added += len(values)
+
+        await topic_stats.apply_bulk(db, user_id, topics)
+        xp_ledger.award(db, user_id, xp_per_exam * added, "deneme")   # Tek olay, tek UPDATE
+        await exam_stats.apply_bulk(db, user_id, summary)
+        await plan_batch.discard(db, user_id)
+
+        self.imports += 1
+        self.rows += added
+        self.last_rows = added
+        self.last_import_seconds = time.perf_counter() - started
+        newer = newest_before is None or latest["date"] > newest_before
+        return {"eklenen": added, "son_tyt_net": latest["tyt_net"] if newer else None, "version": version}
+
+    def stats(self):
+        return {"imports": self.imports, "rows": self.rows, "rejected_files": self.rejected, "comment_jobs": self.comment_jobs,
+                "last_rows": self.last_rows, "last_import_seconds": self.last_import_seconds}
+
+
+exam_importer = ExamImporter()
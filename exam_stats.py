@@ -0,0 +1,301 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, date
+from typing import Optional
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, IS_SQLITE
+import delta_sync
+import models as models
+
+# --- AYARLAR ---
+YKS_DATE = date.fromisoformat(os.getenv("YKS_DATE", "2027-06-19"))   # Tahminin yapıldığı sınav günü
+STATS_CACHE_TTL_SECONDS = float(os.getenv("STATS_CACHE_TTL_SECONDS", "600"))
+STATS_CACHE_MAX_ENTRIES = int(os.getenv("STATS_CACHE_MAX_ENTRIES", "10000"))
+STATS_BACKFILL_USERS = int(os.getenv("STATS_BACKFILL_USERS", "200"))
+
+SUBJECTS = ("tyt_turkce", "tyt_sosyal", "tyt_mat", "tyt_fen", "tyt_net", "ayt_net")
+MAX_NET = {"tyt_turkce": 40.0, "tyt_sosyal": 20.0, "tyt_mat": 40.0, "tyt_fen": 20.0, "tyt_net": 120.0, "ayt_net": 80.0}
+RECENT_SIZE = 10
+EPOCH = datetime(2020, 1, 1)
+
+
+def day_of(when: Optional[datetime]) -> float:
+    return ((when or datetime.now()) - EPOCH).total_seconds() / 86400
+
+def exam_entry(exam) -> dict:
+    entry = {"id": exam.id, "x": day_of(exam.date), "name": exam.exam_name}
+    for s in SUBJECTS: entry[s] = float(getattr(exam, s) or 0.0)
+    return entry
+
+def brief(entry: Optional[dict]) -> Optional[dict]:
+    if entry is None: return None
+    return {"id": entry["id"], "exam_name": entry["name"], "tyt_net": entry["tyt_net"], "ayt_net": entry["ayt_net"]}
+
+
+# --- ÖZET SATIRI ---
+async def _locked_summary(db: AsyncSession, user_id: int) -> models.UserExamStats:
+    query = select(models.UserExamStats).where(models.UserExamStats.user_id == user_id).with_for_update()
+    row = (await db.execute(query)).scalars().first()
+    if row is None:
+        insert = sqlite_insert if IS_SQLITE else pg_insert
+        await db.execute(insert(models.UserExamStats).values(user_id=user_id, ready=False)
+                         .on_conflict_do_nothing(index_elements=["user_id"]))
+        row = (await db.execute(query)).scalars().first()
+    return row
+
+async def _recent(db: AsyncSession, user_id: int) -> list:
+    rows = (await db.execute(select(models.ExamResult).where(models.ExamResult.user_id == user_id)
+                             .order_by(models.ExamResult.date.desc(), models.ExamResult.id.desc()).limit(RECENT_SIZE))).scalars().all()
+    return [exam_entry(e) for e in reversed(rows)]
+
+async def _extreme(db: AsyncSession, user_id: int, highest: bool) -> Optional[dict]:
+    order = models.ExamResult.tyt_net.desc() if highest else models.ExamResult.tyt_net.asc()
+    exam = (await db.execute(select(models.ExamResult).where(models.ExamResult.user_id == user_id, models.ExamResult.tyt_net.is_not(None))
+                             .order_by(order, models.ExamResult.id).limit(1))).scalars().first()
+    return exam_entry(exam) if exam else None
+
+
+async def record_exam(db: AsyncSession, exam: models.ExamResult):
+    """Yeni denemeyi özete ekler (O(1) + son 10 listesi). Deneme flush edilmiş olmalı, commit çağıranın işi."""
+    row = await _locked_summary(db, exam.user_id)
+    if not row.ready:
+        await rebuild(db, [row])  # Yeni denemeyi de okur
+        return
+    entry = exam_entry(exam)
+    sums = {s: list(row.sums.get(s, [0.0, 0.0])) for s in SUBJECTS}
+    for s in SUBJECTS:
+        sums[s][0] += entry[s]
+        sums[s][1] += entry["x"] * entry[s]
+    row.sums = sums
+    row.exam_count += 1
+    row.sum_x += entry["x"]
+    row.sum_xx += entry["x"] ** 2
+
+    recent = sorted(row.recent + [entry], key=lambda e: (e["x"], e["id"]))
+    row.recent = recent[-RECENT_SIZE:]
+    if row.best is None or entry["tyt_net"] > row.best["tyt_net"]: row.best = entry
+    if row.worst is None or entry["tyt_net"] < row.worst["tyt_net"]: row.worst = entry
+    row.updated_at = datetime.utcnow()
+
+def collect_bulk(exams: list, totals: dict):
+    """Toplu içe aktarma, parça başına: denemelerin özete katkısı totals'ta birikir (boyutu deneme sayısıyla büyümez)."""
+    if not totals:
+        totals.update(exam_count=0, sum_x=0.0, sum_xx=0.0, sums={s: [0.0, 0.0] for s in SUBJECTS}, recent=[], best=None, worst=None)
+    for exam in exams:
+        entry = exam_entry(exam)
+        for s in SUBJECTS:
+            totals["sums"][s][0] += entry[s]
+            totals["sums"][s][1] += entry["x"] * entry[s]
+        totals["exam_count"] += 1
+        totals["sum_x"] += entry["x"]
+        totals["sum_xx"] += entry["x"] ** 2
+        totals["recent"].append(entry)
+        if totals["best"] is None or entry["tyt_net"] > totals["best"]["tyt_net"]: totals["best"] = entry
+        if totals["worst"] is None or entry["tyt_net"] < totals["worst"]["tyt_net"]: totals["worst"] = entry
+    totals["recent"] = sorted(totals["recent"], key=lambda e: (e["x"], e["id"]))[-RECENT_SIZE:]
+
+async def apply_bulk(db: AsyncSession, user_id: int, totals: dict):
+    """collect_bulk'ta birikenleri özete tek seferde ekler (record_exam'in toplu hali). Commit çağıranın işi."""
+    row = await _locked_summary(db, user_id)
+    if not row.ready:
+        await rebuild(db, [row])  # Yeni denemeleri de okur
+        return
+    row.sums = {s: [row.sums.get(s, [0.0, 0.0])[0] + totals["sums"][s][0], row.sums.get(s, [0.0, 0.0])[1] + totals["sums"][s][1]]
+                for s in SUBJECTS}
+    row.exam_count += totals["exam_count"]
+    row.sum_x += totals["sum_x"]
+    row.sum_xx += totals["sum_xx"]
+    row.recent = sorted(row.recent + totals["recent"], key=lambda e: (e["x"], e["id"]))[-RECENT_SIZE:]
+    if row.best is None or totals["best"]["tyt_net"] > row.best["tyt_net"]: row.best = totals["best"]
+    if row.worst is None or totals["worst"]["tyt_net"] < row.worst["tyt_net"]: row.worst = totals["worst"]
+    row.updated_at = datetime.utcnow()
+
+async def remove_exam(db: AsyncSession, exam: models.ExamResult):
+    """Silinecek denemeyi özetten çıkarır. Deneme silindikten sonra (flush edilmiş) çağrılır."""
+    row = await _locked_summary(db, exam.user_id)
+    if not row.ready:
+        await rebuild(db, [row])
+        return
+    entry = exam_entry(exam)
+    sums = {s: list(row.sums.get(s, [0.0, 0.0])) for s in SUBJECTS}
+    for s in SUBJECTS:
+        sums[s][0] -= entry[s]
+        sums[s][1] -= entry["x"] * entry[s]
+    row.sums = sums
+    row.exam_count = max(0, row.exam_count - 1)
+    row.sum_x -= entry["x"]
+    row.sum_xx -= entry["x"] ** 2
+
+    # Sadece silinen deneme listede/uçlardaysa indeksten tek sorgu
+    if any(e["id"] == exam.id for e in row.recent): row.recent = await _recent(db, exam.user_id)
+    if row.best and row.best["id"] == exam.id: row.best = await _extreme(db, exam.user_id, highest=True)
+    if row.worst and row.worst["id"] == exam.id: row.worst = await _extreme(db, exam.user_id, highest=False)
+    row.updated_at = datetime.utcnow()
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.UserExamStats).where(models.UserExamStats.user_id == user_id))
+
+
+# --- TOPLU YENİDEN HESAP (NumPy sadece burada) ---
+async def rebuild(db: AsyncSession, rows: list):
+    """Verilen (kilitli) özet satırlarını kullanıcıların tüm geçmişinden vektörel olarak yeniden hesaplar."""
+    import numpy as np
+
+    by_user = {row.user_id: row for row in rows}
+    cols = [getattr(models.ExamResult, s) for s in SUBJECTS]
+    result = await db.execute(select(models.ExamResult.user_id, models.ExamResult.id, models.ExamResult.date, models.ExamResult.exam_name, *cols)
+                              .where(models.ExamResult.user_id.in_(list(by_user)))
+                              .order_by(models.ExamResult.user_id, models.ExamResult.date, models.ExamResult.id))
+    data = result.all()
+
+    for row in rows:
+        row.exam_count, row.sum_x, row.sum_xx, row.sums, row.recent, row.best, row.worst = 0, 0.0, 0.0, {}, [], None, None
+        row.ready = True
+        row.updated_at = datetime.utcnow()
+    if not data: return
+
+    uid = np.array([d[0] for d in data])
+    x = np.array([day_of(d[2]) for d in data])
+    y = np.array([[float(v or 0.0) for v in d[4:]] for d in data])  # (n, ders)
+    starts = np.flatnonzero(np.r_[True, uid[1:] != uid[:-1]])
+    ends = np.r_[starts[1:], len(uid)]
+
+    counts = ends - starts
+    sum_x = np.add.reduceat(x, starts)
+    sum_xx = np.add.reduceat(x * x, starts)
+    sum_y = np.add.reduceat(y, starts, axis=0)
+    sum_xy = np.add.reduceat(y * x[:, None], starts, axis=0)
+    tyt = y[:, SUBJECTS.index("tyt_net")]
+
+    def entry(i):
+        d = data[i]
+        return {"id": d[1], "x": float(x[i]), "name": d[3], **{s: float(y[i, j]) for j, s in enumerate(SUBJECTS)}}
+
+    for g, (start, end) in enumerate(zip(starts, ends)):
+        row = by_user[int(uid[start])]
+        row.exam_count = int(counts[g])
+        row.sum_x, row.sum_xx = float(sum_x[g]), float(sum_xx[g])
+        row.sums = {s: [float(sum_y[g, j]), float(sum_xy[g, j])] for j, s in enumerate(SUBJECTS)}
+        row.recent = [entry(i) for i in range(max(start, end - RECENT_SIZE), end)]
+        segment = tyt[start:end]
+        row.best = entry(start + int(np.argmax(segment)))
+        row.worst = entry(start + int(np.argmin(segment)))
+
+async def backfill(session_factory=AsyncSessionLocal, batch: int = STATS_BACKFILL_USERS) -> int:
+    # Özeti olmayan (veya hazır olmayan) ve denemesi olan kullanıcılar, parça parça
+    done = 0
+    while True:
+        async with session_factory() as db:
+            ready_users = select(models.UserExamStats.user_id).where(models.UserExamStats.ready == True)
+            user_ids = (await db.execute(select(models.ExamResult.user_id).where(models.ExamResult.user_id.is_not(None), models.ExamResult.user_id.not_in(ready_users))
+                                         .distinct().limit(batch))).scalars().all()
+            if not user_ids: return done
+            rows = [await _locked_summary(db, user_id) for user_id in sorted(user_ids)]
+            await rebuild(db, [row for row in rows if not row.ready])
+            await db.commit()
+            for user_id in user_ids: stats_cache.invalidate(user_id)
+            done += len(user_ids)
+
+
+# --- ÖZETTEN İSTATİSTİK ---
+def compute(row: Optional[models.UserExamStats], today: Optional[date] = None) -> dict:
+    """Özet satırından O(ders) hesap; geçmiş taranmaz."""
+    today = today or date.today()
+    n = row.exam_count if row else 0
+    recent = row.recent if row else []
+    x_exam = day_of(datetime.combine(YKS_DATE, datetime.min.time()))
+    denom = n * row.sum_xx - row.sum_x ** 2 if n >= 2 else 0.0
+
+    trend, projection = {}, {}
+    for s in SUBJECTS:
+        if n == 0:
+            trend[s], projection[s] = 0.0, None
+            continue
+        sum_y, sum_xy = row.sums.get(s, [0.0, 0.0])
+        # Aynı gün girilen denemelerde payda ~0: eğilim yok, ortalama kullanılır
+        slope = (n * sum_xy - row.sum_x * sum_y) / denom if denom > 1e-9 * max(1.0, n * row.sum_xx) else 0.0
+        intercept = (sum_y - slope * row.sum_x) / n
+        trend[s] = round(slope * 30, 2)  # Net/ay
+        projection[s] = round(min(max(intercept + slope * x_exam, 0.0), MAX_NET[s]), 2)
+
+    def moving_average(k):
+        window = recent[-k:]
+        return {s: round(sum(e[s] for e in window) / len(window), 2) for s in SUBJECTS} if window else None
+
+    return {
+        "deneme_sayisi": n,
+        "son_tyt": recent[-1]["tyt_net"] if recent else None,
+        "ders_egilimi": trend,
+        "hareketli_ortalama": {"son_5": moving_average(5), "son_10": moving_average(10)},
+        "en_iyi_deneme": brief(row.best) if row else None,
+        "en_kotu_deneme": brief(row.worst) if row else None,
+        "sinav_gunu_tahmini": {"tarih": YKS_DATE.isoformat(), "kalan_gun": max((YKS_DATE - today).days, 0), **projection},
+    }
+
+
+class StatsCache:
+    """
+    Kullanıcı başına hesaplanmış istatistik; o kullanıcının bir sonraki yazımına kadar geçerli.
+    Kayıt hesaplandığı andaki sync sürümünü taşır; istek principal'ındaki sürüm daha yeniyse
+    (başka worker'da yazılmış) kayıt kullanılmaz. TTL sadece gün değişimi ve bellek için üst sınır.
+    """
+
+    def __init__(self, ttl: float = STATS_CACHE_TTL_SECONDS, max_entries: int = STATS_CACHE_MAX_ENTRIES,
+                 session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self._data = OrderedDict()  # user_id -> (expires_at, stats)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: int, min_version: int = 0) -> dict:
+        return (await self.get_versioned(user_id, min_version))[0]
+
+    async def get_versioned(self, user_id: int, min_version: int = 0) -> tuple:
+        # (istatistik, hesaplandığı andaki sync sürümü): ETag gövdeden daha yeni bir sürüm göstermesin
+        # min_version: isteği yapanın bildiği sürüm (Principal.sync_version); kayıt bundan eskiyse yeniden hesaplanır
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is not None and item[0] >= time.monotonic() and item[2] >= min_version:
+                self._data.move_to_end(user_id)
+                self.hits += 1
+                return item[1], item[2]
+            self.misses += 1
+
+        async with self.session_factory() as db:
+            # Sürüm özetten önce okunur: özet en az bu sürüm kadar yeni
+            version = await delta_sync.current_version(db, user_id)
+            row = (await db.execute(select(models.UserExamStats).where(models.UserExamStats.user_id == user_id))).scalars().first()
+            if row is None or not row.ready:
+                # Backfill henüz bu kullanıcıya gelmedi
+                row = await _locked_summary(db, user_id)
+                if not row.ready: await rebuild(db, [row])
+                await db.commit()
+        stats = compute(row)
+        if self.ttl > 0:
+            with self._lock:
+                self._data[user_id] = (time.monotonic() + self.ttl, stats, version)
+                self._data.move_to_end(user_id)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+        return stats, version
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "size": len(self._data)}
+
+
+stats_cache = StatsCache()
@@ -0,0 +1,82 @@
+import os
+import zlib
+from typing import Optional
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+
+try:
+    import brotli  # İsteğe bağlı: yoksa sadece gzip
+except ImportError:
+    brotli = None
+
+# --- AYARLAR ---
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))   # Küçük gövdede sıkıştırma kazandırmaz
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))              # gzip 1-9 (9: CPU'ya değmez)
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))              # brotli 0-11, dinamik yanıt için orta
+
+
+# --- ETAG / 304 ---
+# ETag gövdeden değil, gövdeyi belirleyen ucuz değerlerden (sürüm sayacı, xp, sorgu) üretilir.
+# Kural: ETag'deki sürüm gövdeden yeni olamaz (eski olabilir: en kötü ihtimalle gereksiz bir 200).
+def etag(*parts) -> str:
+    # Zayıf ETag: aynı içerik gzip/brotli/düz farklı baytlarla gelir
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+def query_key(request: Request) -> str:
+    # limit/cursor/fields her sayfayı ayrı içerik yapar
+    return format(zlib.crc32(request.url.query.encode("utf-8")), "x")
+
+def _matches(header: Optional[str], tag: str) -> bool:
+    if not header: return False
+    if header.strip() == "*": return True
+    weak = tag[2:] if tag.startswith("W/") else tag
+    return any((t.strip()[2:] if t.strip().startswith("W/") else t.strip()) == weak for t in header.split(","))
+
+def not_modified(request: Request, response: Response, tag: str) -> Optional[Response]:
+    """If-None-Match eşleşirse 304 döner (gövde okunmaz, serileştirilmez); eşleşmezse ETag'i yanıta koyar."""
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}  # İstemci her seferinde sorar, değişmediyse 304
+    if _matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+# --- SIKIŞTIRMA ---
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_QUALITY, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None: self._compressor = brotli.Compressor(quality=self.quality)
+        data = self._compressor.process(body)
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Accept-Encoding'e göre br (brotli kuruluysa) ya da gzip; minimum_size altı ve
+    SSE akışları (text/event-stream) sıkıştırılmaz. 304'lerin gövdesi yok, dokunulmaz.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, compresslevel: int = COMPRESS_LEVEL):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = {item.split(";")[0].strip().lower() for item in Headers(scope=scope).get("accept-encoding", "").split(",")}
+        if brotli is not None and "br" in accepted:
+            responder = BrotliResponder(self.app, self.minimum_size, exclude_content_types=self.exclude_content_types)
+        elif "gzip" in accepted:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel,
+                                      thread_minimum_size=self.thread_minimum_size, exclude_content_types=self.exclude_content_types)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size, exclude_content_types=self.exclude_content_types)
+        await responder(scope, receive, send)
@@ -0,0 +1,164 @@
+import os
+import io
+import threading
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+if TYPE_CHECKING:
+    from PIL import Image  # Pillow ilk fotoğrafta yüklenir (açılışı yavaşlatmasın)
+
+import models as models
+
+# --- AYARLAR ---
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(12 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))       # Gemini'ye giden resmin en uzun kenarı
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+PHASH_BANDS = 8                                                   # 64 bitlik hash 8 bitlik 8 parçaya bölünür
+# 64 bitte kaç bit fark "aynı soru" sayılır. Varsayılan birebir eşleşme; bant araması en fazla PHASH_BANDS - 1'i garanti eder
+PHASH_MAX_DISTANCE = min(int(os.getenv("PHASH_MAX_DISTANCE", "0")), PHASH_BANDS - 1)
+FINE_HASH_SIZE = 32                                                          # İkinci kontrol: 32x32 = 1024 bitlik dHash
+FINE_HASH_MAX_DISTANCE = int(os.getenv("FINE_HASH_MAX_DISTANCE", "16"))   # 1024 bitte izin verilen fark (tek harf farkı ~20+)
+
+
+class PipelineStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0   # Kaba hash tuttu, ince hash tutmadı
+
+    def record_shrink(self, bytes_in: int, bytes_out: int):
+        with self._lock:
+            self.uploads += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def record_lookup(self, hit: bool, rejected: int = 0):
+        with self._lock:
+            self.lookups += 1
+            self.rejected += rejected
+            if hit: self.hits += 1
+
+    def snapshot(self):
+        return {
+            "uploads": self.uploads,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "rejected_candidates": self.rejected,
+        }
+
+stats = PipelineStats()
+
+
+# 1. YÜKLEME: Tamamını belleğe almadan önce limit kontrolü
+async def read_upload_capped(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    buf = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk: break
+        buf.extend(chunk)
+        if len(buf) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Fotoğraf çok büyük (en fazla {max_bytes // (1024 * 1024)} MB).")
+    if not buf: raise HTTPException(status_code=400, detail="Boş dosya.")
+    return bytes(buf)
+
+
+# 2-3. ÇÖZME + KÜÇÜLTME: JPEG'i draft modunda düşük çözünürlükte aç, sınırlı boyuta indirip yeniden kodla
+def shrink_image(data: bytes, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> Tuple["Image.Image", bytes]:
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("RGB", (max_side, max_side))  # Sadece JPEG'de etkili, DCT ölçeklemesiyle decode eder
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Resim okunamadı.")
+
+    image.thumbnail((max_side, max_side))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    jpeg = out.getvalue()
+    stats.record_shrink(len(data), len(jpeg))
+    return image, jpeg
+
+
+# 4. ALGISAL HASH: aday bulmak için 64 bit (9x8 dHash), doğrulamak için 1024 bit (33x32 dHash)
+def dhash(image: "Image.Image", width: int = 8, height: int = 8) -> int:
+    from PIL import Image
+    small = image.convert("L").resize((width + 1, height), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(height):
+        for col in range(width):
+            left = pixels[row * (width + 1) + col]
+            right = pixels[row * (width + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+def content_crop(image: "Image.Image") -> "Image.Image":
+    # Gri ton + kontrast, sayfa kenarındaki boşluk kırpılır: hash yazıya bakar, kadraja değil
+    from PIL import ImageOps
+    gray = ImageOps.autocontrast(image.convert("L"))
+    box = gray.point(lambda p: 255 if p < 192 else 0).getbbox()
+    return gray.crop(box) if box else gray
+
+def image_hashes(image: "Image.Image") -> Tuple[int, int]:
+    # (kaba, ince); resize'lar event loop'u tutmasın diye threadpool'da çağrılır
+    page = content_crop(image)
+    return dhash(page), dhash(page, FINE_HASH_SIZE, FINE_HASH_SIZE)
+
+def hash_bands(value: int):
+    # 8 bitlik 8 parça: en fazla 7 bit farklı iki hash en az bir parçada birebir eşleşir (güvercin yuvası)
+    return [(value >> (8 * i)) & 0xFF for i in range(PHASH_BANDS)]
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# --- ÇÖZÜLMÜŞ SORU DEPOSU ---
+def band_columns():
+    return [getattr(models.SolvedQuestion, f"band{i}") for i in range(PHASH_BANDS)]
+
+async def find_solved(db: AsyncSession, phash: int, fine_hash: int, max_distance: int = PHASH_MAX_DISTANCE,
+                      fine_max_distance: int = FINE_HASH_MAX_DISTANCE) -> Optional[models.SolvedQuestion]:
+    """
+    Adaylar kaba hash'le bulunur (birebir ya da bant eşleşmesi), Hamming mesafesine göre sıralanır;
+    sunulan cevabın ince hash'i de yakın olmalı. İnce hash'i olmayan (eski) kayıtlar sunulmaz.
+    """
+    Q = models.SolvedQuestion
+    max_distance = min(max_distance, PHASH_BANDS - 1)
+    if max_distance <= 0:
+        condition = Q.phash == f"{phash:016x}"
+    else:
+        condition = or_(*(column == band for column, band in zip(band_columns(), hash_bands(phash))))
+    # Sadece id + hash'ler çekilir: sıralama tüm adaylar üzerinde, limit yok
+    rows = (await db.execute(select(Q.id, Q.phash, Q.fine_hash).where(condition, Q.fine_hash.is_not(None)))).all()
+    ranked = sorted((distance, row.id, row.fine_hash) for row in rows
+                    if (distance := hamming(int(row.phash, 16), phash)) <= max_distance)
+
+    best_id, rejected = None, 0
+    for _, row_id, row_fine in ranked:
+        if hamming(int(row_fine, 16), fine_hash) <= fine_max_distance:
+            best_id = row_id
+            break
+        rejected += 1
+
+    best = await db.get(Q, best_id) if best_id is not None else None
+    stats.record_lookup(best is not None, rejected)
+    if best is not None: best.hits += 1
+    return best
+
+def store_solved(db: AsyncSession, phash: int, fine_hash: int, answer: str):
+    bands = {f"band{i}": band for i, band in enumerate(hash_bands(phash))}
+    db.add(models.SolvedQuestion(phash=f"{phash:016x}", fine_hash=f"{fine_hash:0{FINE_HASH_SIZE * FINE_HASH_SIZE // 4}x}", answer=answer, **bands))
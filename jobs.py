@@ -0,0 +1,181 @@
+import os
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+import models as models
+
+# --- AYARLAR ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))                  # Aynı anda çalışan iş sayısı
+JOB_POLL_SECONDS = int(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))  # 10s, 20s, 40s, ...
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))    # Bu süredir "running" kalan iş çökmüş sayılır
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))             # Biten (done) işler bu kadar tutulur
+JOB_DEAD_RETENTION_DAYS = int(os.getenv("JOB_DEAD_RETENTION_DAYS", "30"))  # Dead-letter incelemeye daha uzun açık
+JOB_PRUNE_BATCH = 1000
+
+ACTIVE_STATUSES = ("pending", "running", "dead")   # stats() sadece bunları sayar; done satırları taranmaz
+
+
+class JobQueue:
+    """
+    jobs tablosu üzerinde süreç içi worker havuzu.
+    İşler isteğin kendi transaction'ında eklenir, dispatcher AsyncIOScheduler'da döner.
+    Handler'lar uzun beklemeden (AI çağrısı) önce db.commit() ile bağlantıyı havuza bırakır,
+    sonucu yazarken satırı yeniden okur (bu arada silinmiş olabilir).
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_base: int = JOB_RETRY_BASE_SECONDS, lease: int = JOB_LEASE_SECONDS,
+                 session_factory=AsyncSessionLocal):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.session_factory = session_factory
+        self._handlers = {}   # kind -> (async func(db, payload), async on_dead(db, payload))
+        self._running = set()
+        self._loop = None
+        self._dispatching = False
+        self.completed = 0
+        self.retried = 0
+        self.dead = 0
+        self.pruned = 0
+
+    def handler(self, kind: str, on_dead=None):
+        def decorator(func):
+            self._handlers[kind] = (func, on_dead)
+            return func
+        return decorator
+
+    def enqueue(self, db: AsyncSession, kind: str, payload: dict, max_attempts: Optional[int] = None) -> models.Job:
+        # Commit çağıranın işi: iş ve asıl kayıt aynı transaction'da yazılır
+        job = models.Job(kind=kind, payload=payload, status="pending", attempts=0,
+                         max_attempts=max_attempts or self.max_attempts, run_after=datetime.utcnow())
+        db.add(job)
+        return job
+
+    async def enqueue_many(self, db: AsyncSession, kind: str, payloads: list, max_attempts: Optional[int] = None):
+        # Toplu iş: tek executemany (ORM nesnesi ve id dönmez). Commit yine çağıranın işi
+        if not payloads: return
+        now = datetime.utcnow()
+        await db.execute(insert(models.Job), [{"kind": kind, "payload": payload, "status": "pending", "attempts": 0,
+                                               "max_attempts": max_attempts or self.max_attempts, "run_after": now}
+                                              for payload in payloads])
+
+    def start(self, scheduler, interval: int = JOB_POLL_SECONDS):
+        self._loop = asyncio.get_running_loop()
+        scheduler.add_job(self.dispatch, "interval", seconds=interval, id="job-dispatcher", max_instances=1, coalesce=True)
+        scheduler.add_job(self.prune, "interval", hours=1, id="job-prune", max_instances=1, coalesce=True)
+
+    def notify(self):
+        # Yeni iş eklendi, poll süresini beklemeden dağıt (threadpool'dan da çağrılabilir)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.dispatch()))
+
+    async def dispatch(self):
+        if self._dispatching: return
+        self._dispatching = True
+        try:
+            free = self.workers - len(self._running)
+            if free <= 0: return
+            for job_id in await self._claim(free):
+                task = asyncio.create_task(self._run(job_id))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        except Exception as e:
+            print(f"Job Dispatch Hata: {e}")
+        finally:
+            self._dispatching = False
+
+    async def _claim(self, limit: int) -> list:
+        async with self.session_factory() as db:
+            now = datetime.utcnow()
+            # Çöken worker'dan kalan işler: worker'ı öldüren iş except'e hiç düşmez, deneme burada sayılır
+            expired = (models.Job.status == "running", models.Job.locked_at < now - timedelta(seconds=self.lease))
+            dead = (await db.execute(update(models.Job).where(*expired, models.Job.attempts + 1 >= models.Job.max_attempts).values(
+                status="dead", attempts=models.Job.attempts + 1, locked_at=None, updated_at=now, last_error="Lease süresi doldu (worker çöktü)."
+            ).returning(models.Job.kind, models.Job.payload))).all()
+            requeued = (await db.execute(update(models.Job).where(*expired).values(
+                status="pending", attempts=models.Job.attempts + 1, locked_at=None, updated_at=now, last_error="Lease süresi doldu (worker çöktü)."
+            ))).rowcount
+            for kind, payload in dead:
+                on_dead = self._handlers.get(kind, (None, None))[1]
+                if on_dead: await on_dead(db, payload)
+
+            candidates = (await db.execute(select(models.Job.id).where(
+                models.Job.status == "pending", models.Job.run_after <= now
+            ).order_by(models.Job.id).limit(limit))).scalars().all()
+
+            claimed = []
+            for job_id in candidates:
+                # Koşullu UPDATE: aynı işi iki worker alamaz
+                result = await db.execute(update(models.Job).where(models.Job.id == job_id, models.Job.status == "pending").values(
+                    status="running", locked_at=now))
+                if result.rowcount: claimed.append(job_id)
+            await db.commit()
+            self.retried += requeued
+            self.dead += len(dead)
+            return claimed
+
+    async def _run(self, job_id: int):
+        try:
+            async with self.session_factory() as db:
+                job = await db.get(models.Job, job_id)
+                func, on_dead = self._handlers.get(job.kind, (None, None))
+                try:
+                    if func is None: raise RuntimeError(f"Bilinmeyen iş türü: {job.kind}")
+                    await func(db, job.payload)
+                    job.status = "done"
+                    job.last_error = None
+                    self.completed += 1
+                except Exception as e:
+                    await db.rollback()
+                    job = await db.get(models.Job, job_id)
+                    job.attempts += 1
+                    job.last_error = f"{e}\n{traceback.format_exc()}"[-2000:]
+                    if job.attempts >= job.max_attempts:
+                        job.status = "dead"  # Dead-letter: elle incelenmesi gerekir
+                        self.dead += 1
+                        if on_dead: await on_dead(db, job.payload)
+                    else:
+                        job.status = "pending"
+                        self.retried += 1
+                        job.run_after = datetime.utcnow() + timedelta(seconds=self.retry_base * 2 ** (job.attempts - 1))
+                job.locked_at = None
+                job.updated_at = datetime.utcnow()
+                await db.commit()
+        except Exception as e:
+            print(f"Job Hata ({job_id}): {e}")
+
+    async def prune(self, retention_days: int = JOB_RETENTION_DAYS, dead_retention_days: int = JOB_DEAD_RETENTION_DAYS) -> int:
+        """Eski done/dead işleri parça parça siler (tek büyük DELETE tabloyu kilitlemesin)."""
+        now, total = datetime.utcnow(), 0
+        for status, days in (("done", retention_days), ("dead", dead_retention_days)):
+            while True:
+                async with self.session_factory() as db:
+                    ids = select(models.Job.id).where(models.Job.status == status,
+                                                      models.Job.updated_at < now - timedelta(days=days)).limit(JOB_PRUNE_BATCH)
+                    deleted = (await db.execute(delete(models.Job).where(models.Job.id.in_(ids)))).rowcount
+                    await db.commit()
+                total += deleted
+                if deleted < JOB_PRUNE_BATCH: break
+        self.pruned += total
+        return total
+
+    async def stats(self) -> dict:
+        # done sayısı tablodan değil süreç sayacından: metrik toplama tüm tabloyu GROUP BY'lamasın
+        async with self.session_factory() as db:
+            counts = dict((await db.execute(select(models.Job.status, func.count(models.Job.id))
+                                            .where(models.Job.status.in_(ACTIVE_STATUSES)).group_by(models.Job.status))).all())
+        return {"running_tasks": len(self._running), "workers": self.workers, **{status: counts.get(status, 0) for status in ACTIVE_STATUSES},
+                "completed": self.completed, "retried": self.retried, "dead_lettered": self.dead, "pruned": self.pruned}
+
+
+job_queue = JobQueue()
@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+from functools import lru_cache
+from datetime import datetime
+from typing import Optional
+
+from sortedcontainers import SortedList
+from sqlalchemy import select, func
+
+from database import AsyncSessionLocal
+from xp_ledger import pending_xp
+from response_cache import turkish_casefold
+import models as models
+
+# --- AYARLAR ---
+LEADERBOARD_RECONCILE_SECONDS = int(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "300"))  # Diğer worker'ların yazdığı XP en geç bu sürede gelir
+LEADERBOARD_LOAD_BATCH = int(os.getenv("LEADERBOARD_LOAD_BATCH", "10000"))
+
+
+@lru_cache(maxsize=4096)  # Bölüm sayısı az, 1M satırlık kurulumda her satırda yeniden normalize etmeyelim
+def department_key(department: Optional[str]) -> Optional[str]:
+    if not department: return None
+    return " ".join(turkish_casefold(department).split()) or None
+
+
+class Leaderboard:
+    """
+    Aktif kullanıcıların XP sıralaması. Her tablo (-xp, user_id) tutan bir SortedList:
+    ekleme/silme/sıra O(log n), ilk N O(log n + N). Kullanıcı adları tutulmaz (bellek),
+    ilk N için tek sorguyla çekilir.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._global = SortedList()
+        self._departments = {}   # bölüm anahtarı -> SortedList
+        self._users = {}         # user_id -> (xp, bölüm anahtarı)
+        self._pending = None     # Yeniden kurulum sürerken gelen güncellemeler (sonra tekrar uygulanır)
+        self.loaded = False
+        self.reconciles = 0
+        self.last_corrections = 0
+        self.last_reconcile_seconds = 0.0
+        self.last_reconcile_at = None
+
+    # --- GÜNCELLEME (XP değiştiren route'lar commit'ten sonra çağırır) ---
+    def update(self, user_id: int, xp: int, department: Optional[str] = None):
+        xp, key = xp or 0, department_key(department)
+        if self._pending is not None: self._pending[user_id] = (xp, key)
+        self._apply(user_id, xp, key)
+
+    def remove(self, user_id: int):
+        if self._pending is not None: self._pending[user_id] = None
+        self._discard(user_id)
+
+    def _apply(self, user_id: int, xp: int, key: Optional[str]):
+        old = self._users.get(user_id)
+        if old == (xp, key): return
+        if old is not None: self._discard(user_id)
+        entry = (-xp, user_id)
+        self._global.add(entry)
+        if key: self._departments.setdefault(key, SortedList()).add(entry)
+        self._users[user_id] = (xp, key)
+
+    def _discard(self, user_id: int):
+        old = self._users.pop(user_id, None)
+        if old is None: return
+        entry = (-old[0], user_id)
+        self._global.discard(entry)
+        board = self._departments.get(old[1])
+        if board is not None:
+            board.discard(entry)
+            if not board: del self._departments[old[1]]
+
+    # --- OKUMA ---
+    def _board(self, department: Optional[str]):
+        if department is None: return self._global
+        return self._departments.get(department_key(department))
+
+    def rank(self, user_id: int, department: Optional[str] = None) -> Optional[int]:
+        # Eşit XP aynı sırayı paylaşır: kendinden fazla XP'li kişi sayısı + 1
+        item = self._users.get(user_id)
+        board = self._board(department)
+        if item is None or board is None: return None
+        return board.bisect_left((-item[0], 0)) + 1
+
+    def top(self, n: int, department: Optional[str] = None) -> list:
+        board = self._board(department)
+        if not board: return []
+        result, rank = [], 0
+        for i, (neg_xp, user_id) in enumerate(board.islice(0, n)):
+            if i == 0 or -neg_xp != result[-1][2]: rank = i + 1
+            result.append((rank, user_id, -neg_xp))
+        return result
+
+    def size(self, department: Optional[str] = None) -> int:
+        board = self._board(department)
+        return len(board) if board else 0
+
+    # --- DB İLE UZLAŞTIRMA ---
+    async def _snapshot(self) -> list:
+        rows = []
+        async with self.session_factory() as db:
+            # XP: users.xp + henüz işlenmemiş defter olayları
+            query = (select(models.User.id, func.coalesce(models.User.xp, 0) + pending_xp(models.User.id), models.UserTarget.dream_department)
+                     .outerjoin(models.UserTarget, models.UserTarget.user_id == models.User.id)
+                     .where(models.User.is_active == True))
+            result = await db.stream(query.execution_options(yield_per=LEADERBOARD_LOAD_BATCH))
+            async for partition in result.partitions():
+                rows.extend(partition)
+        return rows
+
+    def _build(self, rows: list, old_users: dict):
+        users = {}
+        for user_id, xp, department in rows:
+            users[user_id] = (xp or 0, department_key(department))
+        entries = {}
+        for user_id, (xp, key) in users.items():
+            entries.setdefault(key, []).append((-xp, user_id))
+        departments = {key: SortedList(items) for key, items in entries.items() if key}
+        global_board = SortedList(e for items in entries.values() for e in items)
+        corrections = sum(1 for user_id, item in users.items() if old_users.get(user_id) != item) + \
+                      sum(1 for user_id in list(old_users) if user_id not in users)
+        return users, global_board, departments, corrections
+
+    async def reconcile(self):
+        """Tabloyu DB'den yeniden kurar; açılışta ve periyodik olarak çalışır, istekleri bloklamaz."""
+        if self._pending is not None: return
+        started = time.perf_counter()
+        self._pending = {}
+        try:
+            rows = await self._snapshot()
+            users, global_board, departments, corrections = await asyncio.to_thread(self._build, rows, self._users)
+            self._users, self._global, self._departments = users, global_board, departments
+            for user_id, item in self._pending.items():
+                if item is None: self._discard(user_id)
+                else: self._apply(user_id, *item)
+            self.last_corrections = corrections if self.loaded else 0
+            self.loaded = True
+            self.reconciles += 1
+            self.last_reconcile_at = datetime.utcnow()
+            self.last_reconcile_seconds = time.perf_counter() - started
+        except Exception as e:
+            print(f"Liderlik Hata: {e}")
+        finally:
+            self._pending = None
+
+    def start(self, scheduler, interval: int = LEADERBOARD_RECONCILE_SECONDS):
+        # İlk kurulum hemen (arka planda), sonra periyodik
+        scheduler.add_job(self.reconcile, "interval", seconds=interval, id="leaderboard-reconcile",
+                          max_instances=1, coalesce=True, next_run_time=datetime.now())
+
+    def stats(self):
+        return {"loaded": self.loaded, "users": len(self._users), "departments": len(self._departments),
+                "reconciles": self.reconciles, "last_corrections": self.last_corrections,
+                "last_reconcile_seconds": self.last_reconcile_seconds}
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.header import Header
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+import models as models
+
+# --- AYARLAR ---
+MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM", MAIL_USERNAME)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"   # Yerel test sunucusu (aiosmtpd) için 0
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_POLL_SECONDS = int(os.getenv("MAIL_POLL_SECONDS", "3"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE_SECONDS = int(os.getenv("MAIL_RETRY_BASE_SECONDS", "15"))   # 15s, 30s, 60s, ...
+MAIL_LEASE_SECONDS = int(os.getenv("MAIL_LEASE_SECONDS", "300"))
+MAIL_RETENTION_HOURS = int(os.getenv("MAIL_RETENTION_HOURS", "24"))         # Gönderilen/ölen satırlar bu kadar tutulur (gövdesiz)
+
+# Bağlantı kopması/ağ hataları: yeniden bağlanıp aynı mesajı bir kez daha dene
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, OSError)
+
+
+def build_message(sender: str, to_email: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = f"YKS Asistan <{sender}>"
+    msg['To'] = to_email
+    msg['Subject'] = Header(subject, 'utf-8')
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg
+
+
+class MailSender:
+    """
+    Outbox tablosunu toplu halde boşaltır. Tek bir oturum açmış SMTP bağlantısı
+    batch'ler arasında yeniden kullanılır, koparsa yeniden bağlanılır.
+    """
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, username=MAIL_USERNAME, password=MAIL_PASSWORD,
+                 sender=MAIL_FROM, starttls: bool = SMTP_STARTTLS, batch_size: int = MAIL_BATCH_SIZE,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS, retry_base: int = MAIL_RETRY_BASE_SECONDS,
+                 lease: int = MAIL_LEASE_SECONDS, session_factory=SessionLocal):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.session_factory = session_factory
+        self._smtp = None
+        self._lock = threading.Lock()
+        self._loop = None
+        # Metrikler
+        self.sent_total = 0
+        self.failed_total = 0
+        self.dead_total = 0
+        self.pruned_total = 0
+        self.reconnects = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sender and self.host)
+
+    # --- KUYRUĞA EKLEME ---
+    def queue(self, db: Session, to_email: str, subject: str, body: str) -> bool:
+        # Commit çağıranın işi: mail, kaydı oluşturan transaction ile birlikte yazılır
+        if not self.enabled: return False
+        db.add(models.OutboxMessage(to_email=to_email, subject=subject, body=body, status="pending",
+                                    attempts=0, next_attempt_at=datetime.utcnow()))
+        return True
+
+    def start(self, scheduler, interval: int = MAIL_POLL_SECONDS):
+        if not self.enabled: return
+        self._loop = asyncio.get_running_loop()
+        scheduler.add_job(self._tick, "interval", seconds=interval, id="mail-sender", max_instances=1, coalesce=True)
+        scheduler.add_job(self._prune_tick, "interval", hours=1, id="mail-prune", max_instances=1, coalesce=True)
+
+    def notify(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._tick()))
+
+    async def _tick(self):
+        # smtplib bloklayıcı, event loop'u tutmasın
+        await asyncio.to_thread(self.flush)
+
+    async def _prune_tick(self):
+        await asyncio.to_thread(self.prune)
+
+    # --- SMTP BAĞLANTISI ---
+    def _connect(self):
+        self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        if self.starttls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+        self.reconnects += 1
+
+    def _ensure_connection(self):
+        if self._smtp is None:
+            self._connect()
+            return
+        try:
+            if self._smtp.noop()[0] != 250: self._connect()
+        except CONNECTION_ERRORS:
+            self._connect()
+
+    def close(self):
+        if self._smtp is None: return
+        try: self._smtp.quit()
+        except Exception: pass
+        self._smtp = None
+
+    def _send(self, row: models.OutboxMessage):
+        msg = build_message(self.sender, row.to_email, row.subject, row.body)
+        try:
+            self._smtp.sendmail(self.sender, [row.to_email], msg.as_string())
+        except CONNECTION_ERRORS:
+            self._connect()
+            self._smtp.sendmail(self.sender, [row.to_email], msg.as_string())
+
+    # --- GÖNDERİM ---
+    def _claim(self, db: Session) -> list:
+        now = datetime.utcnow()
+        db.query(models.OutboxMessage).filter(
+            models.OutboxMessage.status == "sending", models.OutboxMessage.locked_at < now - timedelta(seconds=self.lease)
+        ).update({models.OutboxMessage.status: "pending"}, synchronize_session=False)
+
+        candidates = db.query(models.OutboxMessage.id).filter(
+            models.OutboxMessage.status == "pending", models.OutboxMessage.next_attempt_at <= now
+        ).order_by(models.OutboxMessage.id).limit(self.batch_size).all()
+
+        claimed = []
+        for (msg_id,) in candidates:
+            updated = db.query(models.OutboxMessage).filter(models.OutboxMessage.id == msg_id, models.OutboxMessage.status == "pending").update(
+                {models.OutboxMessage.status: "sending", models.OutboxMessage.locked_at: now}, synchronize_session=False)
+            if updated: claimed.append(msg_id)
+        db.commit()
+        return claimed
+
+    def flush(self) -> int:
+        """Bekleyen mailleri batch batch gönderir, gönderilen sayıyı döner."""
+        if not self._lock.acquire(blocking=False): return 0  # Başka bir flush zaten çalışıyor
+        sent = 0
+        db = self.session_factory()
+        try:
+            while True:
+                ids = self._claim(db)
+                if not ids: break
+                started = time.perf_counter()
+                rows = db.query(models.OutboxMessage).filter(models.OutboxMessage.id.in_(ids)).order_by(models.OutboxMessage.id).all()
+
+                try:
+                    self._ensure_connection()
+                    connection_error = None
+                except Exception as e:
+                    connection_error = e
+
+                for row in rows:
+                    try:
+                        if connection_error: raise connection_error
+                        self._send(row)
+                        row.status = "sent"
+                        row.sent_at = datetime.utcnow()
+                        row.last_error = None
+                        row.body = None   # Gövdede düz metin doğrulama kodu var, gönderildikten sonra tutulmaz
+                        sent += 1
+                        self.sent_total += 1
+                    except Exception as e:
+                        self._mark_failed(row, e)
+                    row.locked_at = None
+                db.commit()
+
+                self.batches += 1
+                self.last_batch_size = len(rows)
+                self.last_batch_seconds = time.perf_counter() - started
+                if connection_error:
+                    print(f"Mail Hata: {connection_error}")
+                    break
+        finally:
+            db.close()
+            self._lock.release()
+        return sent
+
+    def _mark_failed(self, row: models.OutboxMessage, error: Exception):
+        self.failed_total += 1
+        row.attempts += 1
+        row.last_error = str(error)[:1000]
+        if row.attempts >= self.max_attempts:
+            row.status = "dead"
+            row.body = None
+            self.dead_total += 1
+        else:
+            row.status = "pending"
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=self.retry_base * 2 ** (row.attempts - 1))
+
+    def prune(self, retention_hours: int = MAIL_RETENTION_HOURS) -> int:
+        """Gönderilmiş/ölmüş eski satırları siler (thread'de çalışır)."""
+        db = self.session_factory()
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+            deleted = db.query(models.OutboxMessage).filter(
+                models.OutboxMessage.status.in_(("sent", "dead")),
+                func.coalesce(models.OutboxMessage.sent_at, models.OutboxMessage.created_at) < cutoff,
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self.pruned_total += deleted
+        return deleted
+
+    def stats(self) -> dict:
+        db = self.session_factory()
+        try:
+            counts = dict(db.query(models.OutboxMessage.status, func.count(models.OutboxMessage.id)).group_by(models.OutboxMessage.status).all())
+        finally:
+            db.close()
+        return {
+            "queue_depth": counts.get("pending", 0) + counts.get("sending", 0),
+            "sent_total": self.sent_total,
+            "failed_total": self.failed_total,
+            "dead_total": self.dead_total,
+            "pruned_total": self.pruned_total,
+            "reconnects": self.reconnects,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_seconds": self.last_batch_seconds,
+            "last_batch_per_second": self.last_batch_size / self.last_batch_seconds if self.last_batch_seconds else 0.0,
+            **{f"status_{k}": v for k, v in counts.items()},
+        }
+
+
+mail_sender = MailSender()
@@ -1,39 +1,55 @@
 import os
-import io
 import sys
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.header import Header 
 import random
 import json
 from datetime import datetime, timedelta, date 
-from typing import Optional, Dict
-from io import BytesIO
+from typing import Optional, Dict, List
 import asyncio
-import traceback
-import time 
-import hashlib 
 
-# Konsol çıktı ayarı
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Response, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel 
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from dotenv import load_dotenv
-from PIL import Image 
-import google.generativeai as genai 
 
 # Importlar
 import models as models, schemas as schemas
-from database import SessionLocal, engine, Base
+from database import AsyncSessionLocal, async_engine, engine, sync_schema, check_connection
+from ai_gateway import gateway as ai
+from response_cache import tutor_cache
+import chat_memory
+from chat_memory import conversation_memory, Context
+import image_pipeline
+from jobs import job_queue
+from mail_outbox import mail_sender
+import topic_stats
+import exam_stats
+from exam_stats import stats_cache
+from leaderboard import leaderboard
+from activity import activity_tracker
+import plan_batch
+from plan_batch import plan_stager
+import delta_sync
+import challenges
+from challenges import challenge_pool
+import exam_import
+from exam_import import exam_importer
+from delta_sync import change_feed, committed_versions
+from http_cache import CompressionMiddleware, etag, query_key, not_modified
+from rate_limit import rate_limiter
+from metrics import metrics, MetricsMiddleware, metrics_allowed, render_gauges, component_samples, pool_samples, threadpool_samples, estimate_tokens
+import xp_ledger
+from xp_ledger import xp_flusher
+from pagination import keyset_page, parse_fields, set_next_cursor
+from auth_cache import Principal, principal_cache
+from password_hashing import password_hasher
 
 load_dotenv()
 
@@ -42,20 +58,17 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-MAIL_USERNAME = os.getenv("MAIL_USERNAME")
-MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 
-MODEL_NAME = "gemini-2.0-flash"
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"   # Şema kontrolü normalde deploy adımında: python migrate.py
+AI_WARMUP = os.getenv("AI_WARMUP", "1") == "1"         # Gemini SDK'sını açılıştan hemen sonra arka planda yükle
 
-# --- AI BAŞLATMA ---
-if GOOGLE_API_KEY:
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        print(f"✅ Google AI Bağlantısı Başarılı ({MODEL_NAME})")
-    except Exception as e:
-        print(f"🚨 API Başlatma Hatası: {e}")
+ai.quota = rate_limiter.model_quota  # Tüm Gemini çağrıları ortak bütçeden düşer
 
-Base.metadata.create_all(bind=engine)
+# SQL sorgu sayısı/süresi (istek başına ve toplam); senkron engine event loop'ta kullanılırsa ayrıca sayılır
+if engine is not None:
+    metrics.instrument_engine(engine, "sync", blocking=True)
+    metrics.instrument_engine(async_engine.sync_engine, "async")
 
 # --- YARDIMCI FONKSİYONLAR ---
 
@@ -79,8 +92,10 @@ def calculate_level(xp):
     # YKS LORDU: 30.000+ XP (Artık Sınava Hazırsın)
     return "YKS LORDU", 1.0
 
-def normalize_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+def update_leaderboard(user, xp: int):
+    # XP değiştiren route'lar commit'ten sonra çağırır (user: Principal veya target'ı yüklü User)
+    if user.is_active:
+        leaderboard.update(user.id, xp, user.target.dream_department if user.target else None)
 
 # --- Pydantic MODELLERİ ---
 # (schemas.py olmadığı için bazı modelleri burada tanımlıyoruz)
@@ -109,45 +124,56 @@ class DenemeEkleRequest(BaseModel):
     # Örn: {"Fonksiyonlar": 2, "Paragraf": 3}
     yanlis_konular: Dict[str, int] = {} 
 
-scheduler = AsyncIOScheduler()
+class DenemeIceAktarSatiri(DenemeEkleRequest):
+    # Toplu içe aktarmada dosyanın bir satırı; tarih verilmezse yükleme anı
+    tarih: Optional[datetime] = None
 
-#  MAIL FONKSİYONU 
-def send_email_func(to_email, subject, body):
-    if not MAIL_USERNAME or not MAIL_PASSWORD:
-        return False 
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = f"YKS Asistan <{MAIL_USERNAME}>"
-        msg['To'] = to_email
-        msg['Subject'] = Header(subject, 'utf-8') 
-        msg.attach(MIMEText(body, 'plain', 'utf-8')) 
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.ehlo()
-        server.starttls() 
-        server.login(MAIL_USERNAME, MAIL_PASSWORD)
-        server.sendmail(MAIL_USERNAME, to_email, msg.as_string())
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Mail Hata: {str(e)}")
-        return False
+scheduler = AsyncIOScheduler()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Konsol çıktı ayarı
+    if (sys.stdout.encoding or "").lower() != "utf-8" and hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8")
+
+    # --- VERİTABANI / AI BAŞLATMA --- (import'ta değil: import ucuz kalsın, hatalı ayar burada patlasın)
+    await check_connection()
+    if AUTO_MIGRATE:
+        await asyncio.to_thread(sync_schema)
+    if GOOGLE_API_KEY:
+        ai.configure(api_key=GOOGLE_API_KEY, model_name=MODEL_NAME)
+        print(f"✅ Google AI Ayarlandı ({MODEL_NAME})")
+        if AI_WARMUP:
+            scheduler.add_job(ai.warm, id="ai-warmup")  # SDK importu açılışı bekletmez
+
+    job_queue.start(scheduler)
+    mail_sender.start(scheduler)
+    scheduler.add_job(topic_stats.backfill, id="topic-backfill")  # Tek seferlik, eski denemeler için
+    scheduler.add_job(exam_stats.backfill, id="stats-backfill")
+    leaderboard.start(scheduler)
+    xp_flusher.start(scheduler)
+    activity_tracker.start(scheduler)
+    plan_stager.start(scheduler)
+    rate_limiter.start(scheduler)
+    change_feed.start(scheduler)
+    challenge_pool.start(scheduler)
+    scheduler.start()
     yield
+    await activity_tracker.flush()  # Bekleyen işaretler kaybolmasın
     if scheduler.running:
         scheduler.shutdown()
+    mail_sender.close()
+    password_hasher.shutdown()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(CompressionMiddleware)  # En dışta: metrikler sıkıştırılmamış gövdeyi ölçer
 
 # --- VERİTABANI BAĞLANTISI ---
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def create_access_token(data: dict):
@@ -156,28 +182,45 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    # Sadece kimlik gereken route'lar için: cache'ten döner, DB'ye gitmez
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None: raise HTTPException(status_code=401)
     except JWTError: raise HTTPException(status_code=401)
     
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None: raise HTTPException(status_code=401)
+    principal = await principal_cache.get(username)
+    if principal is None: raise HTTPException(status_code=401)
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    # Kullanıcı satırını değiştirecek route'lar için ORM nesnesi (birincil anahtarla tek sorgu)
+    # Async oturumda lazy-load yok: hedef de birlikte yüklenir
+    user = await db.get(models.User, principal.id, options=[joinedload(models.User.target)])
+    if user is None:
+        principal_cache.invalidate(principal.username)
+        raise HTTPException(status_code=401)
     return user
 
+def ai_rate_limit(route: str, cost: float = 1):
+    # AI route'ları: kullanıcı x route ve kullanıcı toplamı kovaları, limitler rütbeye göre (429 + Retry-After)
+    async def dependency(user: Principal = Depends(get_current_principal)):
+        rutbe, _ = calculate_level(user.xp)
+        await rate_limiter.check(user.id, rutbe, route, cost)
+    return Depends(dependency)
+
 # ==========================================
 #  ENDPOINTLER
 # ==========================================
 
 @app.post("/register")
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter((models.User.email == user.email) | (models.User.username == user.username)).first()
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = (await db.execute(select(models.User).where((models.User.email == user.email) | (models.User.username == user.username)))).scalars().first()
     if existing: raise HTTPException(status_code=400, detail="Kullanıcı zaten var.")
     
-    normalized_pw = normalize_password(user.password)
-    hashed_pw = pwd_context.hash(normalized_pw)
+    # bcrypt process havuzunda çalışır
+    hashed_pw = await password_hasher.hash(user.password)
     code = str(random.randint(100000, 999999))
     
     db_user = models.User(username=user.username, email=user.email, hashed_password=hashed_pw, is_active=False, verification_code=code)
@@ -192,61 +235,82 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
             target_tyt_net=user.targets.target_tyt_net
         ))
     
-    db.commit()
-    db.refresh(db_user)
+    # Mail aynı transaction'da outbox'a yazılır, SMTP beklenmez
+    mail_sender.queue(db, user.email, "Doğrulama Kodu", f"Kodun: {code}")
+    await db.commit()
+    mail_sender.notify()
     
-    send_email_func(user.email, "Doğrulama Kodu", f"Kodun: {code}")
     return {"durum": "basarili", "mesaj": "Kayıt alındı. Kod mail adresine gönderildi."}
 
 @app.post("/verify")
-def verify_email(req: VerifyRequest, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == req.email).first()
+async def verify_email(req: VerifyRequest, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(models.User).options(joinedload(models.User.target)).where(models.User.email == req.email))).scalars().first()
     if not user: raise HTTPException(status_code=404)
     if user.verification_code == req.code:
         user.is_active = True
         user.verification_code = None
-        db.commit()
+        await db.commit()
+        principal_cache.invalidate(user.username)
+        update_leaderboard(user, user.xp or 0)
         return {"durum": "basarili", "mesaj": "Doğrulandı."}
     raise HTTPException(status_code=400, detail="Hatalı kod.")
 
 @app.post("/token")
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form.username).first()
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(models.User).where(models.User.username == form.username))).scalars().first()
     if not user: raise HTTPException(status_code=401, detail="Hatalı giriş.")
     
-    normalized_input = normalize_password(form.password)
-    if not pwd_context.verify(normalized_input, user.hashed_password):
+    dogru, yeni_hash = await password_hasher.verify(form.password, user.hashed_password)
+    if not dogru:
         raise HTTPException(status_code=401, detail="Hatalı giriş.")
+    if yeni_hash:
+        # Work factor değişmiş: hash'i yeni ayarla güncelle
+        user.hashed_password = yeni_hash
+        await db.commit()
         
     if not user.is_active: raise HTTPException(status_code=403, detail="Onaylanmamış hesap.")
     return {"access_token": create_access_token({"sub": user.username}), "token_type": "bearer"}
 
 @app.delete("/hesap-sil")
-def delete_account(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_account(user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     try:
-        db.query(models.Todo).filter(models.Todo.user_id == user.id).delete()
-        db.query(models.ExamResult).filter(models.ExamResult.user_id == user.id).delete()
-        db.query(models.UserTarget).filter(models.UserTarget.user_id == user.id).delete()
-        db.query(models.ChatMessage).filter(models.ChatMessage.user_id == user.id).delete()
-        db.delete(user)
-        db.commit()
+        await db.execute(delete(models.Todo).where(models.Todo.user_id == user.id))
+        await topic_stats.remove_user(db, user.id)
+        await exam_stats.remove_user(db, user.id)
+        await xp_ledger.remove_user(db, user.id)
+        await plan_batch.remove_user(db, user.id)
+        await delta_sync.remove_user(db, user.id)
+        await chat_memory.remove_user(db, user.id)
+        await challenges.remove_user(db, user.id)
+        await db.execute(delete(models.ExamResult).where(models.ExamResult.user_id == user.id))
+        await db.execute(delete(models.UserTarget).where(models.UserTarget.user_id == user.id))
+        await db.execute(delete(models.ChatMessage).where(models.ChatMessage.user_id == user.id))
+        await db.delete(user)
+        await db.commit()
+        principal_cache.invalidate(user.username)
+        stats_cache.invalidate(user.id)
+        leaderboard.remove(user.id)
         return {"mesaj": "Hesap silindi."}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/profil")
-def get_profile(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def data_version(user: Principal) -> int:
+    # Bu worker'ın kendi yazımları hemen, diğerlerininki principal cache yenilenince
+    return committed_versions.get(user.id, user.sync_version)
+
+@app.get("/profil", response_model=schemas.ProfileResponse)
+async def get_profile(request: Request, response: Response, user: Principal = Depends(get_current_principal)):
+    payload = profile_payload(user)
+    # Gövdeyi belirleyenler: hedef (sürüm), xp, seri
+    if (cevap := not_modified(request, response, etag("p", user.id, user.sync_version, payload["xp"], payload["streak"]))): return cevap
+    return payload
+
+def profile_payload(user: Principal) -> dict:
+    # Salt okunur: günün ilk girişi bellekte işaretlenir, seri toplu olarak yazılır
     bugun = date.today()
-    dun = bugun - timedelta(days=1)
-    
-    if user.last_active_date != bugun:
-        if user.last_active_date == dun:
-            user.streak += 1 
-        else:
-            user.streak = 1 
-        user.last_active_date = bugun
-        db.commit()
+    activity_tracker.mark(user.id, user.last_active_date, bugun)
+    streak = activity_tracker.streak(user.id, user.streak, user.last_active_date, bugun)
     
     rutbe, ilerleme = calculate_level(user.xp)
     target = user.target
@@ -261,166 +325,323 @@ def get_profile(user: models.User = Depends(get_current_user), db: Session = Dep
         "xp": user.xp,
         "rutbe": rutbe,
         "ilerleme": ilerleme,
-        "streak": user.streak
+        "streak": streak
+    }
+
+@app.get("/liderlik")
+async def get_leaderboard(limit: int = Query(100, ge=1, le=100), bolum: bool = False,
+                          user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    # bolum=true: sadece aynı hedef bölümü seçenler arasında
+    if not leaderboard.loaded: raise HTTPException(status_code=503, detail="Sıralama hazırlanıyor.", headers={"Retry-After": "5"})
+    department = None
+    if bolum:
+        department = user.target.dream_department if user.target else None
+        if not department: raise HTTPException(status_code=400, detail="Hedef bölüm seçilmemiş.")
+
+    top = leaderboard.top(limit, department)
+    names = dict((await db.execute(select(models.User.id, models.User.username).where(models.User.id.in_([t[1] for t in top])))).all())
+    return {
+        "liste": [{"sira": sira, "kullanici_adi": names.get(user_id), "xp": xp} for sira, user_id, xp in top],
+        "benim_siram": leaderboard.rank(user.id, department),
+        "toplam": leaderboard.size(department),
     }
 
-@app.get("/gorevler")
-def get_todos(user: models.User = Depends(get_current_user)):
-    return user.todos
+# Liste uçları: ?limit=&cursor=&fields=  (sonraki sayfa X-Next-Cursor / Link header'ında)
+TODO_FIELDS = ("id", "user_id", "content", "is_completed")
+EXAM_FIELDS = ("id", "user_id", "exam_name", "tyt_turkce", "tyt_sosyal", "tyt_mat", "tyt_fen", "tyt_net", "ayt_net",
+               "topic_mistakes", "ai_comment", "ai_status", "date")
+CHAT_FIELDS = ("id", "user_question", "ai_response", "created_at")
+CHAT_DEFAULT_FIELDS = tuple(schemas.ChatMessageBase.model_fields)  # Eski yanıt şekli
+
+@app.get("/gorevler", response_model=List[schemas.TodoItem], response_model_exclude_unset=True)
+async def get_todos(request: Request, response: Response, limit: int = Query(100, ge=1), cursor: Optional[str] = None,
+                    fields: Optional[str] = None, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    # Sürüm değişmediyse 304: DB'ye gidilmez, gövde serileştirilmez
+    if (cevap := not_modified(request, response, etag("t", user.id, data_version(user), query_key(request)))): return cevap
+    items, next_cursor = await keyset_page(db, models.Todo, [models.Todo.user_id == user.id], ["id"],
+                                           parse_fields(fields, TODO_FIELDS, TODO_FIELDS), cursor, limit)
+    set_next_cursor(request, response, next_cursor)
+    return items
 
 @app.put("/gorev-yap/{todo_id}")
-def toggle_todo(todo_id: int, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    todo = db.query(models.Todo).filter(models.Todo.id == todo_id, models.Todo.user_id == user.id).first()
-    if todo:
-        todo.is_completed = not todo.is_completed
-        if todo.is_completed: user.xp += 10 
-        else: user.xp -= 10 
-        db.commit()
-    return {"mesaj": "Ok", "yeni_xp": user.xp}
+async def toggle_todo(todo_id: int, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    todo = (await db.execute(select(models.Todo).where(models.Todo.id == todo_id, models.Todo.user_id == user.id))).scalars().first()
+    if not todo: return {"mesaj": "Ok", "yeni_xp": user.xp}
+    todo.is_completed = not todo.is_completed
+    xp_ledger.award(db, user.id, 10 if todo.is_completed else -10, "gorev")
+    await db.commit()
+    principal_cache.invalidate(user.username)
+    yeni_xp = await xp_ledger.current_xp(db, user.id)
+    update_leaderboard(user, yeni_xp)
+    return {"mesaj": "Ok", "yeni_xp": yeni_xp}
 
 @app.delete("/gorevleri-temizle")
-def clear_todos(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    count = db.query(models.Todo).filter(models.Todo.user_id == user.id, models.Todo.is_completed == True).delete()
-    db.commit()
+async def clear_todos(db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    result = await db.execute(delete(models.Todo).where(models.Todo.user_id == user.id, models.Todo.is_completed == True)
+                              .returning(models.Todo.id))
+    silinen = result.scalars().all()
+    count = len(silinen)
+    await delta_sync.record_deleted(db, user.id, models.Todo, silinen)
+    await db.commit()
     return {"mesaj": f"{count} tamamlanmış görev temizlendi!"}
 
 # main.py içindeki create_ai_plan fonksiyonunu sil ve bunu yapıştır:
 
-@app.post("/plan-olustur")
-def create_ai_plan(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+async def check_unfinished_todos(db: AsyncSession, user: Principal):
     # 1. Yarım kalan iş kontrolü
-    unfinished_count = db.query(models.Todo).filter(models.Todo.user_id == user.id, models.Todo.is_completed == False).count()
+    unfinished_count = await db.scalar(select(func.count(models.Todo.id)).where(models.Todo.user_id == user.id, models.Todo.is_completed == False))
     if unfinished_count > 0:
         raise HTTPException(status_code=406, detail=f"🚫 Önce elindeki {unfinished_count} görevi bitir! Yarım iş bırakma.")
 
+@plan_stager.prompt_builder  # Gece toplu üretim de aynı promptu kullanır
+async def build_plan_prompt(db: AsyncSession, user: Principal) -> str:
+    # 2. SEVİYE ve HEDEF
+    rutbe, _ = calculate_level(user.xp)
+    target = user.target
+    hedef_siralamasi = target.ranking if target and target.ranking else "İlk 20.000"
+    
+    # 3. 🔥 EKSİK KONU ANALİZİ (YENİ!) 🔥
+    # Son 3 denemede en çok hata yapılan 5 konu (JSON açmadan, exam_topic_mistakes'ten)
+    kritik_eksikler = await topic_stats.window_mistakes(db, user.id, last_n=3, limit=5)
+    eksik_txt = ", ".join([f"{k} ({v} Hata)" for k, v in kritik_eksikler]) if kritik_eksikler else "Tespit edilen özel bir eksik yok."
+
+    # 4. STRATEJİ BELİRLEME
+    odak_konusu = ""
+    if rutbe == "Çaylak":
+        odak_konusu = "DURUM: %100 TYT KONU. Temel Matematik ve Paragraf ağırlıklı."
+    elif rutbe == "Çırak":
+        odak_konusu = "DURUM: %70 TYT - %30 AYT. Konu eksiklerini kapat."
+    elif rutbe == "Kalfa":
+        odak_konusu = "DURUM: %40 TYT (DENEME) - %60 AYT (KONU). AYT'ye yüklen."
+    else: 
+        odak_konusu = "DURUM: %100 SINAV MODU. Seri Denemeler ve Zor Sorular."
+
+    # Geçmiş bitenleri hatırlat
+    son_bitenler = (await db.execute(select(models.Todo).where(models.Todo.user_id == user.id, models.Todo.is_completed == True).order_by(models.Todo.id.desc()).limit(10))).scalars().all()
+    biten_txt = ", ".join([t.content for t in son_bitenler]) if son_bitenler else "Yok"
+
+    # 5. ZEKİ PROMPT (Eksiklere Odaklanan)
+    return f"""
+    ROL: Sert ve Nokta Atışı Yapan YKS Koçu.
+    ÖĞRENCİ: {rutbe}. Hedef: {hedef_siralamasi}.
+    
+    🚨 ACİL MÜDAHALE EDİLMESİ GEREKEN EKSİKLER (Deneme Analizi): 
+    {eksik_txt}
+    (Bu konulardan hata yapılmış. Programın EN AZ 2 MADDESİ bu eksikleri kapatmaya yönelik olmalı!)
+    
+    GENEL STRATEJİ: {odak_konusu}
+    GEÇMİŞTE YAPILANLAR: {biten_txt} (Tekrar etme).
+    
+    KURALLAR:
+    1. ASLA sohbet etme, giriş cümlesi yazma.
+    2. DOĞRUDAN EMİR VER: "Çöz", "İzle", "Tekrarla".
+    3. Deneme analizi kısmındaki eksik konulara öncelik ver.
+    
+    GÖREV: Bugün için 4 adet görev yaz.
+    
+    FORMAT:
+    - [Ders]: Konu - [Yapılacak İşlem]
+    """
+
+async def save_plan_tasks(db: AsyncSession, user_id: int, raw_text: str) -> list:
+    return await add_plan_todos(db, user_id, plan_batch.parse_plan_tasks(raw_text))
+
+async def add_plan_todos(db: AsyncSession, user_id: int, final_tasks: list) -> list:
+    for task in final_tasks:
+        db.add(models.Todo(content=task, user_id=user_id))
+    
+    await db.commit()
+    return final_tasks
+
+@app.post("/plan-olustur", dependencies=[ai_rate_limit("plan-olustur")])
+async def create_ai_plan(db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    await check_unfinished_todos(db, user)
+
+    # Gece hazırlanmış plan varsa AI'ya gitmeden ver
+    staged = await plan_stager.take(db, user.id)
+    if staged: return {"mesaj": "Eksiklerine göre plan revize edildi!", "gorevler": await add_plan_todos(db, user.id, staged)}
+
     try:
-        # 2. SEVİYE ve HEDEF
-        rutbe, _ = calculate_level(user.xp)
-        target = user.target
-        hedef_siralamasi = target.ranking if target and target.ranking else "İlk 20.000"
-        
-        # 3. 🔥 EKSİK KONU ANALİZİ (YENİ!) 🔥
-        # Son 3 denemedeki yanlış konuları çekiyoruz
-        son_denemeler = db.query(models.ExamResult).filter(models.ExamResult.user_id == user.id).order_by(models.ExamResult.date.desc()).limit(3).all()
-        
-        eksik_konular = {}
-        for exam in son_denemeler:
-            if exam.topic_mistakes:
-                for konu, hata_sayisi in exam.topic_mistakes.items():
-                    eksik_konular[konu] = eksik_konular.get(konu, 0) + hata_sayisi
-        
-        # En çok hata yapılan 5 konuyu seç
-        kritik_eksikler = sorted(eksik_konular.items(), key=lambda x: x[1], reverse=True)[:5]
-        eksik_txt = ", ".join([f"{k} ({v} Hata)" for k, v in kritik_eksikler]) if kritik_eksikler else "Tespit edilen özel bir eksik yok."
-
-        # 4. STRATEJİ BELİRLEME
-        odak_konusu = ""
-        if rutbe == "Çaylak":
-            odak_konusu = "DURUM: %100 TYT KONU. Temel Matematik ve Paragraf ağırlıklı."
-        elif rutbe == "Çırak":
-            odak_konusu = "DURUM: %70 TYT - %30 AYT. Konu eksiklerini kapat."
-        elif rutbe == "Kalfa":
-            odak_konusu = "DURUM: %40 TYT (DENEME) - %60 AYT (KONU). AYT'ye yüklen."
-        else: 
-            odak_konusu = "DURUM: %100 SINAV MODU. Seri Denemeler ve Zor Sorular."
-
-        # Geçmiş bitenleri hatırlat
-        son_bitenler = db.query(models.Todo).filter(models.Todo.user_id == user.id, models.Todo.is_completed == True).order_by(models.Todo.id.desc()).limit(10).all()
-        biten_txt = ", ".join([t.content for t in son_bitenler]) if son_bitenler else "Yok"
-
-        # 5. ZEKİ PROMPT (Eksiklere Odaklanan)
-        prompt = f"""
-        ROL: Sert ve Nokta Atışı Yapan YKS Koçu.
-        ÖĞRENCİ: {rutbe}. Hedef: {hedef_siralamasi}.
-        
-        🚨 ACİL MÜDAHALE EDİLMESİ GEREKEN EKSİKLER (Deneme Analizi): 
-        {eksik_txt}
-        (Bu konulardan hata yapılmış. Programın EN AZ 2 MADDESİ bu eksikleri kapatmaya yönelik olmalı!)
-        
-        GENEL STRATEJİ: {odak_konusu}
-        GEÇMİŞTE YAPILANLAR: {biten_txt} (Tekrar etme).
-        
-        KURALLAR:
-        1. ASLA sohbet etme, giriş cümlesi yazma.
-        2. DOĞRUDAN EMİR VER: "Çöz", "İzle", "Tekrarla".
-        3. Deneme analizi kısmındaki eksik konulara öncelik ver.
-        
-        GÖREV: Bugün için 4 adet görev yaz.
-        
-        FORMAT:
-        - [Ders]: Konu - [Yapılacak İşlem]
-        """
+        prompt = await build_plan_prompt(db, user)
 
         if not GOOGLE_API_KEY: return {"mesaj": "Bağlantı Yok", "gorevler": []}
 
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt)
-        raw_text = response.text.strip()
-        
-        # Temizleme
-        clean_tasks = []
-        for line in raw_text.split("\n"):
-            line = line.strip()
-            if len(line) < 10: continue
-            cleaned_line = line.replace("* ", "").strip()
-            if cleaned_line.startswith("- "): cleaned_line = cleaned_line[2:]
-            clean_tasks.append(cleaned_line)
-
-        final_tasks = clean_tasks[:4]
-        for task in final_tasks:
-            db.add(models.Todo(content=task, user_id=user.id))
-        
-        db.commit()
+        raw_text = await ai.generate(prompt)
+        final_tasks = await save_plan_tasks(db, user.id, raw_text)
         return {"mesaj": "Eksiklerine göre plan revize edildi!", "gorevler": final_tasks}
 
+    except HTTPException: raise
     except Exception as e:
         print(f"Plan Hata: {e}")
         raise HTTPException(status_code=500, detail="Plan oluşturulamadı.")
 
-@app.post("/ai-soru-sor")
-def ask_tutor(req: SoruIstegi, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    try:
-        if not GOOGLE_API_KEY: return {"cevap": "Bağlantı yok."}
-        target = user.target
-        
-        system_instruction = f"""
+# --- CANLI AKIŞ (SSE) ---
+def sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def with_first(first: str, chunks):
+    # Önceden çekilen ilk parçayı akışın başına geri ekler
+    if first: yield first
+    async for chunk in chunks: yield chunk
+
+@app.post("/plan-olustur/stream", dependencies=[ai_rate_limit("plan-olustur")])
+async def create_ai_plan_stream(db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    await check_unfinished_todos(db, user)
+    staged = await plan_stager.take(db, user.id)
+    if staged:
+        final_tasks = await add_plan_todos(db, user.id, staged)
+        return sse_response(iter([sse({"mesaj": "Eksiklerine göre plan revize edildi!", "gorevler": final_tasks}, event="son")]))
+    if not GOOGLE_API_KEY:
+        return sse_response(iter([sse({"mesaj": "Bağlantı Yok", "gorevler": []}, event="son")]))
+
+    prompt = await build_plan_prompt(db, user)
+    user_id = user.id
+    chunks = ai.stream(prompt)
+    first = await anext(chunks, "")  # Slot burada alınır; AI yoğunsa 503 akış başlamadan döner
+
+    async def events():
+        parts = []
+        try:
+            # İstemci koparsa bu generator iptal edilir; AI akışı da hemen kapansın (slot GC'yi beklemesin)
+            async with aclosing(chunks), aclosing(with_first(first, chunks)) as stream:
+                async for chunk in stream:
+                    parts.append(chunk)
+                    yield sse({"parca": chunk})
+
+            # Akış bitti: plan satırlarını temizle ve kaydet (istek oturumu kapanmış olabilir)
+            async with AsyncSessionLocal() as db_stream:
+                final_tasks = await save_plan_tasks(db_stream, user_id, "".join(parts))
+            yield sse({"mesaj": "Eksiklerine göre plan revize edildi!", "gorevler": final_tasks}, event="son")
+        except Exception as e:
+            print(f"Plan Akış Hata: {e}")
+            yield sse({"detail": "Plan oluşturulamadı."}, event="hata")
+
+    return sse_response(events())
+
+# --- AI HOCA ---
+# Kişisel bilgiler prompta yer tutucu olarak girer, cevap herkes için cache'lenebilir kalır
+TUTOR_SYSTEM_INSTRUCTION = """
         Sen YKS Koçusun.
-        ÖĞRENCİ: {user.username}, Hedef: {target.ranking if target else 'Belirsiz'}.
+        ÖĞRENCİ: {ogrenci}, Hedef: {hedef}.
+        Öğrencinin adını veya hedefini yazacaksan aynen "{ogrenci}" ve "{hedef}" yer tutucularını kullan.
         GÖREV EKLEME: Eğer ders önerirsen cümlenin sonuna "GOREV_EKLE: <Kısa Görev>" yaz.
         """
-        full_prompt = f"{system_instruction}\n\nSoru: {req.soru_metni}"
+
+def tutor_prompt(soru: str, ctx: Optional[Context] = None) -> str:
+    # Bağlam (özet + son mesajlar) varsa cevap kişiye özel olur, cache'e girmez
+    return conversation_memory.prompt(TUTOR_SYSTEM_INSTRUCTION, soru, ctx or Context())
+
+def personalize_answer(answer: str, username: str, hedef: str) -> str:
+    return answer.replace("{ogrenci}", username).replace("{hedef}", hedef)
+
+def tutor_hedef(user: Principal) -> str:
+    target = user.target
+    return target.ranking if target and target.ranking else "Belirsiz"
+
+async def save_tutor_answer(db: AsyncSession, user_id: int, soru: str, final_answer: str,
+                            ctx: Optional[Context] = None, prompt_tokens: int = 0) -> str:
+    ai_reply_to_show = final_answer
+    if "GOREV_EKLE:" in final_answer:
+        parts = final_answer.split("GOREV_EKLE:")
+        ai_reply_to_show = parts[0].strip()
+        raw_task = parts[1].strip()
+        try:
+            db.add(models.Todo(user_id=user_id, content=f"🤖 Hoca: {raw_task}"))
+            await db.commit()
+        except: await db.rollback()
+
+    db.add(models.ChatMessage(user_id=user_id, user_question=soru, ai_response=ai_reply_to_show, prompt_tokens=prompt_tokens))
+    ozet_isi = await conversation_memory.after_save(db, user_id, ctx or Context())
+    await db.commit()
+    if ozet_isi: job_queue.notify()
+    return ai_reply_to_show
+
+@app.post("/ai-soru-sor", dependencies=[ai_rate_limit("ai-soru-sor")])
+async def ask_tutor(req: SoruIstegi, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    try:
+        if not GOOGLE_API_KEY: return {"cevap": "Bağlantı yok."}
         
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(full_prompt)
-        final_answer = response.text
+        ctx = await conversation_memory.context(user.id)
+        final_answer, prompt_tokens = (await tutor_cache.get(req.soru_metni) if ctx.empty else None), 0
+        if final_answer is None:
+            prompt = tutor_prompt(req.soru_metni, ctx)
+            prompt_tokens = estimate_tokens(prompt)
+            final_answer = await ai.generate(prompt)
+            if ctx.empty: await tutor_cache.set(req.soru_metni, final_answer)
+        final_answer = personalize_answer(final_answer, user.username, tutor_hedef(user))
         
-        ai_reply_to_show = final_answer
-        if "GOREV_EKLE:" in final_answer:
-            parts = final_answer.split("GOREV_EKLE:")
-            ai_reply_to_show = parts[0].strip()
-            raw_task = parts[1].strip()
-            try:
-                db.add(models.Todo(user_id=user.id, content=f"🤖 Hoca: {raw_task}"))
-                db.commit()
-            except: db.rollback()
-
-        db.add(models.ChatMessage(user_id=user.id, user_question=req.soru_metni, ai_response=ai_reply_to_show))
-        db.commit()
-        return {"cevap": ai_reply_to_show}
+        return {"cevap": await save_tutor_answer(db, user.id, req.soru_metni, final_answer, ctx, prompt_tokens)}
+    except HTTPException: raise
     except Exception as e:
         return {"cevap": f"Hata: {str(e)}"}
 
-@app.post("/ai-koc-analiz")
-def ai_analyze(req: AiGoalRequest, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+# Akışta GOREV_EKLE işaretini ve yarım kalmış yer tutucuları göstermemek için sondan tutulan karakter sayısı
+STREAM_HOLD_CHARS = len("GOREV_EKLE:")
+
+@app.post("/ai-soru-sor/stream", dependencies=[ai_rate_limit("ai-soru-sor")])
+async def ask_tutor_stream(req: SoruIstegi, user: Principal = Depends(get_current_principal)):
+    if not GOOGLE_API_KEY:
+        return sse_response(iter([sse({"cevap": "Bağlantı yok."}, event="son")]))
+
+    user_id, username, hedef = user.id, user.username, tutor_hedef(user)
+    ctx = await conversation_memory.context(user_id)
+    cached, prompt_tokens = (await tutor_cache.get(req.soru_metni) if ctx.empty else None), 0
+    if cached is None:
+        prompt = tutor_prompt(req.soru_metni, ctx)
+        prompt_tokens = estimate_tokens(prompt)
+        chunks = ai.stream(prompt)
+        first = await anext(chunks, "")  # Slot burada alınır; AI yoğunsa 503 akış başlamadan döner
+
+    def visible(raw: str) -> str:
+        return personalize_answer(raw, username, hedef).split("GOREV_EKLE:")[0]
+
+    async def events():
+        sent = 0
+        try:
+            if cached is not None:
+                raw = cached
+            else:
+                raw = ""
+                # İstemci koparsa AI akışı hemen kapansın (slot GC'yi beklemesin)
+                async with aclosing(chunks), aclosing(with_first(first, chunks)) as stream:
+                    async for chunk in stream:
+                        raw += chunk
+                        text = visible(raw)
+                        safe = len(text) if "GOREV_EKLE:" in raw else len(text) - STREAM_HOLD_CHARS
+                        if safe > sent:
+                            yield sse({"parca": text[sent:safe]})
+                            sent = safe
+                if ctx.empty: await tutor_cache.set(req.soru_metni, raw)
+
+            text = visible(raw)
+            if len(text) > sent: yield sse({"parca": text[sent:]})
+
+            # Akış bitti: görev çıkarımı ve sohbet kaydı
+            async with AsyncSessionLocal() as db_stream:
+                reply = await save_tutor_answer(db_stream, user_id, req.soru_metni, personalize_answer(raw, username, hedef),
+                                                ctx, prompt_tokens)
+            yield sse({"cevap": reply}, event="son")
+        except Exception as e:
+            yield sse({"detail": f"Hata: {str(e)}"}, event="hata")
+
+    return sse_response(events())
+
+@app.post("/ai-koc-analiz", dependencies=[ai_rate_limit("ai-koc-analiz")])
+async def ai_analyze(req: AiGoalRequest, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     try:
         if not user.target:
             db.add(models.Target(user_id=user.id, ranking=req.siralama, dream_university=req.universite))
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user, ["target"])
         else:
             user.target.ranking = req.siralama
             user.target.dream_university = req.universite
-            db.commit()
+            await db.commit()
+        principal_cache.invalidate(user.username)
             
         mevcut_net = user.target.current_tyt_net if user.target else 0
         seviye = "BAŞLANGIÇ" if mevcut_net < 30 else "ORTA" if mevcut_net < 60 else "İYİ"
@@ -433,83 +654,62 @@ def ai_analyze(req: AiGoalRequest, user: models.User = Depends(get_current_user)
         
         if not GOOGLE_API_KEY: return {"unvan": "OFFLINE", "mesaj": "Kaydedildi."}
         
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt)
-        text = response.text.replace("```json", "").replace("```", "").strip()
+        text = (await ai.generate(prompt)).replace("```json", "").replace("```", "").strip()
         return json.loads(text)
     except Exception:
         return {"unvan": "KAYDEDİLDİ", "mesaj": "Hedef alındı."}
 
-@app.post("/soru-coz")
-async def solve_question(file: UploadFile = File(...), user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.post("/soru-coz", dependencies=[ai_rate_limit("soru-coz")])
+async def solve_question(file: UploadFile = File(...), user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
     try:
         if not GOOGLE_API_KEY: return {"cevap": "AI Yok"}
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(["Bu soruyu çöz:", image])
-        user.xp += 15
-        db.commit()
-        return {"cevap": response.text}
+        contents = await image_pipeline.read_upload_capped(file)
+        with metrics.phase("resim"):
+            image, jpeg = await run_in_threadpool(image_pipeline.shrink_image, contents)
+            phash, fine_hash = await run_in_threadpool(image_pipeline.image_hashes, image)
+        del contents
+
+        # Aynı soru daha önce çözüldüyse Gemini'ye hiç gitme
+        cozulmus = await image_pipeline.find_solved(db, phash, fine_hash)
+        if cozulmus:
+            cevap = cozulmus.answer
+        else:
+            cevap = await ai.generate(["Bu soruyu çöz:", {"mime_type": "image/jpeg", "data": jpeg}])
+            image_pipeline.store_solved(db, phash, fine_hash, cevap)
+        xp_ledger.award(db, user.id, 15, "soru")
+        await db.commit()
+        principal_cache.invalidate(user.username)
+        update_leaderboard(user, await xp_ledger.current_xp(db, user.id))
+        return {"cevap": cevap}
+    except HTTPException: raise
     except:
         return {"cevap": "Hata oluştu."}
 
-@app.post("/challenge-olustur")
-def create_challenge(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+@app.post("/challenge-olustur", response_model=schemas.Challenge, dependencies=[ai_rate_limit("challenge-olustur")])
+async def create_challenge(db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
     try:
         rutbe, _ = calculate_level(user.xp)
-        son_gorevler = db.query(models.Todo).filter(models.Todo.user_id == user.id).order_by(models.Todo.id.desc()).limit(3).all()
-        konu_baglam = ", ".join([t.content for t in son_gorevler]) if son_gorevler else "Genel YKS"
-        
-        prompt = f"""
-        Rol: Oyun Yapımcısı. Seviye: {rutbe}. Konu: {konu_baglam}.
-        Görev: Zorlu bir challenge metni yaz.
-        Format (JSON): {{ "baslik": "...", "aciklama": "...", "sure_dk": 45, "xp_degeri": 100 }}
-        Kural: Metin sonunda 'GÖREVİN: ... çözmek' yazmalı.
-        """
-        if not GOOGLE_API_KEY: raise Exception("API Yok")
-        
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt)
-        text = response.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(text)
+        son_gorevler = (await db.execute(select(models.Todo.content).where(models.Todo.user_id == user.id).order_by(models.Todo.id.desc()).limit(3))).scalars().all()
+        konu = challenges.topic_bucket(son_gorevler)
+
+        # Önce havuz (AI beklenmez); kullanıcı kovadakilerin hepsini görmüşse anında üretilir
+        challenge = await challenge_pool.take(db, user.id, rutbe, konu)
+        if challenge is None and GOOGLE_API_KEY:
+            challenge = await challenge_pool.live(rutbe, konu)
+        if challenge is None: raise Exception("Challenge yok")
+        await db.commit()
+        return challenge
+    except HTTPException: raise
     except:
-        return {"baslik": "Hata Avı", "aciklama": "Sistem hata verdi, sen 20 soru çöz.", "sure_dk": 30, "xp_degeri": 50}
+        return challenge_pool.fallback()
 
 # 👇 GÜNCELLENMİŞ DENEME EKLEME (KONU ANALİZLİ)
 @app.post("/deneme-ekle")
-def add_exam(req: DenemeEkleRequest, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+async def add_exam(req: DenemeEkleRequest, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
     toplam_tyt = req.tyt_turkce + req.tyt_sosyal + req.tyt_mat + req.tyt_fen
-    user.xp += 50
-    
-    # 1. AI YORUMU (YANLIŞ KONULARA GÖRE)
-    ai_tavsiyesi = "Analiz oluşturulamadı."
-    if GOOGLE_API_KEY and req.yanlis_konular:
-        try:
-            hatalar = ", ".join([f"{k} ({v} yanlış)" for k,v in req.yanlis_konular.items()])
-            prompt = f"""
-            Rol: Sert YKS Koçu. 
-            Öğrenci Denemesi: {req.exam_name}. Net: {toplam_tyt}.
-            🚨 EN ÇOK YANLIŞ YAPILAN KONULAR: {hatalar}.
-            
-            GÖREV: Sadece bu yanlış konulara odaklanan, nokta atışı bir eleştiri ve tavsiye ver.
-            Kısa ve net ol (Maks 2 cümle).
-            """
-            model = genai.GenerativeModel(MODEL_NAME)
-            response = model.generate_content(prompt)
-            ai_tavsiyesi = response.text.strip()
-        except Exception as e:
-            print(f"Analiz Hatası: {e}")
-    elif GOOGLE_API_KEY:
-        # Konu girilmediyse genel yorum
-        try:
-            prompt = f"Rol: Sert Koç. Net: {toplam_tyt}. Genel bir tavsiye ver."
-            model = genai.GenerativeModel(MODEL_NAME)
-            response = model.generate_content(prompt)
-            ai_tavsiyesi = response.text.strip()
-        except: pass
+    xp_ledger.award(db, user.id, 50, "deneme")
 
-    # 2. VERİTABANINA KAYIT
+    # 1. VERİTABANINA KAYIT (AI yorumu arka planda yazılacak)
     yeni_deneme = models.ExamResult(
         user_id=user.id,
         exam_name=req.exam_name,
@@ -520,57 +720,243 @@ def add_exam(req: DenemeEkleRequest, db: Session = Depends(get_db), user: models
         tyt_net=toplam_tyt,
         ayt_net=req.ayt_net,
         topic_mistakes=req.yanlis_konular, # 👇 YANLIŞLAR KAYDEDİLDİ
-        ai_comment=ai_tavsiyesi,
+        ai_comment=None if GOOGLE_API_KEY else "Analiz oluşturulamadı.",
+        ai_status="pending" if GOOGLE_API_KEY else "failed",
         date=datetime.now()
     )
     db.add(yeni_deneme)
-    if user.target: user.target.current_tyt_net = toplam_tyt
-    db.commit()
-    
-    return {"mesaj": "Kaydedildi!", "analiz": ai_tavsiyesi}
-
-@app.get("/deneme-gecmisi")
-def get_exams(user: models.User = Depends(get_current_user)):
-    return user.exam_results
-
-@app.get("/chat-gecmisi", response_model=list[schemas.ChatMessageBase])
-def get_chat_history(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(models.ChatMessage).filter(models.ChatMessage.user_id == user.id).order_by(models.ChatMessage.created_at.asc()).limit(50).all()
+    if user.target:
+        await db.execute(update(models.UserTarget).where(models.UserTarget.user_id == user.id)
+                         .values(current_tyt_net=toplam_tyt, version=await delta_sync.next_version(db, user.id), updated_at=datetime.utcnow()))
+    await db.flush()
+    await topic_stats.record_exam(db, yeni_deneme)
+    await exam_stats.record_exam(db, yeni_deneme)
+    await plan_batch.discard(db, user.id)  # Eksik konular değişti, gece planı bayat
+
+    # 2. AI YORUMU İŞİ (Aynı transaction'da kuyruğa girer)
+    if GOOGLE_API_KEY:
+        job_queue.enqueue(db, "exam_comment", {"exam_id": yeni_deneme.id})
+    await db.commit()
+    principal_cache.invalidate(user.username)
+    stats_cache.invalidate(user.id)
+    update_leaderboard(user, await xp_ledger.current_xp(db, user.id))
+    job_queue.notify()
+
+    return {"mesaj": "Kaydedildi!", "analiz": yeni_deneme.ai_comment or "Analiz hazırlanıyor...",
+            "deneme_id": yeni_deneme.id, "ai_durum": yeni_deneme.ai_status}
+
+@app.post("/deneme-ice-aktar")
+async def import_exams(file: UploadFile = File(...), db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    # Dönemlik toplu giriş (CSV ya da JSON lines, satırlar /deneme-ekle gövdesi + isteğe bağlı tarih)
+    fmt = exam_import.detect_format(file.filename, file.content_type)
+    if fmt is None: raise HTTPException(status_code=415, detail="Sadece CSV ya da JSON lines (.csv, .jsonl) yüklenebilir.")
+    sonuc = await exam_importer.run(db, user.id, file.file, fmt, DenemeIceAktarSatiri, xp_per_exam=50, comments=bool(GOOGLE_API_KEY))
+    if user.target and sonuc["son_tyt_net"] is not None:   # Sadece dosya mevcut denemelerden yeniyse
+        await db.execute(update(models.UserTarget).where(models.UserTarget.user_id == user.id)
+                         .values(current_tyt_net=sonuc["son_tyt_net"], version=sonuc["version"], updated_at=datetime.utcnow()))
+    await db.commit()
+    principal_cache.invalidate(user.username)
+    stats_cache.invalidate(user.id)
+    update_leaderboard(user, await xp_ledger.current_xp(db, user.id))
+    job_queue.notify()
+
+    return {"mesaj": f"{sonuc['eklenen']} deneme kaydedildi!", "eklenen": sonuc["eklenen"],
+            "ai_durum": "pending" if GOOGLE_API_KEY else "failed"}
+
+def build_exam_comment_prompt(exam: models.ExamResult) -> str:
+    # 1. AI YORUMU (YANLIŞ KONULARA GÖRE)
+    if exam.topic_mistakes:
+        hatalar = ", ".join([f"{k} ({v} yanlış)" for k,v in exam.topic_mistakes.items()])
+        return f"""
+        Rol: Sert YKS Koçu. 
+        Öğrenci Denemesi: {exam.exam_name}. Net: {exam.tyt_net}.
+        🚨 EN ÇOK YANLIŞ YAPILAN KONULAR: {hatalar}.
+        
+        GÖREV: Sadece bu yanlış konulara odaklanan, nokta atışı bir eleştiri ve tavsiye ver.
+        Kısa ve net ol (Maks 2 cümle).
+        """
+    # Konu girilmediyse genel yorum
+    return f"Rol: Sert Koç. Net: {exam.tyt_net}. Genel bir tavsiye ver."
+
+async def exam_comment_dead(db: AsyncSession, payload: dict):
+    exam = await db.get(models.ExamResult, payload["exam_id"])
+    if exam:
+        exam.ai_comment = "Analiz oluşturulamadı."
+        exam.ai_status = "failed"
+
+async def pending_exams(db: AsyncSession, exam_ids: list) -> list:
+    # populate_existing: AI beklenirken silinen/yorumlanan deneme oturumdaki eski kopyadan okunmasın
+    return (await db.execute(select(models.ExamResult).where(models.ExamResult.id.in_(exam_ids), models.ExamResult.ai_status == "pending")
+                             .order_by(models.ExamResult.date, models.ExamResult.id)
+                             .execution_options(populate_existing=True))).scalars().all()
+
+@job_queue.handler("exam_comment", on_dead=exam_comment_dead)
+async def exam_comment_job(db: AsyncSession, payload: dict):
+    exams = await pending_exams(db, [payload["exam_id"]])
+    if not exams: return  # Deneme bu arada silinmiş
+    prompt = build_exam_comment_prompt(exams[0])
+    await db.commit()  # Bağlantı AI cevabını beklerken havuza dönsün
+    yorum = (await ai.generate(prompt)).strip()
+    for exam in await pending_exams(db, [payload["exam_id"]]):
+        exam.ai_comment = yorum
+        exam.ai_status = "done"
+
+def build_exam_batch_prompt(exams: list) -> str:
+    # Toplu içe aktarılan denemeler: tek çağrıda her birine ayrı yorum
+    satirlar = "\n".join(
+        f"- id={e.id} | {e.exam_name} | TYT net: {e.tyt_net} | AYT net: {e.ayt_net} | Yanlışlar: "
+        + (", ".join(f"{k} ({v})" for k, v in e.topic_mistakes.items()) if e.topic_mistakes else "girilmedi")
+        for e in exams)
+    return f"""
+    Rol: Sert YKS Koçu.
+    Aşağıdaki her deneme için ayrı, nokta atışı bir eleştiri ve tavsiye yaz (Maks 2 cümle).
+    Yanlış konular girildiyse sadece o konulara odaklan. id'leri aynen kullan.
+
+    DENEMELER:
+    {satirlar}
+    """
 
-@app.get("/istatistikler")
-def get_stats(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def exam_comment_batch_dead(db: AsyncSession, payload: dict):
+    for exam in (await db.execute(select(models.ExamResult).where(models.ExamResult.id.in_(payload["exam_ids"]),
+                                                                  models.ExamResult.ai_status == "pending"))).scalars():
+        exam.ai_comment = "Analiz oluşturulamadı."
+        exam.ai_status = "failed"
+
+@job_queue.handler("exam_comment_batch", on_dead=exam_comment_batch_dead)
+async def exam_comment_batch_job(db: AsyncSession, payload: dict):
+    exams = await pending_exams(db, payload["exam_ids"])
+    if not exams: return  # Silinmiş ya da yorumlanmış
+    prompt = build_exam_batch_prompt(exams)
+    await db.commit()  # Bağlantı AI cevabını beklerken havuza dönsün
+    yorumlar = exam_import.parse_comments(await ai.generate(prompt, caller="exam_comment_batch",
+                                                            generation_config=exam_import.COMMENT_OUTPUT))
+    if not yorumlar: raise ValueError("Toplu yorum okunamadı")  # Tekrar denenir
+    for exam in await pending_exams(db, payload["exam_ids"]):
+        exam.ai_comment = yorumlar.get(exam.id, "Analiz oluşturulamadı.")
+        exam.ai_status = "done" if exam.id in yorumlar else "failed"
+
+async def chat_summary_dead(db: AsyncSession, payload: dict):
+    await conversation_memory.summary_dead(db, payload["user_id"])
+
+@job_queue.handler("chat_summary", on_dead=chat_summary_dead)
+async def chat_summary_job(db: AsyncSession, payload: dict):
+    await conversation_memory.summarize(db, payload["user_id"])
+
+@app.get("/deneme-gecmisi", response_model=List[schemas.ExamItem], response_model_exclude_unset=True)
+async def get_exams(request: Request, response: Response, limit: int = Query(50, ge=1), cursor: Optional[str] = None,
+                    fields: Optional[str] = None, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    if (cevap := not_modified(request, response, etag("e", user.id, data_version(user), query_key(request)))): return cevap
+    # En yeni sayfa önce gelir, cursor daha eski denemelere gider
+    items, next_cursor = await keyset_page(db, models.ExamResult, [models.ExamResult.user_id == user.id], ["date", "id"],
+                                           parse_fields(fields, EXAM_FIELDS, EXAM_FIELDS), cursor, limit, newest_first=True)
+    set_next_cursor(request, response, next_cursor)
+    return items
+
+@app.get("/chat-gecmisi", response_model=List[schemas.ChatItem], response_model_exclude_unset=True)
+async def get_chat_history(request: Request, response: Response, limit: int = Query(50, ge=1), cursor: Optional[str] = None,
+                           fields: Optional[str] = None, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    if (cevap := not_modified(request, response, etag("c", user.id, data_version(user), query_key(request)))): return cevap
+    # Son 50 mesaj (eskiden en eski 50 dönüyordu), cursor daha eski mesajlara gider
+    items, next_cursor = await keyset_page(db, models.ChatMessage, [models.ChatMessage.user_id == user.id], ["created_at", "id"],
+                                           parse_fields(fields, CHAT_FIELDS, CHAT_DEFAULT_FIELDS), cursor, limit, newest_first=True)
+    set_next_cursor(request, response, next_cursor)
+    return items
+
+@app.get("/istatistikler", response_model=schemas.StatsResponse)
+async def get_stats(request: Request, response: Response, user: Principal = Depends(get_current_principal)):
+    # Özet cache'teyse DB'ye gidilmez; sürüm özetin hesaplandığı an + hedef (principal), kalan gün günlük değişir
+    # Principal'daki sürüm cache'tekinden yeniyse (başka worker'da yazım) özet yeniden okunur
+    istatistik, surum = await stats_cache.get_versioned(user.id, user.sync_version)
+    tag = etag("s", user.id, surum, user.sync_version, istatistik["sinav_gunu_tahmini"]["kalan_gun"])
+    if (cevap := not_modified(request, response, tag)): return cevap
+    return await stats_payload(user, istatistik)
+
+async def stats_payload(user: Principal, istatistik: Optional[dict] = None) -> dict:
     target = user.target
-    son_deneme = db.query(models.ExamResult).filter(models.ExamResult.user_id == user.id).order_by(models.ExamResult.date.desc()).first()
-    mevcut_tyt = son_deneme.tyt_net if son_deneme else (target.current_tyt_net if target else 0)
+    # Özet satırından (deneme yazılana kadar bellekte), geçmiş taranmaz
+    istatistik = istatistik or await stats_cache.get(user.id, user.sync_version)
+    son_tyt = istatistik["son_tyt"]
+    mevcut_tyt = son_tyt if son_tyt is not None else (target.current_tyt_net if target else 0)
     return {
         "mevcut_tyt": mevcut_tyt,
         "hedef_bolum": target.dream_department if target else "Belirsiz",
-        "basari_orani": int((mevcut_tyt / (target.target_tyt_net or 120)) * 100) if target else 0
+        "basari_orani": int((mevcut_tyt / (target.target_tyt_net or 120)) * 100) if target else 0,
+        **{k: v for k, v in istatistik.items() if k != "son_tyt"},
     }
 
 @app.delete("/deneme-sil/{exam_id}")
-def delete_exam(exam_id: int, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    db.query(models.ExamResult).filter(models.ExamResult.id == exam_id, models.ExamResult.user_id == user.id).delete()
-    db.commit()
+async def delete_exam(exam_id: int, db: AsyncSession = Depends(get_db), user: Principal = Depends(get_current_principal)):
+    exam = (await db.execute(select(models.ExamResult).where(models.ExamResult.id == exam_id, models.ExamResult.user_id == user.id))).scalars().first()
+    if exam:
+        await topic_stats.remove_exam(db, exam_id)
+        await db.execute(delete(models.ExamResult).where(models.ExamResult.id == exam_id))
+        await exam_stats.remove_exam(db, exam)
+        await delta_sync.record_deleted(db, user.id, models.ExamResult, [exam_id])
+        await db.commit()
+        stats_cache.invalidate(user.id)
     return {"mesaj": "Silindi"}
+
+# Açılışta tek istek: /profil + /istatistikler + son cursor'dan beri değişen görev/deneme/sohbet/hedef ve silinenler
+SYNC_FIELDS = {models.Todo: TODO_FIELDS, models.ExamResult: EXAM_FIELDS, models.ChatMessage: CHAT_FIELDS,
+               models.UserTarget: ("ranking", "dream_university", "dream_department", "current_tyt_net", "target_tyt_net")}
+
+@app.get("/sync")
+async def sync(since: Optional[str] = None, user: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    degisenler = await change_feed.changes(db, user.id, since, SYNC_FIELDS)
+    # profil her seferinde tam: xp (XP olayları) ve seri (activity_tracker) ORM flush'ından geçmez, sürümle izlenemez;
+    # zaten principal'dan DB'ye gitmeden kurulan birkaç alan
+    return {"profil": profile_payload(user), "istatistikler": await stats_payload(user), **degisenler}
+# --- METRİKLER (Prometheus text formatı) ---
+# Modüllerin stats() sayaçları yks_component{component, key} gauge'ı olarak çıkar
+COMPONENT_STATS = {
+    "ai_gateway": ai.stats, "principal_cache": principal_cache.stats, "stats_cache": stats_cache.stats,
+    "tutor_cache": tutor_cache.stats, "password_hasher": password_hasher.stats, "job_queue": job_queue.stats,
+    "mail_outbox": lambda: run_in_threadpool(mail_sender.stats), "leaderboard": leaderboard.stats,
+    "xp_ledger": xp_flusher.stats, "activity": activity_tracker.stats, "plan_batch": plan_stager.stats,
+    "rate_limit": rate_limiter.stats, "sync": change_feed.stats, "chat_memory": conversation_memory.stats,
+    "challenge_pool": challenge_pool.stats, "exam_import": exam_importer.stats,
+}
+
+@metrics.collector
+async def runtime_gauges() -> list:
+    components = []
+    for name, stats in COMPONENT_STATS.items():
+        value = stats()
+        if asyncio.iscoroutine(value): value = await value
+        components.extend(component_samples(name, value))
+    return (render_gauges("yks_db_pool_connections", "Bağlantı havuzu durumu", pool_samples(async_engine, "async") + pool_samples(engine, "sync"))
+            + render_gauges("yks_threadpool_threads", "run_in_threadpool thread'leri (busy/total)", threadpool_samples())
+            + render_gauges("yks_component", "Modül sayaçları (stats())", components))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    # Route trafiği ve kuyruk iç yapısı dışarı açılmasın: METRICS_TOKEN / METRICS_ALLOW yoksa yokmuş gibi
+    if not metrics_allowed(request.headers.get("authorization"), request.client.host if request.client else None):
+        raise HTTPException(status_code=404)
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 from sqlalchemy import text
 
 from sqlalchemy import text
 
 @app.get("/tabloyu-duzelt")
-def fix_table_schema(db: Session = Depends(get_db)):
+async def fix_table_schema(db: AsyncSession = Depends(get_db)):
     """
     BU FONKSİYON SADECE TEK SEFERLİK KULLANIM İÇİNDİR.
     Eski 'exam_results' tablosunu siler ve yenisini (yeni sütunlarla) oluşturur.
     DİKKAT: Eski deneme kayıtların silinir!
     """
     try:
-        # 1. Eski tabloyu zorla sil
-        db.execute(text("DROP TABLE IF EXISTS exam_results CASCADE;"))
-        db.commit()
+        # 1. Eski tabloyu zorla sil (konu toplamları da ona bağlı)
+        await db.execute(delete(models.ExamTopicMistake))
+        await db.execute(delete(models.UserTopicStat))
+        await db.execute(delete(models.UserExamStats))
+        await db.execute(text("DROP TABLE IF EXISTS exam_results CASCADE;"))
+        await db.commit()
         
         # 2. Modellerdeki yeni yapıya göre tabloyu tekrar oluştur
-        models.Base.metadata.create_all(bind=engine)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
         
         return {"durum": "BAŞARILI", "mesaj": "ExamResult tablosu silindi ve 'topic_mistakes' sütunuyla yeniden oluşturuldu. Artık deneme ekleyebilirsin!"}
     except Exception as e:
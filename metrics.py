@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import asyncio
+import hmac
+import ipaddress
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+# --- AYARLAR ---
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))   # Bundan yavaş istekler faz dökümüyle loglanır (0 = kapalı)
+# /metrics varsayılan kapalı (404): token ya da izinli adres verilmedikçe açılmaz
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")                               # "Authorization: Bearer <token>" ile erişim
+METRICS_ALLOW = os.getenv("METRICS_ALLOW", "")                           # Token'sız erişebilen adresler/ağlar, ör. "127.0.0.1,10.0.0.0/8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 50000, 250000, 1000000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{escape(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# --- METRİK TİPLERİ (prometheus_client bağımlılığı olmadan, text format 0.0.4) ---
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series = {}   # label değerleri -> [kova sayıları..., +Inf sayısı, toplam]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((values, list(series)) for values, series in self._series.items())
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+def render_gauges(name: str, help: str, samples: list) -> list:
+    # samples: [(label dict, değer)] (toplama anında okunan anlık değerler)
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+# --- İSTEK BAĞLAMI ---
+class RequestMetrics:
+    __slots__ = ("route", "scope", "started", "sql_count", "sql_seconds", "ai_calls", "ai_seconds", "phases")
+
+    def __init__(self, route: str, scope: Optional[dict] = None):
+        self.route = route
+        self.scope = scope   # Route eşleşmesi istek bitmeden de okunabilsin
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.ai_calls = 0
+        self.ai_seconds = 0.0
+        self.phases = {}   # phase() ile işaretlenen bölümler -> saniye
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request", default=None)
+
+
+class Metrics:
+    """
+    Süreç içi metrikler. HTTP süreleri ASGI middleware'den, SQL engine event'lerinden,
+    Gemini çağrıları AI gateway'den gelir; /metrics Prometheus text formatında döner.
+    """
+
+    def __init__(self, slow_seconds: float = SLOW_REQUEST_SECONDS):
+        self.slow_seconds = slow_seconds
+        self.http_seconds = Histogram("yks_http_request_seconds", "HTTP istek süresi (route şablonu bazında)", ("method", "route", "status"))
+        self.http_sql_queries = Histogram("yks_http_request_sql_queries", "İstek başına SQL sorgu sayısı", ("route",), COUNT_BUCKETS)
+        self.http_sql_seconds = Histogram("yks_http_request_sql_seconds", "İstek başına toplam SQL süresi", ("route",))
+        self.sql_seconds = Histogram("yks_sql_query_seconds", "Tek SQL sorgusunun süresi", ("engine",))
+        self.sql_errors = Counter("yks_sql_errors_total", "Hata veren SQL sorguları", ("engine",))
+        self.ai_seconds = Histogram("yks_ai_call_seconds", "Gemini çağrı süresi (çağıran fonksiyon bazında)", ("caller", "mode"))
+        self.ai_errors = Counter("yks_ai_errors_total", "Hata veren Gemini çağrıları", ("caller", "error"))
+        self.ai_prompt_chars = Histogram("yks_ai_prompt_chars", "Prompt boyutu (karakter, resimlerde bayt)", ("caller",), SIZE_BUCKETS)
+        self.ai_response_chars = Histogram("yks_ai_response_chars", "Cevap boyutu (karakter)", ("caller",), SIZE_BUCKETS)
+        self.ai_prompt_tokens = Histogram("yks_ai_prompt_tokens", "Çağrı başına prompt token (Gemini usage_metadata, yoksa tahmin)", ("caller",), TOKEN_BUCKETS)
+        self.slow_requests = Counter("yks_slow_requests_total", "SLOW_REQUEST_SECONDS'tan yavaş istekler", ("route",))
+        self.sql_on_loop = Counter("yks_sql_blocking_on_event_loop_total", "Event loop thread'inde çalışan senkron SQL sorguları", ("route",))
+        self._instruments = [self.http_seconds, self.http_sql_queries, self.http_sql_seconds, self.sql_seconds, self.sql_errors,
+                             self.ai_seconds, self.ai_errors, self.ai_prompt_chars, self.ai_prompt_tokens, self.ai_response_chars,
+                             self.slow_requests, self.sql_on_loop]
+        self._loop_warned = set()   # Uyarısı basılmış route'lar
+        self._collectors = []   # async func() -> list[str] (anlık gauge'lar)
+
+    # --- SQL ---
+    def instrument_engine(self, engine, name: str, blocking: bool = False):
+        """
+        Senkron engine'e (async için engine.sync_engine) event dinleyicileri bağlar.
+        blocking=True: engine'in sorguları thread'i bloklar; event loop thread'inde çalışırsa
+        (async route'ta senkron Session) sayılır ve route başına bir kez uyarı basılır.
+        """
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            if blocking: self._check_loop()
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            self._sql_done(conn, name)
+
+        @event.listens_for(engine, "handle_error")
+        def error(context):
+            self.sql_errors.inc(name)
+            if context.connection is not None: self._sql_done(context.connection, name)
+
+    def _check_loop(self):
+        try: asyncio.get_running_loop()
+        except RuntimeError: return   # Thread'de (run_in_threadpool, mail gönderici): sorun yok
+        req = current_request.get()
+        route = "background"
+        if req is not None:
+            route = getattr((req.scope or {}).get("route"), "path", req.route)
+        self.sql_on_loop.inc(route)
+        if route not in self._loop_warned:
+            self._loop_warned.add(route)
+            print(f"⚠️ Senkron SQL event loop'u blokluyor: {route} (AsyncSession ya da run_in_threadpool kullanılmalı)")
+
+    def _sql_done(self, conn, name: str):
+        stack = conn.info.get("query_started")
+        if not stack: return
+        elapsed = time.perf_counter() - stack.pop()
+        self.sql_seconds.observe(elapsed, name)
+        req = current_request.get()
+        if req is not None:
+            req.sql_count += 1
+            req.sql_seconds += elapsed
+
+    # --- AI ---
+    @contextmanager
+    def ai_call(self, caller: str, mode: str, prompt_size: int, prompt_tokens: int = 0):
+        """
+        AI gateway her Gemini çağrısını bununla sarar. Dönen liste: [cevap karakteri, prompt token];
+        gateway cevaptaki gerçek token sayısını ikinci elemana yazar (yoksa tahmin kalır).
+        """
+        self.ai_prompt_chars.observe(prompt_size, caller)
+        usage = [0, prompt_tokens]
+        started = time.perf_counter()
+        try:
+            yield usage
+        except Exception as e:
+            self.ai_errors.inc(caller, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.ai_seconds.observe(elapsed, caller, mode)
+            if usage[0]: self.ai_response_chars.observe(usage[0], caller)
+            if usage[1]: self.ai_prompt_tokens.observe(usage[1], caller)
+            req = current_request.get()
+            if req is not None:
+                req.ai_calls += 1
+                req.ai_seconds += elapsed
+
+    # --- FAZLAR ---
+    @contextmanager
+    def phase(self, name: str):
+        # Yavaş istek logunda ayrı görünsün istenen bölümler (ör. resim küçültme)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            req = current_request.get()
+            if req is not None: req.phases[name] = req.phases.get(name, 0.0) + time.perf_counter() - started
+
+    # --- HTTP ---
+    def request_done(self, req: RequestMetrics, method: str, status: int):
+        elapsed = time.perf_counter() - req.started
+        self.http_seconds.observe(elapsed, method, req.route, str(status))
+        self.http_sql_queries.observe(req.sql_count, req.route)
+        self.http_sql_seconds.observe(req.sql_seconds, req.route)
+        if self.slow_seconds > 0 and elapsed >= self.slow_seconds:
+            self.slow_requests.inc(req.route)
+            other = max(0.0, elapsed - req.sql_seconds - req.ai_seconds - sum(req.phases.values()))
+            phases = "".join(f" {name}={seconds * 1000:.0f}ms" for name, seconds in req.phases.items())
+            print(f"Yavaş İstek: {method} {req.route} {status} toplam={elapsed * 1000:.0f}ms "
+                  f"sql={req.sql_seconds * 1000:.0f}ms/{req.sql_count} ai={req.ai_seconds * 1000:.0f}ms/{req.ai_calls}{phases} "
+                  f"diger={other * 1000:.0f}ms")
+
+    # --- TOPLAMA ---
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    async def render(self) -> str:
+        lines = []
+        for instrument in self._instruments: lines.extend(instrument.render())
+        for collect in self._collectors:
+            try: lines.extend(await collect())
+            except Exception as e: print(f"Metrik Hata: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Saf ASGI: akış (SSE) cevaplarında süre son parça gönderilene kadar ölçülür."""
+
+    def __init__(self, app, registry: "Metrics" = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        req = RequestMetrics("unmatched", scope)
+        token = current_request.set(req)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Şablon ("/gorev-yap/{todo_id}"): ham path etiket sayısını patlatır
+            if route is not None: req.route = getattr(route, "path", req.route)
+            self.registry.request_done(req, scope["method"], status[0])
+            current_request.reset(token)
+
+
+def component_samples(component: str, stats: dict, prefix: str = "") -> list:
+    # Modüllerin stats() sözlükleri: sayılar gauge olur, iç içe sözlükler "dis.ic" anahtarıyla, metinler atlanır
+    samples = []
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            samples.extend(component_samples(component, value, f"{prefix}{key}."))
+        elif isinstance(value, (bool, int, float)):
+            samples.append(({"component": component, "key": f"{prefix}{key}"}, float(value)))
+    return samples
+
+def pool_samples(engine, name: str) -> list:
+    pool = engine.pool
+    samples = []
+    for key in ("size", "checkedin", "checkedout", "overflow"):
+        func = getattr(pool, key, None)
+        if func is not None: samples.append(({"engine": name, "state": key}, func()))
+    return samples
+
+def threadpool_samples() -> list:
+    # run_in_threadpool / to_thread'in ortak limiti (varsayılan 40 thread)
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return [({"state": "busy"}, limiter.borrowed_tokens), ({"state": "total"}, limiter.total_tokens)]
+
+def parse_networks(value: str) -> list:
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+METRICS_NETWORKS = parse_networks(METRICS_ALLOW)
+
+def metrics_allowed(authorization: Optional[str], client_host: Optional[str],
+                    token: Optional[str] = METRICS_TOKEN, networks: list = METRICS_NETWORKS) -> bool:
+    # Token eşleşirse ya da istemci izinli ağdaysa; ikisi de ayarlanmadıysa kimse
+    if token and authorization and hmac.compare_digest(authorization, f"Bearer {token}"): return True
+    if networks and client_host:
+        try: address = ipaddress.ip_address(client_host)
+        except ValueError: return False
+        return any(address in network for network in networks)
+    return False
+
+def estimate_tokens(text: str) -> int:
+    # Tokenizer'sız yaklaşık sayı (Gemini'de ~4 karakter/token); gerçek sayı cevapla gelirse o kullanılır
+    return (len(text) + 3) // 4 if text else 0
+
+def prompt_size(contents) -> int:
+    if isinstance(contents, str): return len(contents)
+    if isinstance(contents, dict): return len(contents.get("data") or b"")
+    if isinstance(contents, (list, tuple)): return sum(prompt_size(c) for c in contents)
+    return 0
+
+def caller_name(depth: int = 2) -> str:
+    # Gateway'i çağıran fonksiyonun adı (AI metriklerinin etiketi)
+    try: return sys._getframe(depth).f_code.co_name
+    except ValueError: return "unknown"
+
+
+metrics = Metrics()
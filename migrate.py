@@ -0,0 +1,14 @@
+"""
+Şema kontrolü (eksik tablo / sütun / index): deploy adımında, uygulama açılmadan önce bir kez.
+    python migrate.py
+Uygulama import'unda çalışmaz; tek süreçli geliştirme ortamında AUTO_MIGRATE=1 ile lifespan'de de çalışabilir.
+"""
+import time
+
+from database import sync_schema
+import models  # noqa: F401  (tablolar Base.metadata'ya kayıtlı olsun)
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    sync_schema()
+    print(f"✅ Şema güncel ({time.perf_counter() - started:.2f} sn)")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Date, Text, JSON
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Date, Text, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -19,6 +19,9 @@ class User(Base):
     streak = Column(Integer, default=0)
     last_active_date = Column(Date, nullable=True)
 
+    # Eski /sync sayacı: artık user_sync_versions'ta; ilk artışta oraya başlangıç değeri olarak taşınır
+    sync_version = Column(Integer, default=0)
+
     target = relationship("UserTarget", back_populates="user", uselist=False)
     todos = relationship("Todo", back_populates="user")
     exam_results = relationship("ExamResult", back_populates="user")
@@ -35,6 +38,8 @@ class UserTarget(Base):
     dream_department = Column(String, nullable=True)
     current_tyt_net = Column(Float, default=0.0)
     target_tyt_net = Column(Float, default=0.0)
+    version = Column(Integer, nullable=True)   # user_sync_versions'tan (delta_sync)
+    updated_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="target")
 
@@ -46,9 +51,17 @@ class Todo(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     content = Column(String)
     is_completed = Column(Boolean, default=False)
+    version = Column(Integer, nullable=True)   # user_sync_versions'tan (delta_sync)
+    updated_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="todos")
 
+    # Keyset sayfalama: WHERE user_id = ? AND id > ? ORDER BY id
+    __table_args__ = (
+        Index("ix_todos_user_id_id", "user_id", "id"),
+        Index("ix_todos_user_version", "user_id", "version"),  # /sync?since=
+    )
+
 # 4. DENEME SONUÇLARI
 class ExamResult(Base):
     __tablename__ = "exam_results"
@@ -69,10 +82,23 @@ class ExamResult(Base):
     topic_mistakes = Column(JSON, default={}) 
     
     ai_comment = Column(String, nullable=True)
+    # AI yorumu arka planda yazılır: pending | done | failed
+    ai_status = Column(String, default="pending")
+    # topic_mistakes exam_topic_mistakes tablosuna işlendi mi (eski kayıtlar açılışta işlenir)
+    topics_indexed = Column(Boolean, default=False)
     date = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=True)   # user_sync_versions'tan (delta_sync)
+    updated_at = Column(DateTime, nullable=True)
 
     user = relationship("User", back_populates="exam_results")
 
+    # Keyset sayfalama: WHERE user_id = ? AND (date, id) < (?, ?) ORDER BY date DESC, id DESC
+    __table_args__ = (
+        Index("ix_exam_results_user_date_id", "user_id", "date", "id"),
+        Index("ix_exam_results_user_tyt_net", "user_id", "tyt_net"),  # En iyi/en kötü deneme silinince yenisini bulmak için
+        Index("ix_exam_results_user_version", "user_id", "version"),  # /sync?since=
+    )
+
 # 5. CHAT GEÇMİŞİ
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -81,6 +107,261 @@ class ChatMessage(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     user_question = Column(String)
     ai_response = Column(String)
+    prompt_tokens = Column(Integer, nullable=True)   # Bu cevap için giden prompt (tahmini; bağlam dahil)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=True)   # user_sync_versions'tan (delta_sync)
+    updated_at = Column(DateTime, nullable=True)
+
+    user = relationship("User", back_populates="chat_history")
+
+    __table_args__ = (
+        Index("ix_chat_messages_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_chat_messages_user_version", "user_id", "version"),  # /sync?since=
+    )
+
+# 6. AI CEVAP CACHE'İ (Ortak backend: birden fazla worker aynı tabloyu okur)
+class AIResponseCache(Base):
+    __tablename__ = "ai_response_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(64), unique=True, index=True)
+    value = Column(Text)
+    expires_at = Column(DateTime, index=True)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# 7. ÇÖZÜLMÜŞ SORULAR (Fotoğrafın algısal hash'i ile aynı soruyu tekrar çözmemek için)
+class SolvedQuestion(Base):
+    __tablename__ = "solved_questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    phash = Column(String(16), index=True)
+    # Hash'in 8 bitlik parçaları, yakın eşleşme adaylarını indeksten bulmak için
+    band0 = Column(Integer, index=True)
+    band1 = Column(Integer, index=True)
+    band2 = Column(Integer, index=True)
+    band3 = Column(Integer, index=True)
+    band4 = Column(Integer, index=True)
+    band5 = Column(Integer, index=True)
+    band6 = Column(Integer, index=True)
+    band7 = Column(Integer, index=True)
+    fine_hash = Column(String(256))   # 1024 bitlik ikinci hash: aday ancak bununla da yakınsa sunulur
+    answer = Column(Text)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# 8. ARKA PLAN İŞLERİ (Kalıcı kuyruk: süreç çökse de işler kaybolmaz)
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)
+    payload = Column(JSON, default={})
+    # pending -> running -> done | (tekrar pending) | dead
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    run_after = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_status_updated_at", "status", "updated_at"),  # Biten işlerin temizliği
+    )
+
+# 9. MAIL OUTBOX (Mailler kayıt transaction'ında yazılır, arka planda gönderilir)
+class OutboxMessage(Base):
+    __tablename__ = "mail_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String)
+    subject = Column(String)
+    body = Column(Text)
+    # pending -> sending -> sent | (tekrar pending) | dead
+    status = Column(String, default="pending", index=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+# 10. KONU BAZLI YANLIŞLAR (topic_mistakes JSON'unun normalize hali, deneme başına konu başına bir satır)
+class ExamTopicMistake(Base):
+    __tablename__ = "exam_topic_mistakes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    exam_id = Column(Integer, ForeignKey("exam_results.id"), index=True)
+    topic = Column(String)
+    count = Column(Integer, default=0)
+    exam_date = Column(DateTime)  # Pencere sorguları join'siz çalışsın diye denemeden kopya
+
+    __table_args__ = (
+        Index("ix_exam_topic_mistakes_user_date", "user_id", "exam_date"),
+        Index("ix_exam_topic_mistakes_topic_user", "topic", "user_id"),  # Kohort analizi
+    )
+
+# 11. KULLANICI x KONU TOPLAMI (Deneme ekleme/silmede aynı transaction'da güncellenir)
+class UserTopicStat(Base):
+    __tablename__ = "user_topic_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    topic = Column(String)
+    total_count = Column(Integer, default=0)
+    exam_count = Column(Integer, default=0)
+    # Zamanla sönümlenen ağırlık: decayed_score, decay_ref anına göre tutulur
+    decayed_score = Column(Float, default=0.0)
+    decay_ref = Column(DateTime, nullable=True)
+    last_seen_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (UniqueConstraint("user_id", "topic", name="uq_user_topic_stats_user_topic"),)
+
+# 12. KULLANICI DENEME ÖZETİ (/istatistikler bunu okur; deneme ekleme/silmede artımlı güncellenir)
+class UserExamStats(Base):
+    __tablename__ = "user_exam_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True)
+    ready = Column(Boolean, default=False)  # False: satır yeni açıldı, geçmişten yeniden hesaplanmalı
+    exam_count = Column(Integer, default=0)
+    # Doğrusal eğilim için toplamlar (x = gün): Σx, Σx², ve ders başına {"tyt_mat": [Σy, Σxy], ...}
+    sum_x = Column(Float, default=0.0)
+    sum_xx = Column(Float, default=0.0)
+    sums = Column(JSON, default={})
+    recent = Column(JSON, default=[])  # Son 10 deneme, eskiden yeniye: [{"id", "x", "name", <ders>: net}, ...]
+    best = Column(JSON, nullable=True)
+    worst = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# 13. XP DEFTERİ (Sadece eklenir; toplu olarak users.xp'ye "xp = xp + delta" ile işlenir)
+class XPEvent(Base):
+    __tablename__ = "xp_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    delta = Column(Integer)
+    reason = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime, nullable=True)  # NULL: henüz users.xp'ye işlenmedi
+
+    __table_args__ = (
+        # Bekleyen olaylar az: sadece onları indeksle (okuma: users.xp + bekleyen toplam)
+        Index("ix_xp_events_pending_user", "user_id", postgresql_where=applied_at.is_(None), sqlite_where=applied_at.is_(None)),
+        Index("ix_xp_events_applied_at", "applied_at"),
+    )
+
+# 14. HAZIR PLANLAR (Gece toplu üretilir, /plan-olustur varsa anında bunu verir)
+class StagedPlan(Base):
+    __tablename__ = "staged_plans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    plan_date = Column(Date)
+    tasks = Column(JSON, default=[])
+    run_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    consumed_at = Column(DateTime, nullable=True)  # NULL: henüz verilmedi
+
+    __table_args__ = (UniqueConstraint("user_id", "plan_date", name="uq_staged_plans_user_date"),)
+
+# 15. TOPLU PLAN ÇALIŞMALARI (Günde bir satır; çöken çalışma kaldığı kullanıcıdan devam eder)
+class PlanBatchRun(Base):
+    __tablename__ = "plan_batch_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_date = Column(Date, unique=True)
+    # pending -> running -> done | (lease dolunca başka worker devralır)
+    status = Column(String, default="pending")
+    last_user_id = Column(Integer, default=0)  # Bu id'ye kadar (dahil) tüm kullanıcılar işlendi
+    eligible = Column(Integer, default=0)
+    generated = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    claim_token = Column(String(32), nullable=True)  # Sahip worker'ın çalışma başına rastgele anahtarı
+    finished_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+# 16. RATE LIMIT KOVALARI (Birden fazla worker için ortak token bucket; RATE_LIMIT_BACKEND=db)
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)   # "u:<user_id>:<route>", "u:<user_id>", "model"
+    tokens = Column(Float)
+    updated_at = Column(Float, index=True)   # Unix zamanı (worker'lar arası ortak saat)
+
+# 17. SİLİNME KAYITLARI (/sync: istemci silinen görev/denemeyi de görsün; SYNC_TOMBSTONE_DAYS sonra budanır)
+class SyncTombstone(Base):
+    __tablename__ = "sync_tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    entity = Column(String)      # "gorevler" | "denemeler"
+    entity_id = Column(Integer)
+    version = Column(Integer)    # Silindiği andaki kullanıcı sürümü (user_sync_versions)
+    deleted_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (Index("ix_sync_tombstones_user_version", "user_id", "version"),)
+
+# 17b. KULLANICI SÜRÜM SAYACI (/sync: kullanıcının verisi her değiştiğinde artar; users satırını kilitlememek için ayrı tablo)
+class UserSyncVersion(Base):
+    __tablename__ = "user_sync_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# 18. SOHBET HAFIZASI (Kullanıcı başına özet; son K mesaj chat_messages'tan, özetlenmemiş olanlar)
+class ChatMemory(Base):
+    __tablename__ = "chat_memory"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, index=True)
+    summary = Column(Text, default="")
+    summarized_until = Column(Integer, default=0)   # Bu chat_messages.id'ye kadar (dahil) özette
+    refresh_queued = Column(Boolean, default=False)  # Özet işi kuyrukta: aynı kullanıcıya ikinci iş açılmaz
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# 19. CHALLENGE HAVUZU (Rütbe + konu kovası başına önceden üretilmiş challenge'lar; /challenge-olustur buradan verir)
+class PoolChallenge(Base):
+    __tablename__ = "challenge_pool"
+
+    id = Column(Integer, primary_key=True, index=True)
+    rank = Column(String)        # calculate_level rütbesi
+    topic = Column(String)       # challenge_pool.TOPICS kovası
+    baslik = Column(String)
+    aciklama = Column(Text)
+    sure_dk = Column(Integer)
+    xp_degeri = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_challenge_pool_bucket", "rank", "topic", "id"),)
+
+# 20. CHALLENGE KOVALARI (Yeniden doldurmayı tek worker sahiplenir; claimed_at eskiyse sahiplik düşer)
+class ChallengeBucket(Base):
+    __tablename__ = "challenge_buckets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    rank = Column(String)
+    topic = Column(String)
+    claimed_at = Column(DateTime, nullable=True)
+    refilled_at = Column(DateTime, nullable=True)
+    refills = Column(Integer, default=0)
+
+    __table_args__ = (UniqueConstraint("rank", "topic", name="uq_challenge_buckets_rank_topic"),)
+
+# 21. CHALLENGE İMLEÇLERİ (Kullanıcının kovada gördüğü son challenge; sıradaki hep daha yeni id, tekrar yok)
+class ChallengeCursor(Base):
+    __tablename__ = "challenge_cursors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    rank = Column(String)
+    topic = Column(String)
+    last_id = Column(Integer, default=0)
+    served_at = Column(DateTime, default=datetime.utcnow)
 
-    user = relationship("User", back_populates="chat_history")
\ No newline at end of file
+    __table_args__ = (UniqueConstraint("user_id", "rank", "topic", name="uq_challenge_cursors_user_bucket"),
+                      Index("ix_challenge_cursors_bucket_last", "rank", "topic", "last_id"))
@@ -0,0 +1,79 @@
+import json
+import base64
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# --- AYARLAR ---
+PAGE_MAX_LIMIT = 200
+
+
+def encode_cursor(values: list) -> str:
+    # Son satırın sıralama anahtarı; istemci için opak, satır silinse de geçerli kalır
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def cursor_value(column, value):
+    # Her değer kendi sütununun tipinde olmalı: yanlış tipli cursor sorguya ulaşıp 500 vermesin
+    kind = column.type.python_type
+    if kind is datetime:
+        if not isinstance(value, str): raise ValueError
+        return datetime.fromisoformat(value)
+    if kind is int:
+        if isinstance(value, bool) or not isinstance(value, int): raise ValueError
+        return value
+    if kind is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)): raise ValueError
+        return float(value)
+    if not isinstance(value, kind): raise ValueError
+    return value
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns): raise ValueError
+        return [cursor_value(c, v) for c, v in zip(columns, values)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Geçersiz cursor.")
+
+def parse_fields(fields: Optional[str], allowed: tuple, default: tuple) -> tuple:
+    if not fields: return default
+    wanted = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in wanted if f not in allowed]
+    if unknown: raise HTTPException(status_code=400, detail=f"Bilinmeyen alan: {', '.join(unknown)}")
+    return wanted
+
+
+async def keyset_page(db: AsyncSession, model, where: list, order_by: list, fields: tuple,
+                      cursor: Optional[str], limit: int, newest_first: bool = False):
+    """
+    (sıralama sütunları..., id) üzerinde keyset sayfalama. OFFSET yok: her sayfa
+    (user_id, sıralama, id) indeksinde tek aralık taraması, derin sayfalar da O(sayfa).
+    newest_first: sayfalar geriye doğru ilerler, sayfa içi sıra yine eskiden yeniye.
+    Sadece istenen sütunlar okunur (topic_mistakes gibi büyük alanlar istenmezse gelmez).
+    """
+    limit = max(1, min(limit, PAGE_MAX_LIMIT))
+    keys = [getattr(model, c) for c in order_by]
+    columns = list(dict.fromkeys([getattr(model, f) for f in fields] + keys))
+
+    query = select(*columns).where(*where)
+    if cursor:
+        after = decode_cursor(cursor, keys)
+        query = query.where(tuple_(*keys) < tuple_(*after) if newest_first else tuple_(*keys) > tuple_(*after))
+    query = query.order_by(*[k.desc() if newest_first else k.asc() for k in keys]).limit(limit + 1)
+
+    rows = (await db.execute(query)).mappings().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor([rows[-1][k.key] for k in keys]) if has_more else None
+    if newest_first: rows = rows[::-1]
+    return [{f: row[f] for f in fields} for row in rows], next_cursor
+
+def set_next_cursor(request: Request, response: Response, next_cursor: Optional[str]):
+    # Gövde eskisi gibi liste kalır (mobil istemci bozulmaz), sonraki sayfa header'da
+    if next_cursor is None: return
+    response.headers["X-Next-Cursor"] = next_cursor
+    response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
@@ -0,0 +1,107 @@
+import os
+import time
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# --- AYARLAR ---
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))                     # Work factor: her +1 süreyi ikiye katlar
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))  # Bekleyen iş sınırı, aşılırsa 503
+PASSWORD_HASH_BUDGET_MS = float(os.getenv("PASSWORD_HASH_BUDGET_MS", "250"))
+
+
+def normalize_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+def make_context(rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+# Process havuzunda çalışan fonksiyonlar (pickle edilebilmeleri için modül seviyesinde)
+_contexts = {}
+
+def _context(rounds: int) -> CryptContext:
+    ctx = _contexts.get(rounds)
+    if ctx is None:
+        ctx = _contexts[rounds] = make_context(rounds)
+    return ctx
+
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(normalize_password(password))
+
+def _verify(password: str, hashed: str, rounds: int):
+    # (doğru mu, work factor değiştiyse yeni hash)
+    ctx = _context(rounds)
+    normalized = normalize_password(password)
+    if not ctx.verify(normalized, hashed): return False, None
+    return True, (ctx.hash(normalized) if ctx.needs_update(hashed) else None)
+
+
+def calibrate_rounds(budget_ms: float = PASSWORD_HASH_BUDGET_MS, low: int = 8, high: int = 14) -> int:
+    """Tek çekirdekte bir hash'in bütçeyi aşmadığı en yüksek work factor."""
+    best = low
+    for rounds in range(low, high + 1):
+        started = time.perf_counter()
+        _hash("calibration", rounds)
+        if (time.perf_counter() - started) * 1000 > budget_ms: break
+        best = rounds
+    return best
+
+
+class PasswordHasher:
+    """
+    bcrypt hash/verify işlerini ayrı process'lerde çalıştırır (GIL'e takılmaz,
+    threadpool'u tutmaz). Kuyruk dolunca yeni istekler 503 ile reddedilir.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.rejected = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: çocuk process sadece bu modülü yükler, uygulamanın thread'lerini kopyalamaz
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def _submit(self, func, *args):
+        if self._pending >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Sunucu şu an çok yoğun, birazdan tekrar dene.", headers={"Retry-After": "2"})
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self.workers <= 0:
+                return await loop.run_in_executor(None, func, *args)  # Havuz kapalı: geliştirme ortamı
+            return await loop.run_in_executor(self._get_pool(), func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str):
+        """(doğru mu, gerekirse yeniden hesaplanmış hash) döner."""
+        return await self._submit(_verify, password, hashed, self.rounds)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {"pending": self._pending, "workers": self.workers, "max_queue": self.max_queue, "rejected": self.rejected, "rounds": self.rounds}
+
+
+password_hasher = PasswordHasher()
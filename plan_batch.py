@@ -0,0 +1,285 @@
+import os
+import time
+import uuid
+import asyncio
+from datetime import datetime, date, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update, delete, func, exists, or_, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, IS_SQLITE
+from ai_gateway import gateway
+from auth_cache import Principal
+from xp_ledger import pending_xp
+import models as models
+
+# --- AYARLAR ---
+PLAN_BATCH_HOUR = int(os.getenv("PLAN_BATCH_HOUR", "3"))                    # Sabah yoğunluğundan önce (yerel saat)
+PLAN_BATCH_CONCURRENCY = int(os.getenv("PLAN_BATCH_CONCURRENCY", "4"))      # AI_MAX_CONCURRENCY'nin altında kalsın
+PLAN_BATCH_PAGE = int(os.getenv("PLAN_BATCH_PAGE", "200"))                  # Defter her sayfa sonunda ilerler
+PLAN_BATCH_RETRIES = int(os.getenv("PLAN_BATCH_RETRIES", "3"))
+PLAN_BATCH_RETRY_BASE_SECONDS = float(os.getenv("PLAN_BATCH_RETRY_BASE_SECONDS", "5"))  # 5s, 10s, 20s
+PLAN_BATCH_ACTIVE_DAYS = int(os.getenv("PLAN_BATCH_ACTIVE_DAYS", "7"))      # Bu süredir girmeyenlere kota harcama
+PLAN_BATCH_LEASE_SECONDS = int(os.getenv("PLAN_BATCH_LEASE_SECONDS", "900"))  # Heartbeat bu kadar eskiyse çalışma çökmüş sayılır
+
+
+def parse_plan_tasks(raw_text: str) -> list:
+    # Temizleme: madde işaretleri atılır, kısa/boş satırlar elenir, en fazla 4 görev
+    clean_tasks = []
+    for line in raw_text.strip().split("\n"):
+        line = line.strip()
+        if len(line) < 10: continue
+        cleaned_line = line.replace("* ", "").strip()
+        if cleaned_line.startswith("- "): cleaned_line = cleaned_line[2:]
+        clean_tasks.append(cleaned_line)
+    return clean_tasks[:4]
+
+async def discard(db: AsyncSession, user_id: int):
+    # Yeni deneme eksik konuları değiştirdi: bekleyen hazır plan bayat, istekte yeniden üretilsin
+    await db.execute(delete(models.StagedPlan).where(models.StagedPlan.user_id == user_id, models.StagedPlan.consumed_at.is_(None)))
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.StagedPlan).where(models.StagedPlan.user_id == user_id))
+
+
+class PlanStager:
+    """
+    Görevlerini bitirmiş aktif kullanıcılar için günlük planı gece toplu üretir (staged_plans).
+    /plan-olustur önce buradan alır, yoksa eskisi gibi anında üretir.
+    plan_batch_runs günlük defterdir: çalışmayı tek worker sahiplenir, kaldığı kullanıcıdan devam edilir.
+    Sahiplik claim_token'dadır; heartbeat zamanlayıcıyla atılır, defteri ancak token'ı tutan worker ilerletir.
+    Lease başka worker'a geçince eski worker yeni AI çağrısı başlatmaz.
+    """
+
+    def __init__(self, concurrency: int = PLAN_BATCH_CONCURRENCY, page_size: int = PLAN_BATCH_PAGE,
+                 retries: int = PLAN_BATCH_RETRIES, retry_base: float = PLAN_BATCH_RETRY_BASE_SECONDS,
+                 active_days: int = PLAN_BATCH_ACTIVE_DAYS, lease: int = PLAN_BATCH_LEASE_SECONDS,
+                 session_factory=AsyncSessionLocal, ai=gateway):
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.retries = retries
+        self.retry_base = retry_base
+        self.active_days = active_days
+        self.lease = lease
+        self.session_factory = session_factory
+        self.ai = ai
+        self._build_prompt = None   # async func(db, Principal) -> str (main.py'deki /plan-olustur promptu)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight = 0
+        self.running_date = None
+        self.processed = 0
+        self.generated = 0
+        self.failed = 0
+        self.retried = 0
+        self.served = 0
+        self.misses = 0
+        self.runs = 0
+        self.leases_lost = 0
+        self.last_run_seconds = 0.0
+
+    def prompt_builder(self, func):
+        # İstekteki promptun aynısı kullanılsın diye main.py kayıt eder
+        self._build_prompt = func
+        return func
+
+    def start(self, scheduler, hour: int = PLAN_BATCH_HOUR):
+        scheduler.add_job(self.run, "cron", hour=hour, id="plan-batch", max_instances=1, coalesce=True, misfire_grace_time=3600)
+        # Açılışta ve lease aralığıyla: bugünün yarım kalan (çökmüş) çalışması varsa devral
+        scheduler.add_job(self.resume, "interval", seconds=self.lease, id="plan-batch-resume", max_instances=1, coalesce=True,
+                          next_run_time=datetime.now())
+
+    # --- İSTEK TARAFI ---
+    async def take(self, db: AsyncSession, user_id: int, today: Optional[date] = None) -> Optional[list]:
+        """Bugünün hazır planını sahiplenir (commit çağıranın işi: görevlerle aynı transaction)."""
+        today = today or date.today()
+        staged = (await db.execute(select(models.StagedPlan.id, models.StagedPlan.tasks)
+                                   .where(models.StagedPlan.user_id == user_id, models.StagedPlan.plan_date == today,
+                                          models.StagedPlan.consumed_at.is_(None)))).first()
+        if staged is not None:
+            # Koşullu UPDATE: aynı planı iki paralel istek alamaz
+            claimed = await db.execute(update(models.StagedPlan).where(models.StagedPlan.id == staged.id, models.StagedPlan.consumed_at.is_(None))
+                                       .values(consumed_at=datetime.utcnow()))
+            if claimed.rowcount == 1 and staged.tasks:
+                self.served += 1
+                return list(staged.tasks)
+        self.misses += 1
+        return None
+
+    # --- TOPLU ÜRETİM ---
+    async def resume(self):
+        today = date.today()
+        try:
+            async with self.session_factory() as db:
+                status = await db.scalar(select(models.PlanBatchRun.status).where(models.PlanBatchRun.run_date == today))
+        except Exception as e:
+            print(f"Plan Batch Hata: {e}")
+            return
+        if status is not None and status != "done": await self.run(today)
+
+    async def run(self, run_date: Optional[date] = None) -> Optional[int]:
+        run_date = run_date or date.today()
+        if self._build_prompt is None or not self.ai.enabled: return None
+        try:
+            run = await self._claim_run(run_date)
+        except Exception as e:
+            print(f"Plan Batch Hata: {e}")
+            return None
+        if run is None: return None  # Başka worker çalıştırıyor ya da bugün bitti
+
+        started = time.perf_counter()
+        self.running_date = run_date
+        self.processed = self.generated = self.failed = 0
+        run_id, after, token = run
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._keep_alive(run_id, token, lost))
+        try:
+            while True:
+                page = await self._eligible(run_date, after)
+                if not page:
+                    await self._finish(run_id, token)
+                    break
+                results = await asyncio.gather(*(self._generate(run_id, run_date, p, lost) for p in page))
+                if lost.is_set(): break  # Lease kaybedildi: sayfa yarım, yeni sahip kaldığı yerden alır
+                ok = sum(1 for r in results if r)
+                self.processed += len(page)
+                self.generated += ok
+                self.failed += len(page) - ok
+                after = page[-1].id
+                if not await self._advance(run_id, token, after, len(page), ok): break  # Lease kaybedildi
+        except Exception as e:
+            print(f"Plan Batch Hata: {e}")
+            await self._record_error(run_id, token, str(e))
+        finally:
+            heartbeat.cancel()
+            self.running_date = None
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - started
+        return run_id
+
+    async def _claim_run(self, run_date: date) -> Optional[tuple]:
+        runs = models.PlanBatchRun
+        async with self.session_factory() as db:
+            insert = sqlite_insert if IS_SQLITE else pg_insert
+            await db.execute(insert(runs).values(run_date=run_date, status="pending", last_user_id=0, eligible=0, generated=0, failed=0)
+                             .on_conflict_do_nothing(index_elements=["run_date"]))
+            now, token = datetime.utcnow(), uuid.uuid4().hex
+            # Bekleyen ya da heartbeat'i eskimiş (çökmüş) çalışma sahiplenilir
+            claimed = await db.execute(update(runs).where(runs.run_date == run_date, or_(
+                runs.status == "pending",
+                and_(runs.status == "running", runs.heartbeat_at < now - timedelta(seconds=self.lease))))
+                .values(status="running", started_at=func.coalesce(runs.started_at, now), heartbeat_at=now, claim_token=token))
+            if claimed.rowcount != 1:
+                await db.rollback()
+                return None
+            row = (await db.execute(select(runs.id, runs.last_user_id).where(runs.run_date == run_date))).first()
+            await db.commit()
+        return row.id, row.last_user_id or 0, token
+
+    async def _heartbeat(self, run_id: int, token: str) -> bool:
+        runs = models.PlanBatchRun
+        async with self.session_factory() as db:
+            result = await db.execute(update(runs).where(runs.id == run_id, runs.status == "running", runs.claim_token == token)
+                                      .values(heartbeat_at=datetime.utcnow()))
+            await db.commit()
+        return result.rowcount == 1
+
+    async def _keep_alive(self, run_id: int, token: str, lost: asyncio.Event):
+        # Sayfa süresinden bağımsız: lease'in üçte birinde bir; sahiplik gittiyse lost kurulur
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                owned = await self._heartbeat(run_id, token)
+            except Exception as e:
+                print(f"Plan Batch Heartbeat Hata: {e}")
+                continue
+            if not owned:
+                self.leases_lost += 1
+                lost.set()
+                return
+
+    async def _eligible(self, run_date: date, after: int) -> list:
+        # Açık görevi olmayan, son günlerde aktif, bugünün planı henüz üretilmemiş kullanıcılar (id sırasıyla)
+        users = models.User
+        unfinished = exists().where(models.Todo.user_id == users.id, models.Todo.is_completed == False)
+        staged = exists().where(models.StagedPlan.user_id == users.id, models.StagedPlan.plan_date == run_date)
+        async with self.session_factory() as db:
+            rows = (await db.execute(select(users, pending_xp(users.id)).options(joinedload(users.target))
+                                     .where(users.id > after, users.is_active == True,
+                                            users.last_active_date >= run_date - timedelta(days=self.active_days),
+                                            ~unfinished, ~staged)
+                                     .order_by(users.id).limit(self.page_size))).all()
+        return [Principal.from_user(user, pending) for user, pending in rows]
+
+    async def _generate(self, run_id: int, run_date: date, user: Principal, lost: asyncio.Event) -> bool:
+        async with self._semaphore:
+            if lost.is_set(): return False  # Çalışma artık başka worker'da
+            self._in_flight += 1
+            try:
+                async with self.session_factory() as db:
+                    prompt = await self._build_prompt(db, user)
+                # AI beklenirken DB bağlantısı tutulmaz
+                for attempt in range(self.retries + 1):
+                    if lost.is_set(): return False
+                    try:
+                        raw_text = await self.ai.generate(prompt)
+                        break
+                    except Exception:
+                        if attempt == self.retries: raise
+                        self.retried += 1
+                        await asyncio.sleep(self.retry_base * 2 ** attempt)
+                tasks = parse_plan_tasks(raw_text)
+                if not tasks: return False
+
+                async with self.session_factory() as db:
+                    insert = sqlite_insert if IS_SQLITE else pg_insert
+                    await db.execute(insert(models.StagedPlan).values(user_id=user.id, plan_date=run_date, tasks=tasks, run_id=run_id)
+                                     .on_conflict_do_nothing(index_elements=["user_id", "plan_date"]))
+                    await db.commit()
+                return True
+            except Exception as e:
+                print(f"Plan Batch Hata ({user.id}): {e}")
+                return False
+            finally:
+                self._in_flight -= 1
+
+    async def _advance(self, run_id: int, token: str, last_user_id: int, eligible: int, generated: int) -> bool:
+        runs = models.PlanBatchRun
+        async with self.session_factory() as db:
+            result = await db.execute(update(runs).where(runs.id == run_id, runs.status == "running", runs.claim_token == token)
+                                      .values(last_user_id=last_user_id, eligible=runs.eligible + eligible,
+                                              generated=runs.generated + generated, failed=runs.failed + eligible - generated,
+                                              heartbeat_at=datetime.utcnow()))
+            await db.commit()
+        return result.rowcount == 1
+
+    async def _finish(self, run_id: int, token: str):
+        runs = models.PlanBatchRun
+        async with self.session_factory() as db:
+            # Çöküp yeniden başlayan çalışmada sayaçlar kaymış olabilir: üretilen sayısı tablodan
+            generated = select(func.count(models.StagedPlan.id)).where(models.StagedPlan.run_id == run_id).scalar_subquery()
+            await db.execute(update(runs).where(runs.id == run_id, runs.claim_token == token)
+                             .values(status="done", generated=generated, finished_at=datetime.utcnow(), heartbeat_at=datetime.utcnow()))
+            await db.commit()
+
+    async def _record_error(self, run_id: int, token: str, error: str):
+        # Durum "running" kalır: lease dolunca (ya da yeniden açılışta) kaldığı yerden devam edilir
+        try:
+            async with self.session_factory() as db:
+                await db.execute(update(models.PlanBatchRun).where(models.PlanBatchRun.id == run_id, models.PlanBatchRun.claim_token == token)
+                                 .values(last_error=error[:2000]))
+                await db.commit()
+        except Exception as e:
+            print(f"Plan Batch Hata: {e}")
+
+    def stats(self):
+        return {"running_date": self.running_date.isoformat() if self.running_date else None, "processed": self.processed,
+                "generated": self.generated, "failed": self.failed, "retried": self.retried, "in_flight": self._in_flight,
+                "served": self.served, "misses": self.misses, "runs": self.runs, "leases_lost": self.leases_lost,
+                "last_run_seconds": self.last_run_seconds}
+
+
+plan_stager = PlanStager()
@@ -0,0 +1,174 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import OrderedDict, defaultdict
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, delete, case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import AsyncSessionLocal, IS_SQLITE
+import models as models
+
+# --- AYARLAR ---
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")   # "memory" (worker başına) veya "db" (worker'lar arası ortak)
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+RATE_LIMIT_PRUNE_SECONDS = int(os.getenv("RATE_LIMIT_PRUNE_SECONDS", "600"))
+# Rütbe (calculate_level) -> [burst, dakikada istek]: her AI route'u için kullanıcı başına ayrı kova
+RATE_LIMIT_RANKS = {"Çaylak": [4, 2], "Çırak": [5, 3], "Kalfa": [6, 4], "Usta": [8, 5], "YKS LORDU": [10, 6],
+                    **json.loads(os.getenv("RATE_LIMIT_RANKS", "{}"))}
+RATE_LIMIT_USER_FACTOR = float(os.getenv("RATE_LIMIT_USER_FACTOR", "2"))   # Kullanıcının tüm AI route'ları toplamı: route limitinin bu katı
+# Modelin ortak bütçesi (tüm kullanıcılar + gece işleri): Gemini kotasının biraz altında tut. 0 = kapalı
+AI_QUOTA_PER_MINUTE = float(os.getenv("AI_QUOTA_PER_MINUTE", "0"))
+AI_QUOTA_BURST = float(os.getenv("AI_QUOTA_BURST", str(max(AI_QUOTA_PER_MINUTE / 6, 1))))
+
+
+def refill(tokens: float, updated_at: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+# --- BACKENDLER ---
+# take(): izin verildiyse 0, verilmediyse kaç saniye sonra yeterli jeton olacağı
+class MemoryBackend:
+    """Tek process içinde. Birden fazla worker varsa limitler worker başına uygulanır."""
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._data = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._data.get(key, (capacity, now))
+            tokens = refill(tokens, updated_at, capacity, rate, now)
+            allowed = tokens >= cost
+            self._data[key] = (tokens - cost if allowed else tokens, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_buckets:
+                self._data.popitem(last=False)  # En eski kova: uzun süredir dolu, silmek limiti değiştirmez
+        return 0.0 if allowed else (cost - tokens) / rate
+
+    async def refund(self, key: str, capacity: float, cost: float = 1):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None: self._data[key] = (min(capacity, item[0] + cost), item[1])
+
+    async def prune(self, idle_seconds: float):
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            for key in [k for k, (_, updated_at) in self._data.items() if updated_at < cutoff]:
+                del self._data[key]
+
+    async def size(self) -> int:
+        return len(self._data)
+
+
+class DBBackend:
+    """Ortak tablo: jeton hesabı tek koşullu UPDATE içinde, worker'lar arasında yarış yok."""
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float = 1) -> float:
+        buckets = models.RateLimitBucket
+        now = time.time()
+        refilled = buckets.tokens + (now - buckets.updated_at) * rate
+        tokens = case((refilled > capacity, capacity), else_=refilled)
+        async with self.session_factory() as db:
+            taken = await db.execute(update(buckets).where(buckets.key == key, tokens >= cost)
+                                     .values(tokens=tokens - cost, updated_at=now))
+            if taken.rowcount == 0:
+                # Kova yoksa dolu açılır; varsa jeton yetmedi
+                insert = sqlite_insert if IS_SQLITE else pg_insert
+                created = await db.execute(insert(buckets).values(key=key, tokens=capacity - cost, updated_at=now)
+                                           .on_conflict_do_nothing(index_elements=["key"]))
+                if created.rowcount == 0:
+                    row = (await db.execute(select(buckets.tokens, buckets.updated_at).where(buckets.key == key))).first()
+                    await db.commit()
+                    return (cost - refill(row.tokens, row.updated_at, capacity, rate, now)) / rate
+            await db.commit()
+        return 0.0
+
+    async def refund(self, key: str, capacity: float, cost: float = 1):
+        buckets = models.RateLimitBucket
+        async with self.session_factory() as db:
+            await db.execute(update(buckets).where(buckets.key == key)
+                             .values(tokens=case((buckets.tokens + cost > capacity, capacity), else_=buckets.tokens + cost)))
+            await db.commit()
+
+    async def prune(self, idle_seconds: float):
+        async with self.session_factory() as db:
+            await db.execute(delete(models.RateLimitBucket).where(models.RateLimitBucket.updated_at < time.time() - idle_seconds))
+            await db.commit()
+
+    async def size(self) -> int:
+        async with self.session_factory() as db:
+            return await db.scalar(select(func.count(models.RateLimitBucket.key)))
+
+
+# --- LIMITER ---
+class RateLimiter:
+    """
+    AI route'ları için token bucket: kullanıcı x route, kullanıcı toplamı ve modelin ortak bütçesi.
+    Kullanıcı limitleri rütbeye göre (RATE_LIMIT_RANKS). Aşılınca 429 + Retry-After.
+    """
+
+    def __init__(self, backend, ranks: dict = RATE_LIMIT_RANKS, user_factor: float = RATE_LIMIT_USER_FACTOR,
+                 quota_per_minute: float = AI_QUOTA_PER_MINUTE, quota_burst: float = AI_QUOTA_BURST):
+        self.backend = backend
+        self.ranks = ranks
+        self.user_factor = user_factor
+        self.quota_per_minute = quota_per_minute
+        self.quota_burst = quota_burst
+        self.allowed = defaultdict(int)
+        self.denied = defaultdict(int)   # route -> reddedilen (model bütçesi için "model")
+
+    def limits(self, rank: str) -> tuple:
+        burst, per_minute = self.ranks.get(rank) or self.ranks["Çaylak"]
+        return float(burst), per_minute / 60.0
+
+    async def check(self, user_id: int, rank: str, route: str, cost: float = 1):
+        burst, rate = self.limits(rank)
+        route_key, user_key = f"u:{user_id}:{route}", f"u:{user_id}"
+        wait = await self.backend.take(route_key, burst, rate, cost)
+        if not wait:
+            wait = await self.backend.take(user_key, burst * self.user_factor, rate * self.user_factor, cost)
+            if wait: await self.backend.refund(route_key, burst, cost)  # Reddedilen istek route kovasından düşmesin
+        if wait:
+            self.denied[route] += 1
+            raise HTTPException(status_code=429, detail="Çok sık istek attın, biraz bekle.",
+                                headers={"Retry-After": str(max(1, math.ceil(wait)))})
+        self.allowed[route] += 1
+
+    async def model_quota(self, cost: float = 1):
+        """Gemini'ye giden her çağrıdan önce (AI gateway); cache'ten dönen cevaplar bütçe harcamaz."""
+        if self.quota_per_minute <= 0: return
+        wait = await self.backend.take("model", self.quota_burst, self.quota_per_minute / 60.0, cost)
+        if wait:
+            self.denied["model"] += 1
+            raise HTTPException(status_code=503, detail="AI kotası doldu, birazdan tekrar dene.",
+                                headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+    def start(self, scheduler, interval: int = RATE_LIMIT_PRUNE_SECONDS):
+        scheduler.add_job(self.prune, "interval", seconds=interval, id="rate-limit-prune", max_instances=1, coalesce=True)
+
+    async def prune(self):
+        # En yavaş kova bu sürede dolar; daha uzun süredir dokunulmayan kova "yok" ile aynı
+        slowest = max(burst * self.user_factor / (per_minute / 60.0) for burst, per_minute in self.ranks.values())
+        try:
+            await self.backend.prune(max(slowest, self.quota_burst * 60.0 / self.quota_per_minute if self.quota_per_minute > 0 else 0))
+        except Exception as e:
+            print(f"Rate Limit Prune Hata: {e}")
+
+    async def stats(self):
+        return {"allowed": dict(self.allowed), "denied": dict(self.denied), "buckets": await self.backend.size()}
+
+
+def make_backend(kind: str = RATE_LIMIT_BACKEND):
+    return DBBackend() if kind == "db" else MemoryBackend()
+
+rate_limiter = RateLimiter(make_backend())
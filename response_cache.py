@@ -0,0 +1,147 @@
+import os
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, delete, func
+
+from database import AsyncSessionLocal
+import models as models
+
+# --- AYARLAR ---
+AI_CACHE_BACKEND = os.getenv("AI_CACHE_BACKEND", "memory")   # "memory" veya "db" (birden fazla worker için)
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", str(60 * 60 * 24 * 7)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+
+
+def turkish_casefold(text: str) -> str:
+    # Python'un lower()'ı "I" -> "i" yapar, Türkçede "I" -> "ı", "İ" -> "i" olmalı
+    return text.replace("I", "ı").replace("İ", "i").lower()
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFC", turkish_casefold(text))
+    # Harf, rakam ve boşluk dışındaki her şeyi (noktalama, emoji) at
+    text = "".join(ch if ch.isspace() or unicodedata.category(ch)[0] in "LN" else " " for ch in text)
+    return " ".join(text.split())
+
+def make_key(namespace: str, question: str) -> Optional[str]:
+    normalized = normalize_question(question)
+    if not normalized: return None
+    return hashlib.sha256(f"{namespace}:{normalized}".encode("utf-8")).hexdigest()
+
+
+# --- BACKENDLER ---
+class MemoryBackend:
+    """Tek process içinde LRU + TTL."""
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str, ttl: int):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    async def size(self) -> int:
+        return len(self._data)
+
+
+class DBBackend:
+    """Ortak tablo (SQLite/Postgres), birden fazla worker aynı cache'i kullanır."""
+
+    def __init__(self, max_entries: int = AI_CACHE_MAX_ENTRIES, session_factory=AsyncSessionLocal):
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+
+    async def get(self, key: str) -> Optional[str]:
+        async with self.session_factory() as db:
+            row = (await db.execute(select(models.AIResponseCache).where(models.AIResponseCache.key == key))).scalars().first()
+            if row is None: return None
+            now = datetime.utcnow()
+            if row.expires_at < now:
+                await db.delete(row)
+                await db.commit()
+                return None
+            row.last_hit_at = now
+            await db.commit()
+            return row.value
+
+    async def set(self, key: str, value: str, ttl: int):
+        async with self.session_factory() as db:
+            try:
+                now = datetime.utcnow()
+                row = (await db.execute(select(models.AIResponseCache).where(models.AIResponseCache.key == key))).scalars().first()
+                if row is None:
+                    row = models.AIResponseCache(key=key)
+                    db.add(row)
+                row.value = value
+                row.expires_at = now + timedelta(seconds=ttl)
+                row.last_hit_at = now
+                await db.commit()
+                await self._evict(db)
+            except Exception:
+                await db.rollback()  # Aynı anahtarı başka worker yazmış olabilir
+
+    async def _evict(self, db):
+        await db.execute(delete(models.AIResponseCache).where(models.AIResponseCache.expires_at < datetime.utcnow()))
+        count = await db.scalar(select(func.count(models.AIResponseCache.id)))
+        if count > self.max_entries:
+            # En uzun süredir kullanılmayanları sil (LRU)
+            stale_ids = (await db.execute(select(models.AIResponseCache.id).order_by(models.AIResponseCache.last_hit_at.asc()).limit(count - self.max_entries))).scalars().all()
+            await db.execute(delete(models.AIResponseCache).where(models.AIResponseCache.id.in_(stale_ids)))
+        await db.commit()
+
+    async def size(self) -> int:
+        async with self.session_factory() as db:
+            return await db.scalar(select(func.count(models.AIResponseCache.id)))
+
+
+# --- CACHE ---
+class ResponseCache:
+    def __init__(self, backend, namespace: str, ttl: int = AI_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, question: str) -> Optional[str]:
+        key = make_key(self.namespace, question)
+        value = await self.backend.get(key) if key else None
+        if value is None: self.misses += 1
+        else: self.hits += 1
+        return value
+
+    async def set(self, question: str, answer: str):
+        key = make_key(self.namespace, question)
+        if key: await self.backend.set(key, answer, self.ttl)
+
+    async def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "size": await self.backend.size()}
+
+
+def make_backend(kind: str = AI_CACHE_BACKEND):
+    return DBBackend() if kind == "db" else MemoryBackend()
+
+# Prompt metni değişirse namespace'i de değiştir ki eski cevaplar kullanılmasın
+tutor_cache = ResponseCache(make_backend(), namespace="tutor-v1")
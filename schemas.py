@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 from models import User
 
@@ -67,4 +67,59 @@ class ChatMessageBase(BaseModel):
     ai_response: str
     created_at: datetime
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# --- OKUMA UÇLARI (response_model: gövde Pydantic ile doğrudan JSON baytına yazılır) ---
+class ProfileResponse(BaseModel):
+    kullanici_adi: str
+    hedef_bolum: str
+    xp: int
+    rutbe: str
+    ilerleme: float
+    streak: int
+
+class StatsResponse(BaseModel):
+    mevcut_tyt: Optional[float] = None
+    hedef_bolum: Optional[str] = None
+    basari_orani: int = 0
+    deneme_sayisi: int = 0
+    ders_egilimi: Dict[str, float] = {}
+    hareketli_ortalama: Dict[str, Optional[Dict[str, float]]] = {}
+    en_iyi_deneme: Optional[Dict[str, Any]] = None
+    en_kotu_deneme: Optional[Dict[str, Any]] = None
+    sinav_gunu_tahmini: Dict[str, Any] = {}
+
+# Liste öğeleri: ?fields= ile istenmeyen alanlar yanıta girmez (response_model_exclude_unset)
+class TodoItem(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    content: Optional[str] = None
+    is_completed: Optional[bool] = None
+
+class ExamItem(BaseModel):
+    id: Optional[int] = None
+    user_id: Optional[int] = None
+    exam_name: Optional[str] = None
+    tyt_turkce: Optional[float] = None
+    tyt_sosyal: Optional[float] = None
+    tyt_mat: Optional[float] = None
+    tyt_fen: Optional[float] = None
+    tyt_net: Optional[float] = None
+    ayt_net: Optional[float] = None
+    topic_mistakes: Optional[Dict[str, Any]] = None
+    ai_comment: Optional[str] = None
+    ai_status: Optional[str] = None
+    date: Optional[datetime] = None
+
+class ChatItem(BaseModel):
+    id: Optional[int] = None
+    user_question: Optional[str] = None
+    ai_response: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+# --- CHALLENGE --- (AI çıktısı da bununla doğrulanır: alan eksik/aralık dışıysa havuza girmez)
+class Challenge(BaseModel):
+    baslik: str = Field(min_length=3, max_length=80)
+    aciklama: str = Field(min_length=20, max_length=600)
+    sure_dk: int = Field(ge=5, le=180)
+    xp_degeri: int = Field(ge=10, le=500)
@@ -0,0 +1,142 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, insert, delete, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, IS_SQLITE
+import models as models
+
+# --- AYARLAR ---
+TOPIC_DECAY_HALF_LIFE_DAYS = float(os.getenv("TOPIC_DECAY_HALF_LIFE_DAYS", "21"))  # 3 hafta önceki yanlış yarı ağırlıkta
+TOPIC_BACKFILL_BATCH = int(os.getenv("TOPIC_BACKFILL_BATCH", "500"))
+
+HALF_LIFE_SECONDS = TOPIC_DECAY_HALF_LIFE_DAYS * 86400
+
+
+def decay(score: float, since: datetime, until: datetime) -> float:
+    # score'u since anından until anına taşı (until > since ise azalır)
+    return score * 0.5 ** ((until - since).total_seconds() / HALF_LIFE_SECONDS)
+
+def clean_mistakes(topic_mistakes: Optional[dict]) -> dict:
+    merged = {}
+    for topic, count in (topic_mistakes or {}).items():
+        topic = str(topic).strip()
+        try: count = int(count)
+        except (TypeError, ValueError): continue
+        if topic and count > 0: merged[topic] = merged.get(topic, 0) + count
+    return merged
+
+
+async def _locked_stat(db: AsyncSession, user_id: int, topic: str) -> models.UserTopicStat:
+    query = select(models.UserTopicStat).where(models.UserTopicStat.user_id == user_id, models.UserTopicStat.topic == topic).with_for_update()
+    stat = (await db.execute(query)).scalars().first()
+    if stat is None:
+        # Aynı konuyu aynı anda iki istek açarsa biri boşa düşer, ikisi de aynı satırı kilitler
+        insert = sqlite_insert if IS_SQLITE else pg_insert
+        await db.execute(insert(models.UserTopicStat).values(user_id=user_id, topic=topic, total_count=0, exam_count=0, decayed_score=0.0)
+                         .on_conflict_do_nothing(index_elements=["user_id", "topic"]))
+        stat = (await db.execute(query)).scalars().first()
+    return stat
+
+
+async def record_exam(db: AsyncSession, exam: models.ExamResult):
+    """Denemenin yanlışlarını satırlara açar ve kullanıcı toplamlarını günceller. Commit çağıranın işi."""
+    when = exam.date or datetime.now()
+    mistakes = clean_mistakes(exam.topic_mistakes)
+    for topic in sorted(mistakes):  # Sabit sıra: eşzamanlı iki istek kilitleri aynı sırayla alır
+        count = mistakes[topic]
+        db.add(models.ExamTopicMistake(user_id=exam.user_id, exam_id=exam.id, topic=topic, count=count, exam_date=when))
+        stat = await _locked_stat(db, exam.user_id, topic)
+        stat.total_count += count
+        stat.exam_count += 1
+        if stat.decay_ref is None or when >= stat.decay_ref:
+            stat.decayed_score = decay(stat.decayed_score, stat.decay_ref or when, when) + count
+            stat.decay_ref = when
+        else:
+            stat.decayed_score += decay(count, when, stat.decay_ref)
+        stat.last_seen_at = max(stat.last_seen_at or when, when)
+    exam.topics_indexed = True
+
+def _fold(score: float, ref: Optional[datetime], count: float, when: datetime) -> tuple:
+    # Ağırlığı when anında olan count'u, ref anındaki puana ekle: (yeni puan, yeni ref)
+    if ref is None or when >= ref: return decay(score, ref or when, when) + count, when
+    return score + decay(count, when, ref), ref
+
+async def collect_bulk(db: AsyncSession, user_id: int, exams: list, totals: dict):
+    """Toplu içe aktarma, parça başına: exams = [(exam_id, tarih, topic_mistakes), ...]. Yanlış satırları tek executemany;
+    özet için konu başına [toplam, deneme sayısı, puan, ref] totals'ta birikir (bellek konu sayısı kadar)."""
+    rows = []
+    for exam_id, when, topic_mistakes in exams:
+        for topic, count in clean_mistakes(topic_mistakes).items():
+            rows.append({"user_id": user_id, "exam_id": exam_id, "topic": topic, "count": count, "exam_date": when})
+            total = totals.setdefault(topic, [0, 0, 0.0, None])
+            total[0] += count
+            total[1] += 1
+            total[2], total[3] = _fold(total[2], total[3], count, when)
+    if rows: await db.execute(insert(models.ExamTopicMistake), rows)
+
+async def apply_bulk(db: AsyncSession, user_id: int, totals: dict):
+    """collect_bulk'ta biriken toplamlar: her konunun özet satırı bir kez kilitlenip güncellenir. Commit çağıranın işi."""
+    for topic in sorted(totals):
+        count, exams, score, ref = totals[topic]
+        stat = await _locked_stat(db, user_id, topic)
+        stat.total_count += count
+        stat.exam_count += exams
+        stat.decayed_score, stat.decay_ref = _fold(stat.decayed_score, stat.decay_ref, score, ref)
+        stat.last_seen_at = max(stat.last_seen_at or ref, ref)
+
+async def remove_exam(db: AsyncSession, exam_id: int):
+    """record_exam'in tersi; deneme silinmeden önce aynı transaction'da çağrılır."""
+    rows = (await db.execute(select(models.ExamTopicMistake).where(models.ExamTopicMistake.exam_id == exam_id)
+                             .order_by(models.ExamTopicMistake.topic))).scalars().all()
+    for row in rows:
+        stat = await _locked_stat(db, row.user_id, row.topic)
+        stat.total_count -= row.count
+        stat.exam_count -= 1
+        if stat.total_count <= 0 or stat.exam_count <= 0:
+            await db.delete(stat)
+            continue
+        stat.decayed_score = max(0.0, stat.decayed_score - decay(row.count, row.exam_date, stat.decay_ref))
+    await db.execute(delete(models.ExamTopicMistake).where(models.ExamTopicMistake.exam_id == exam_id))
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.ExamTopicMistake).where(models.ExamTopicMistake.user_id == user_id))
+    await db.execute(delete(models.UserTopicStat).where(models.UserTopicStat.user_id == user_id))
+
+
+# --- OKUMA ---
+async def window_mistakes(db: AsyncSession, user_id: int, last_n: int = 3, limit: int = 5) -> list:
+    """Son N denemedeki konu toplamları, çoktan aza: [(konu, yanlış), ...]"""
+    last_exams = (select(models.ExamResult.id).where(models.ExamResult.user_id == user_id)
+                  .order_by(models.ExamResult.date.desc(), models.ExamResult.id.desc()).limit(last_n))
+    total = func.sum(models.ExamTopicMistake.count)
+    rows = await db.execute(select(models.ExamTopicMistake.topic, total)
+                            .where(models.ExamTopicMistake.exam_id.in_(last_exams))
+                            .group_by(models.ExamTopicMistake.topic).order_by(total.desc(), models.ExamTopicMistake.topic).limit(limit))
+    return [(topic, int(count)) for topic, count in rows.all()]
+
+async def decayed_mistakes(db: AsyncSession, user_id: int, limit: int = 5, now: Optional[datetime] = None) -> list:
+    """Tüm geçmiş, yeni yanlışlar ağır basar: [(konu, ağırlık), ...]"""
+    now = now or datetime.now()
+    stats = (await db.execute(select(models.UserTopicStat).where(models.UserTopicStat.user_id == user_id))).scalars().all()
+    scored = [(s.topic, decay(s.decayed_score, s.decay_ref, now)) for s in stats if s.decay_ref is not None]
+    return sorted(scored, key=lambda x: x[1], reverse=True)[:limit]
+
+
+# --- GERİYE DÖNÜK DOLDURMA ---
+async def backfill(session_factory=AsyncSessionLocal, batch: int = TOPIC_BACKFILL_BATCH) -> int:
+    # Bu tablo gelmeden önce kaydedilen denemeler; parça parça, her parça ayrı transaction
+    done = 0
+    while True:
+        async with session_factory() as db:
+            exams = (await db.execute(select(models.ExamResult).where(or_(models.ExamResult.topics_indexed.is_(None), models.ExamResult.topics_indexed == False))
+                                      .order_by(models.ExamResult.id).limit(batch).with_for_update())).scalars().all()
+            if not exams: return done
+            for exam in exams:
+                await record_exam(db, exam)
+            await db.commit()
+            done += len(exams)
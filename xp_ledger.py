@@ -0,0 +1,116 @@
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+import models as models
+
+# --- AYARLAR ---
+XP_FLUSH_SECONDS = int(os.getenv("XP_FLUSH_SECONDS", "2"))
+XP_FLUSH_BATCH = int(os.getenv("XP_FLUSH_BATCH", "1000"))
+XP_EVENT_RETENTION_DAYS = int(os.getenv("XP_EVENT_RETENTION_DAYS", "30"))  # İşlenmiş olaylar bu süre denetim için tutulur
+
+users_table = models.User.__table__
+
+
+def award(db: AsyncSession, user_id: int, delta: int, reason: str):
+    # Commit çağıranın işi: XP olayı asıl kayıtla aynı transaction'da yazılır, users satırına dokunulmaz
+    db.add(models.XPEvent(user_id=user_id, delta=delta, reason=reason))
+
+def pending_xp(user_id_column):
+    """users.xp'ye henüz işlenmemiş toplam (korele alt sorgu, kısmi indeksten okunur)."""
+    return (select(func.coalesce(func.sum(models.XPEvent.delta), 0))
+            .where(models.XPEvent.user_id == user_id_column, models.XPEvent.applied_at.is_(None))
+            .scalar_subquery())
+
+async def current_xp(db: AsyncSession, user_id: int) -> int:
+    xp = await db.scalar(select(func.coalesce(models.User.xp, 0) + pending_xp(models.User.id)).where(models.User.id == user_id))
+    return int(xp or 0)
+
+async def remove_user(db: AsyncSession, user_id: int):
+    await db.execute(delete(models.XPEvent).where(models.XPEvent.user_id == user_id))
+
+
+class XPLedger:
+    """Bekleyen XP olaylarını toplu olarak users.xp'ye işler. Her parti tek transaction."""
+
+    def __init__(self, batch_size: int = XP_FLUSH_BATCH, retention_days: int = XP_EVENT_RETENTION_DAYS,
+                 session_factory=AsyncSessionLocal):
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.session_factory = session_factory
+        self.events_applied = 0
+        self.user_updates = 0
+        self.batches = 0
+        self.conflicts = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self, scheduler, interval: int = XP_FLUSH_SECONDS):
+        scheduler.add_job(self.flush, "interval", seconds=interval, id="xp-flush", max_instances=1, coalesce=True)
+        scheduler.add_job(self.prune, "interval", hours=6, id="xp-prune", max_instances=1, coalesce=True)
+
+    async def flush(self) -> int:
+        applied = 0
+        try:
+            while True:
+                count = await self._flush_batch()
+                applied += count
+                if count < self.batch_size: return applied
+        except Exception as e:
+            print(f"XP Flush Hata: {e}")
+            return applied
+
+    async def _flush_batch(self) -> int:
+        started = time.perf_counter()
+        async with self.session_factory() as db:
+            # Postgres: başka worker'ın kilitlediği olayları atla
+            events = (await db.execute(select(models.XPEvent.id, models.XPEvent.user_id, models.XPEvent.delta)
+                                       .where(models.XPEvent.applied_at.is_(None)).order_by(models.XPEvent.id)
+                                       .limit(self.batch_size).with_for_update(skip_locked=True))).all()
+            if not events: return 0
+
+            # Koşullu UPDATE: aynı olayı iki worker işleyemez; biri kaçırırsa parti geri alınır
+            ids = [e.id for e in events]
+            marked = await db.execute(update(models.XPEvent).where(models.XPEvent.id.in_(ids), models.XPEvent.applied_at.is_(None))
+                                      .values(applied_at=datetime.utcnow()))
+            if marked.rowcount != len(ids):
+                await db.rollback()
+                self.conflicts += 1
+                return 0
+
+            totals = defaultdict(int)
+            for e in events: totals[e.user_id] += e.delta
+            # Kullanıcı sırasıyla (kilit sırası sabit), tek executemany, okuma yok
+            params = [{"b_id": user_id, "b_delta": delta} for user_id, delta in sorted(totals.items()) if delta]
+            if params:
+                await db.execute(update(users_table).where(users_table.c.id == bindparam("b_id"))
+                                 .values(xp=func.coalesce(users_table.c.xp, 0) + bindparam("b_delta")), params)
+            await db.commit()
+
+        self.events_applied += len(events)
+        self.user_updates += len(totals)
+        self.batches += 1
+        self.last_batch_seconds = time.perf_counter() - started
+        return len(events)
+
+    async def prune(self):
+        try:
+            async with self.session_factory() as db:
+                cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+                await db.execute(delete(models.XPEvent).where(models.XPEvent.applied_at < cutoff))
+                await db.commit()
+        except Exception as e:
+            print(f"XP Prune Hata: {e}")
+
+    async def stats(self) -> dict:
+        async with self.session_factory() as db:
+            pending = await db.scalar(select(func.count(models.XPEvent.id)).where(models.XPEvent.applied_at.is_(None)))
+        return {"pending_events": pending, "events_applied": self.events_applied, "user_updates": self.user_updates,
+                "batches": self.batches, "conflicts": self.conflicts, "last_batch_seconds": self.last_batch_seconds}
+
+
+xp_flusher = XPLedger()